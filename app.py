@@ -5,6 +5,11 @@ Kiến trúc MVC: Streamlit + PostgreSQL/pgvector + OpenRouter
 
 import streamlit as st
 from models.db import init_db
+from models.embedding import MODEL_NAME
+from models.embedding_cache import purge_other_models
+from models.vector_index import ensure_vector_index
+from models.law_model import backfill_chapter_numbers
+from services.answer_cache import purge_expired
 from views.upload_view import render_upload_sidebar
 from views.chat_view import render_chat_main
 
@@ -21,6 +26,14 @@ st.set_page_config(
 @st.cache_resource(show_spinner="Đang kết nối cơ sở dữ liệu...")
 def startup():
     init_db()
+    # Vector của model embedding cũ không còn dùng được
+    purge_other_models(MODEL_NAME)
+    # Tạo / build lại index vector theo VECTOR_INDEX_TYPE
+    ensure_vector_index()
+    # Dữ liệu cũ chưa có chapter_no
+    backfill_chapter_numbers()
+    # Câu trả lời đã cache quá hạn
+    purge_expired()
 
 startup()
 
@@ -0,0 +1,112 @@
+"""
+bench_reranker.py – So sánh các backend reranker trên dữ liệu thật trong DB
+
+- Benchmark: số cặp (câu hỏi, chunk) chấm được mỗi giây cho từng backend,
+  với phân bố độ dài chunk lấy ngẫu nhiên từ bảng law_documents.
+- Parity: điểm của backend ONNX int8 phải bám sát backend torch (fp32).
+- Cascade: recall@10 của bước sơ loại (top RERANK_CASCADE_TOP_N) so với
+  rerank toàn bộ ứng viên thật (vector + full-text search), kèm thời gian.
+
+Chạy: python bench_reranker.py [số_chunk]
+"""
+
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from config.rag_config import MAX_CANDIDATES_FETCH, SIM_THRESHOLD, LEXICAL_TOP_K, RERANK_CASCADE_TOP_N
+from models.embedding import get_embeddings
+from models.law_model import sample_contents, vector_search_many, lexical_search
+from services.rag_pipeline import fuse_rankings
+from services.reranker import RERANKER_MODEL, rerank, cascade_recall
+from services.reranker_backends import BACKENDS, load_backend
+
+load_dotenv()
+
+QUESTIONS = [
+    "lấy trộm xe máy bị phạt thế nào?",
+    "trốn thuế bị xử lý ra sao?",
+    "bên vay không trả nợ đúng hạn thì phải trả lãi như thế nào?",
+    "bạo lực gia đình",
+]
+# Ngưỡng parity: sai lệch điểm tuyệt đối tối đa và độ trùng top-10 tối thiểu
+MAX_ABS_DIFF = 0.1
+MIN_TOP10_OVERLAP = 0.8
+# Recall@10 tối thiểu của bước sơ loại so với rerank toàn bộ
+MIN_CASCADE_RECALL = 0.9
+
+n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+contents = sample_contents(n_chunks)
+if not contents:
+    print("FAILURE: DB chưa có dữ liệu để benchmark.")
+    sys.exit(1)
+
+lengths = np.array([len(c) for c in contents])
+print(f"Chunks: {len(contents)} · độ dài ký tự p50={np.percentile(lengths, 50):.0f} "
+      f"p90={np.percentile(lengths, 90):.0f} max={lengths.max()}")
+
+pairs = [(q, c) for q in QUESTIONS for c in contents]
+scores: dict[str, np.ndarray] = {}
+
+for name in BACKENDS:
+    try:
+        backend = load_backend(name, RERANKER_MODEL)
+    except ImportError as e:
+        print(f"[{name}] bỏ qua: {e}")
+        continue
+    backend.predict(pairs[:8])  # warm-up
+    t0 = time.time()
+    scores[name] = np.array(backend.predict(pairs))
+    elapsed = time.time() - t0
+    print(f"[{name}] {len(pairs)} pairs in {elapsed:.2f}s → {len(pairs) / elapsed:.1f} pairs/sec")
+
+if "torch" in scores and "onnx-int8" in scores:
+    ref, fast = scores["torch"], scores["onnx-int8"]
+    diff = np.abs(ref - fast)
+    overlaps = []
+    for qi in range(len(QUESTIONS)):
+        sl = slice(qi * len(contents), (qi + 1) * len(contents))
+        top_ref = set(np.argsort(-ref[sl])[:10])
+        top_fast = set(np.argsort(-fast[sl])[:10])
+        overlaps.append(len(top_ref & top_fast) / max(1, len(top_ref)))
+    print(f"Parity: max |Δ|={diff.max():.4f} · mean |Δ|={diff.mean():.4f} · top-10 overlap={np.mean(overlaps):.2f}")
+
+    if diff.max() <= MAX_ABS_DIFF and min(overlaps) >= MIN_TOP10_OVERLAP:
+        print("SUCCESS: onnx-int8 scores match torch.")
+    else:
+        print("FAILURE: onnx-int8 scores diverge from torch.")
+        sys.exit(1)
+
+# ── Cascade: recall và thời gian so với rerank toàn bộ ───────────────────────
+recalls = []
+for question in QUESTIONS:
+    vec_hits = vector_search_many(get_embeddings([question]), top_k=MAX_CANDIDATES_FETCH, threshold=SIM_THRESHOLD)
+    candidates = fuse_rankings(vec_hits, lexical_search([question], top_k=LEXICAL_TOP_K))
+    if not candidates:
+        continue
+
+    t0 = time.time()
+    rerank(question, list(candidates), score_threshold=0.0, cascade_top_n=None)
+    time_full = time.time() - t0
+    timings: dict = {}
+    t0 = time.time()
+    rerank(question, list(candidates), score_threshold=0.0, timings=timings)
+    time_cascade = time.time() - t0
+
+    recall = cascade_recall(question, list(candidates))
+    recalls.append(recall)
+    print(
+        f"[cascade] {question!r}: {timings['rerank_scored']}/{timings['rerank_candidates']} scored · "
+        f"full {time_full:.2f}s → cascade {time_cascade:.2f}s "
+        f"(stage1 {timings['rerank_stage1']:.3f}s) · recall@10={recall:.2f}"
+    )
+
+if recalls:
+    print(f"Cascade (top-{RERANK_CASCADE_TOP_N}): mean recall@10={np.mean(recalls):.2f}")
+    if min(recalls) >= MIN_CASCADE_RECALL:
+        print("SUCCESS: cascade keeps the full-rerank top-10.")
+    else:
+        print("FAILURE: cascade drops too many full-rerank top-10 chunks; raise RERANK_CASCADE_TOP_N.")
+        sys.exit(1)
@@ -9,3 +9,170 @@ RERANK_THRESHOLD = 0.6
 
 # Số lượng ứng viên tối đa lấy từ cơ sở dữ liệu để đưa vào Reranker
 MAX_CANDIDATES_FETCH = 100
+
+# ── Embedding ────────────────────────────────────────────────────────────────
+# Số đoạn văn bản gửi trong một request embedding (batch)
+EMBED_BATCH_SIZE = 64
+
+# ── Pipeline ingest (parse → embed → ghi DB) ─────────────────────────────────
+# Số batch embedding gọi API đồng thời
+INGEST_EMBED_WORKERS = 4
+# Số batch tối đa chờ trong mỗi hàng đợi giữa hai bước (backpressure)
+INGEST_QUEUE_SIZE = 4
+
+# ── Connection pool PostgreSQL ───────────────────────────────────────────────
+# Số kết nối mở sẵn khi khởi động / tối đa dùng chung cho toàn bộ process (mọi session Streamlit);
+# kết nối đã mở được giữ lại để dùng lại, không đóng sau mỗi request
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+# Thời gian tối đa (giây) chờ một kết nối rảnh trước khi báo lỗi
+DB_POOL_TIMEOUT = 10.0
+# Kết nối rảnh lâu hơn ngưỡng này (giây) sẽ được kiểm tra bằng SELECT 1 trước khi dùng
+DB_POOL_HEALTHCHECK_IDLE = 30.0
+
+# ── Embedding cache ──────────────────────────────────────────────────────────
+# Tầng 1: LRU trong process (số vector tối đa)
+EMBED_CACHE_MEMORY_SIZE = 10_000
+# Tầng 2: bảng embedding_cache trong PostgreSQL (bền qua các lần restart)
+EMBED_CACHE_PERSISTENT = True
+
+# ── Vector index (pgvector) ──────────────────────────────────────────────────
+# Loại index cho cột embedding: "hnsw" hoặc "ivfflat"
+VECTOR_INDEX_TYPE = "hnsw"
+# HNSW: tham số build và số ứng viên duyệt khi truy vấn (nên >= MAX_CANDIDATES_FETCH)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 100
+# IVFFlat: số list tính từ số dòng (rows/1000, hoặc sqrt(rows) khi > 1 triệu dòng);
+# số probes mỗi truy vấn (None = tự tính sqrt(lists))
+IVFFLAT_PROBES = None
+# Rebuild IVFFlat khi số list hiện tại lệch quá hệ số này so với số list khuyến nghị
+IVFFLAT_REBUILD_FACTOR = 2.0
+# Bộ nhớ cho lúc build index (HNSW build nhanh hơn nhiều nếu đồ thị vừa bộ nhớ)
+VECTOR_INDEX_MAINTENANCE_WORK_MEM = "512MB"
+
+# ── Hybrid retrieval (lexical + vector) ──────────────────────────────────────
+# Số kết quả tối đa từ full-text search (tsvector, không dấu)
+LEXICAL_TOP_K = 50
+# Hằng số k của Reciprocal Rank Fusion: score = Σ 1 / (k + rank)
+RRF_K = 60
+# Số ứng viên tối đa (theo điểm RRF) đưa vào Reranker, chưa tính kết quả keyword search
+RERANK_MAX_CANDIDATES = 60
+
+# ── Reranker ─────────────────────────────────────────────────────────────────
+# Backend chấm điểm: "torch" (sentence-transformers, fp32) hoặc "onnx-int8" (ONNX Runtime, int8)
+RERANKER_BACKEND = "torch"
+# Số cặp (câu hỏi, chunk) mỗi batch; các cặp được xếp theo độ dài để pad ít nhất
+RERANKER_BATCH_SIZE = 16
+RERANKER_MAX_LENGTH = 512
+# Thư mục lưu model ONNX đã export + quantize (tạo tự động lần đầu)
+RERANKER_ONNX_DIR = ".cache/reranker_onnx"
+# Số thread ONNX Runtime (0 = để ONNX Runtime tự chọn)
+RERANKER_ONNX_THREADS = 0
+# Worker dùng chung: gom các yêu cầu đồng thời trong cửa sổ này (ms) thành một batch,
+# tối đa RERANKER_WORKER_MAX_PAIRS cặp mỗi batch
+RERANKER_BATCH_WINDOW_MS = 10
+RERANKER_WORKER_MAX_PAIRS = 256
+# "host:port" của worker chạy ở process riêng (python -m services.reranker_worker);
+# None = worker là một thread trong process Streamlit hiện tại
+RERANKER_WORKER_ADDRESS = None
+# Khoá xác thực worker: lấy từ biến môi trường RERANKER_WORKER_AUTHKEY (bắt buộc khi địa chỉ không phải
+# loopback); nếu không đặt, worker local tự sinh khoá ngẫu nhiên vào file này (quyền 0600) cho client đọc
+RERANKER_WORKER_AUTHKEY_FILE = ".cache/reranker_worker.key"
+# Cascade: bước sơ loại rẻ (cosine đã có + độ trùng từ khoá) giữ top-N ứng viên,
+# chỉ top-N này được chấm bằng cross-encoder (None = tắt cascade, chấm toàn bộ)
+RERANK_CASCADE_TOP_N = 40
+# Trọng số điểm cosine (vector search) trong điểm sơ loại; phần còn lại là độ trùng từ khoá
+RERANK_CASCADE_DENSE_WEIGHT = 0.5
+# Cache điểm reranker theo (câu hỏi đã chuẩn hoá, chunk id, model): số cặp tối đa và TTL (giây)
+RERANK_CACHE_SIZE = 50_000
+RERANK_CACHE_TTL = 24 * 3600
+
+# ── Query expansion (chính sách mở rộng câu hỏi) ─────────────────────────────
+# Bỏ qua LLM khi similarity cao nhất của câu hỏi gốc đạt ngưỡng này
+EXPANSION_SKIP_SIMILARITY = 0.80
+# Chỉ xin EXPANSION_LIGHT_VARIANTS biến thể khi kết quả sơ bộ khá tốt hoặc câu hỏi dài
+EXPANSION_LIGHT_SIMILARITY = 0.65
+EXPANSION_LIGHT_VARIANTS = 2
+# Độ dài câu hỏi tính theo âm tiết: câu ngắn luôn mở rộng đủ, câu dài mở rộng ít
+EXPANSION_SHORT_QUERY_SYLLABLES = 4
+EXPANSION_LONG_QUERY_SYLLABLES = 25
+# Cache biến thể theo câu hỏi đã chuẩn hoá
+EXPANSION_CACHE_SIZE = 2_000
+EXPANSION_CACHE_TTL = 7 * 24 * 3600
+# Nhật ký quyết định (JSONL), dùng làm tập replay cho eval_expansion.py
+EXPANSION_LOG_PATH = "logs/expansion_decisions.jsonl"
+
+# ── Context cho LLM ──────────────────────────────────────────────────────────
+# Số token tối đa của phần CONTEXT trong prompt (lấy chunk theo thứ tự rerank tới khi đầy)
+CONTEXT_TOKEN_BUDGET = 6_000
+# Tokenizer tiktoken dùng khi không nhận ra model trả lời (vd. "openrouter/auto")
+CONTEXT_TOKENIZER_FALLBACK = "o200k_base"
+# Overlap tối đa (ký tự) giữa hai đoạn con liên tiếp, bằng chunk_overlap của text splitter
+CONTEXT_MAX_OVERLAP_CHARS = 200
+
+# ── HTTP client tới OpenRouter (LLM + embedding) ─────────────────────────────
+# Dùng HTTP/2 (cần gói h2: pip install "httpx[http2]")
+LLM_HTTP2 = False
+# Timeout tổng mỗi request / timeout kết nối (giây)
+LLM_TIMEOUT = 60.0
+LLM_CONNECT_TIMEOUT = 10.0
+# Connection pool dùng chung: số kết nối tối đa, số kết nối keep-alive giữ lại và thời gian giữ (giây)
+LLM_MAX_CONNECTIONS = 50
+LLM_MAX_KEEPALIVE_CONNECTIONS = 20
+LLM_KEEPALIVE_EXPIRY = 60.0
+
+# ── Giới hạn tốc độ / retry cho OpenRouter (utils/rate_limit.py) ─────────────
+# Token bucket: số request/giây trung bình (0 = không giới hạn) và số request được gửi dồn
+LLM_RATE_LIMIT_RPS = 8.0
+LLM_RATE_LIMIT_BURST = 16
+# Số request tới OpenRouter đang chạy cùng lúc tối đa trong process (0 = không giới hạn)
+LLM_MAX_IN_FLIGHT = 16
+# Retry khi gặp 429 / 5xx / lỗi kết nối: số lần thử lại, backoff mũ (giây) có jitter
+LLM_MAX_RETRIES = 4
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 20.0
+# Retry-After dài hơn ngưỡng này (giây) thì trả lỗi ngay thay vì chờ
+LLM_RETRY_AFTER_MAX = 60.0
+# Gộp các request không-stream giống hệt nhau đang chạy đồng thời (single-flight)
+LLM_COALESCE_REQUESTS = True
+
+# ── Cache câu trả lời (khớp chính xác câu hỏi đã chuẩn hoá) ───────────────────
+ANSWER_CACHE_ENABLED = True
+# Số câu trả lời tối đa (LRU trong process và số dòng giữ lại trong bảng answer_cache)
+ANSWER_CACHE_SIZE = 1_000
+# Thời gian sống (giây); ingest làm tăng phiên bản corpus nên cache cũ tự hết hiệu lực
+ANSWER_CACHE_TTL = 24 * 3600
+# Lưu cả vào bảng answer_cache để không mất cache khi restart
+ANSWER_CACHE_PERSISTENT = True
+# Dọn bảng (hết hạn / vượt ANSWER_CACHE_SIZE) sau mỗi N lần ghi, không chỉ lúc khởi động;
+# áp dụng cho cả answer_cache và semantic_cache
+ANSWER_CACHE_PURGE_EVERY = 50
+
+# ── Cache ngữ nghĩa (câu hỏi diễn đạt khác của câu đã trả lời) ───────────────
+SEMANTIC_CACHE_ENABLED = True
+# Khoảng cách cosine tối đa (1 - similarity) giữa embedding câu hỏi mới và câu đã cache
+SEMANTIC_CACHE_MAX_DISTANCE = 0.08
+# Nhật ký các lần dùng lại câu trả lời (kèm câu hỏi khớp) để kiểm tra ngưỡng
+SEMANTIC_CACHE_LOG_PATH = "logs/semantic_cache_hits.jsonl"
+
+# ── Hạn chót từng bước (giây) và chế độ rút gọn khi quá hạn ───────────────────
+# Hạn của cả request; mỗi bước dùng min(hạn riêng, thời gian còn lại)
+REQUEST_DEADLINE = 45.0
+# Mở rộng câu hỏi quá hạn → dùng các biến thể đã có (hoặc chỉ câu hỏi gốc)
+DEADLINE_EXPANSION = 3.0
+# Embed + vector search mỗi truy vấn được DEADLINE_EMBEDDING + DEADLINE_SEARCH; truy vấn quá hạn bị bỏ
+DEADLINE_EMBEDDING = 3.0
+DEADLINE_SEARCH = 3.0
+# Rerank quá hạn → dùng thứ tự truy xuất; không đủ thời gian → chỉ chấm DEGRADED_RERANK_TOP_N ứng viên
+DEADLINE_RERANK = 5.0
+DEGRADED_RERANK_TOP_N = 10
+# LLM; khi thời gian còn lại ít hơn DEADLINE_LLM chỉ đưa DEGRADED_CONTEXT_CHUNKS chunk vào context
+DEADLINE_LLM = 30.0
+DEGRADED_CONTEXT_CHUNKS = 3
+
+# ── Debug ─────────────────────────────────────────────────────────────────────
+# Ghi candidates / kết quả rerank / prompt / hierarchy ra file để soi lỗi (tắt khi chạy thật).
+# Mỗi request một file riêng trong DEBUG_DUMP_DIR nên các request đồng thời không ghi đè nhau.
+DEBUG_DUMPS = False
+DEBUG_DUMP_DIR = "logs/debug"
@@ -3,9 +3,10 @@ controllers/chat_controller.py – Điều phối quá trình hỏi đáp pháp
 """
 
 from __future__ import annotations
-from typing import Any
+from typing import Any, Iterator
 
-from services.rag_pipeline import run_rag
+from services.rag_pipeline import run_rag, stream_rag
+from services.answer_cache import current_corpus_version, get_cached_answer, store_answer
 
 
 def ask_law_question(
@@ -20,7 +21,13 @@ def ask_law_question(
             "error": "Câu hỏi không được để trống.",
         }
     try:
-        result = run_rag(question=question)
+        corpus_version = current_corpus_version()
+        cached = get_cached_answer(question, corpus_version)
+        if cached is not None:
+            cached["error"] = None
+            return cached
+        result = run_rag(question=question, corpus_version=corpus_version)
+        store_answer(question, result, corpus_version)
         result["error"] = None
         return result
     except Exception as e:
@@ -30,3 +37,34 @@ def ask_law_question(
             "chunks": [],
             "error": str(e),
         }
+
+
+def stream_law_question(
+    question: str,
+) -> Iterator[dict[str, Any]]:
+    """
+    Phiên bản streaming của ask_law_question: sự kiện "meta" (kết quả truy xuất),
+    các sự kiện "token", rồi "done". Lỗi được trả về dưới dạng sự kiện {"type": "error"}.
+    Câu hỏi đã có trong cache trả về "meta" (kèm answer, cached=True) và "done" ngay.
+    """
+    if not question.strip():
+        yield {"type": "error", "error": "Câu hỏi không được để trống."}
+        return
+    try:
+        corpus_version = current_corpus_version()
+        cached = get_cached_answer(question, corpus_version)
+        if cached is not None:
+            yield {"type": "meta", **cached}
+            yield {"type": "done", "answer": cached["answer"], "timings": cached["timings"]}
+            return
+
+        result: dict[str, Any] = {}
+        for event in stream_rag(question=question, corpus_version=corpus_version):
+            if event["type"] == "meta":
+                result = {k: v for k, v in event.items() if k != "type"}
+            elif event["type"] == "done":
+                result.update(answer=event["answer"], timings=event["timings"])
+                store_answer(question, result, corpus_version)
+            yield event
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
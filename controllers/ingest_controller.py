@@ -3,12 +3,16 @@ controllers/ingest_controller.py – Điều phối ingest: JSON / PDF / DOCX
 """
 
 from __future__ import annotations
+import hashlib
+import itertools
 import streamlit as st
 from typing import Any
 
-from services.file_parsers import parse_pdf, parse_docx
-from models.embedding import get_embedding
-from models.law_model import insert_chunk, check_chunk_exists
+from services.file_parsers import iter_chunks
+from services.ingest_pipeline import IngestPipeline
+from models.law_model import get_document_state
+from models.vector_index import rebuild_vector_index
+from services.reranker import invalidate_chunks
 
 
 def _detect_file_type(filename: str) -> str:
@@ -21,26 +25,26 @@ def _detect_file_type(filename: str) -> str:
     return "unknown"
 
 
-def _get_chunks(file_bytes: bytes, filename: str, file_type: str) -> list[dict[str, Any]]:
-    """
-    Chuyển đổi nội dung file thành danh sách chunks theo loại file.
-
-    PDF  → parse_pdf  (paragraph-based)
-    DOCX → parse_docx (paragraph-based)
-    """
-    if file_type == "pdf":
-        return parse_pdf(file_bytes, filename)
-
-    if file_type == "docx":
-        return parse_docx(file_bytes, filename)
-
-    raise ValueError(f"Định dạng file không được hỗ trợ: {filename}")
+def _progress_text(stats: dict[str, Any]) -> str:
+    rates = stats["rates"]
+    parse = f"Parse {stats['parse']:,} chunks" + (" ✓" if stats["parse_done"] else "")
+    return (
+        f"{parse} ({rates['parse']:.0f}/s) · "
+        f"Embed {stats['embed']:,}/{stats['pending']:,} ({rates['embed']:.0f}/s) · "
+        f"Ghi DB {stats['write']:,} ({rates['write']:.0f}/s)"
+    )
 
 
 def ingest_law_file(file_bytes: bytes, filename: str) -> dict[str, Any]:
     """
     Nhận nội dung file, chunk, tạo embedding và insert vào DB.
 
+    Ingest tăng dần: chỉ các Khoản có nội dung thay đổi (so sánh content hash)
+    mới được embed lại; Khoản không còn trong file mới bị xoá khỏi DB.
+
+    Các bước chạy chồng nhau trên IngestPipeline (parse → embed song song → một luồng ghi DB,
+    nối bằng hàng đợi có giới hạn); thread Streamlit chỉ đọc số liệu để cập nhật progress bar.
+
     Args:
         file_bytes: Bytes nội dung file.
         filename:   Tên file gốc (dùng để detect loại file và lấy law_name).
@@ -48,10 +52,6 @@ def ingest_law_file(file_bytes: bytes, filename: str) -> dict[str, Any]:
     Returns:
         {"success": bool, "inserted": int, "skipped": int, "errors": List[str], "message": str}
     """
-    errors: list[str] = []
-    inserted = 0
-    skipped = 0
-
     # 1. Detect loại file
     file_type = _detect_file_type(filename)
     if file_type == "unknown":
@@ -60,12 +60,13 @@ def ingest_law_file(file_bytes: bytes, filename: str) -> dict[str, Any]:
             "inserted": 0,
             "skipped": 0,
             "errors": [f"Định dạng không hỗ trợ: {filename}"],
-            "message": f"❌ Định dạng không hỗ trợ. Chỉ nhận PDF, DOCX.",
+            "message": "❌ Định dạng không hỗ trợ. Chỉ nhận PDF, DOCX.",
         }
 
-    # 2. Parse → chunks
+    # 2. Parse → chunks (generator; chunk đầu tiên cho biết law_name và bắt lỗi đọc file sớm)
     try:
-        chunks = _get_chunks(file_bytes, filename, file_type)
+        chunks = iter_chunks(file_bytes, filename, file_type)
+        first = next(chunks, None)
     except Exception as e:
         return {
             "success": False,
@@ -75,7 +76,7 @@ def ingest_law_file(file_bytes: bytes, filename: str) -> dict[str, Any]:
             "message": f"❌ Lỗi đọc file: {e}",
         }
 
-    if not chunks:
+    if first is None:
         return {
             "success": False,
             "inserted": 0,
@@ -84,36 +85,93 @@ def ingest_law_file(file_bytes: bytes, filename: str) -> dict[str, Any]:
             "message": "⚠️ File không có nội dung để import.",
         }
 
-    # 3. Embed + insert từng chunk
-    total = len(chunks)
-    progress = st.progress(0, text=f"Đang xử lý 0/{total} chunks…")
+    # 3. Trạng thái văn bản trong DB (so sánh theo từng Khoản diễn ra trong pipeline)
+    law_name = first["law_name"]
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    progress = st.progress(0, text="Đang so sánh với dữ liệu hiện có…")
+
+    try:
+        state = get_document_state(law_name)
+    except Exception as e:
+        progress.empty()
+        return {
+            "success": False,
+            "inserted": 0,
+            "skipped": 0,
+            "errors": [str(e)],
+            "message": f"❌ Lỗi đọc dữ liệu đã có: {e}",
+        }
+
+    if state["file_hash"] == file_hash:
+        progress.empty()
+        total = 1 + sum(1 for _ in chunks)
+        return {
+            "success": True,
+            "inserted": 0,
+            "skipped": total,
+            "errors": [],
+            "message": f"✅ File giống hệt phiên bản v{state['version']} đã import, không có thay đổi.",
+        }
+
+    # 4. Parse / so sánh → embed theo batch song song → ghi DB trong một transaction
+    pipeline = IngestPipeline(itertools.chain([first], chunks), law_name, state["clauses"], filename, file_hash)
+    pipeline.start()
+    while not pipeline.join(timeout=0.25):
+        stats = pipeline.stats()
+        fraction = stats["write"] / stats["pending"] if stats["pending"] else 0.0
+        progress.progress(min(1.0, fraction), text=_progress_text(stats))
+
+    outcome = pipeline.result()
+    errors: list[str] = outcome["errors"]
+    if outcome["parse_error"] is not None:
+        progress.empty()
+        return {
+            "success": False,
+            "inserted": 0,
+            "skipped": 0,
+            "errors": [str(outcome["parse_error"])] + errors,
+            "message": f"❌ Lỗi đọc file: {outcome['parse_error']}",
+        }
 
-    for i, chunk in enumerate(chunks):
+    total = outcome["total"]
+    skipped = total - outcome["pending"]
+    added, changed, removed = outcome["added"], outcome["changed"], outcome["removed"]
+    unchanged = outcome["unchanged"]
+    synced = outcome["synced"]
+    inserted = synced["inserted"] if synced else 0
+    version = synced["version"] if synced else None
+    if synced:
+        # Khoản bị sửa/xoá: bỏ điểm reranker đã cache của các chunk cũ
+        invalidate_chunks(synced["deleted_ids"])
+
+    # 5. Build lại index vector nếu số dòng thay đổi nhiều (IVFFlat) hoặc index chưa có
+    if version is not None:
+        progress.progress(1.0, text="Đang cập nhật index vector…")
         try:
-            # Kiểm tra trùng lắp trước khi get embedding
-            if check_chunk_exists(
-                law_name=chunk.get("law_name"),
-                chapter=chunk.get("chapter"),
-                article=chunk.get("article"),
-                clause=chunk.get("clause")
-            ):
-                skipped += 1
-            else:
-                chunk["embedding"] = get_embedding(chunk["content"])
-                insert_chunk(chunk)
-                inserted += 1
+            rebuild_vector_index()
         except Exception as e:
-            errors.append(f"[chunk {i}] {e}")
-
-        progress.progress((i + 1) / total, text=f"Đang xử lý {i + 1}/{total} chunks…")
+            errors.append(f"Lỗi rebuild index vector: {e}")
 
     progress.empty()
 
     type_label = {"pdf": "PDF", "docx": "DOCX"}.get(file_type, file_type.upper())
     message = f"✅ [{type_label}] Đã xử lý {total} chunks."
+    if version is not None:
+        message += f" Phiên bản v{version}."
     message += f"\n- Thành công: {inserted}"
     if skipped > 0:
-        message += f"\n- Bỏ qua (đã tồn tại): {skipped}"
+        message += f"\n- Bỏ qua (không đổi): {skipped}"
+    if version is not None:
+        message += (
+            f"\n- Khoản: +{len(added)} mới, ~{len(changed)} sửa đổi, "
+            f"-{len(removed)} bị bỏ, {unchanged} giữ nguyên"
+        )
+    stats = outcome["stats"]
+    message += (
+        f"\n- Thông lượng (chunk/s): parse {stats['rates']['parse']:.0f} · "
+        f"embed {stats['rates']['embed']:.0f} · ghi DB {stats['rates']['write']:.0f} "
+        f"({stats['elapsed']:.1f}s)"
+    )
     if errors:
         message += f"\n- Lỗi: {len(errors)}"
 
@@ -0,0 +1,117 @@
+"""
+eval_expansion.py – Đánh giá chính sách mở rộng câu hỏi trên tập replay
+
+Tập replay: các câu hỏi trong nhật ký quyết định (EXPANSION_LOG_PATH) hoặc một
+file JSONL bất kỳ có trường "question". Với mỗi câu hỏi, so sánh:
+- full:   luôn mở rộng MAX_VARIANTS biến thể (hành vi cũ);
+- policy: theo decide_expansion (bỏ qua / ít biến thể).
+Chỉ số: tỉ lệ bỏ qua LLM, số biến thể trung bình, thời gian mở rộng tiết kiệm,
+độ trùng top-10 sau rerank giữa policy và full.
+
+Chạy: python eval_expansion.py [replay.jsonl] [số_câu_tối_đa]
+"""
+
+import json
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from config.rag_config import EXPANSION_LOG_PATH, LEXICAL_TOP_K, RERANK_MAX_CANDIDATES
+from models.law_model import keyword_search, lexical_search
+from services.query_expansion import MAX_VARIANTS, decide_expansion, generate_similar_questions
+from services.rag_pipeline import (
+    _search_queries,
+    detect_law_scope,
+    extract_legal_references,
+    fuse_rankings,
+)
+from services.reranker import rerank
+
+load_dotenv()
+
+# Độ trùng top-10 tối thiểu để coi chính sách là không làm giảm chất lượng
+MIN_TOP10_OVERLAP = 0.8
+
+
+def load_replay(path: str, limit: int) -> list[str]:
+    questions: list[str] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                question = json.loads(line).get("question")
+                if question and question not in questions:
+                    questions.append(question)
+    return questions[:limit]
+
+
+def retrieve_top10(question: str, refs: dict, variants: list[str]) -> set:
+    queries = [question] + variants
+    vec_hits = _search_queries(queries, 0)
+    fused = fuse_rankings(vec_hits, lexical_search(queries, top_k=LEXICAL_TOP_K))[:RERANK_MAX_CANDIDATES]
+    kw_hits = keyword_search(
+        articles=refs["articles"] or None,
+        chapters=refs["chapters"] or None,
+        law_names=refs["laws"] or None,
+    )
+    seen, candidates = set(), []
+    for chunk in kw_hits + fused:
+        if chunk["id"] not in seen:
+            seen.add(chunk["id"])
+            candidates.append(chunk)
+    return {c["id"] for c in rerank(" ".join(queries), candidates, top_k=10, score_threshold=0.0)}
+
+
+path = sys.argv[1] if len(sys.argv) > 1 else EXPANSION_LOG_PATH
+limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+try:
+    questions = load_replay(path, limit)
+except FileNotFoundError:
+    print(f"FAILURE: Không tìm thấy tập replay {path}.")
+    sys.exit(1)
+if not questions:
+    print("FAILURE: Tập replay rỗng.")
+    sys.exit(1)
+
+rows = []
+for question in questions:
+    refs = extract_legal_references(question)
+    refs["laws"] = detect_law_scope(question) if (refs["articles"] or refs["chapters"]) else []
+
+    first_pass = _search_queries([question], 0)
+    top_similarity = max((c["similarity"] for c in first_pass), default=0.0)
+    decision = decide_expansion(question, refs, top_similarity)
+
+    t0 = time.time()
+    full_variants = generate_similar_questions(question, MAX_VARIANTS, use_cache=False)[1:]
+    time_full = time.time() - t0
+    t0 = time.time()
+    policy_variants = (
+        generate_similar_questions(question, decision["n_variants"], use_cache=False)[1:]
+        if decision["expand"] else []
+    )
+    time_policy = time.time() - t0
+
+    top_full = retrieve_top10(question, refs, full_variants)
+    top_policy = retrieve_top10(question, refs, policy_variants)
+    overlap = len(top_full & top_policy) / max(1, len(top_full))
+    rows.append((decision, time_full - time_policy, overlap))
+    print(
+        f"[{decision['reason']}] {question!r}: {len(policy_variants)} variants · "
+        f"saved {time_full - time_policy:.2f}s · top-10 overlap={overlap:.2f}"
+    )
+
+skip_rate = np.mean([not d["expand"] for d, _, _ in rows])
+mean_variants = np.mean([d["n_variants"] for d, _, _ in rows])
+saved = np.mean([s for _, s, _ in rows])
+overlap = np.mean([o for _, _, o in rows])
+print(
+    f"Replay {len(rows)} questions: skip rate={skip_rate:.0%} · mean variants={mean_variants:.1f} · "
+    f"mean expansion time saved={saved:.2f}s · mean top-10 overlap={overlap:.2f}"
+)
+if overlap >= MIN_TOP10_OVERLAP:
+    print("SUCCESS: expansion policy keeps full-expansion results.")
+else:
+    print("FAILURE: expansion policy changes results too much; relax the thresholds in config/rag_config.py.")
+    sys.exit(1)
@@ -0,0 +1,194 @@
+"""
+models/cache_model.py – Lưu trữ bền cho cache câu trả lời (khớp chính xác + ngữ nghĩa)
+và phiên bản corpus
+"""
+
+from __future__ import annotations
+import json
+from typing import Any
+
+from models.db import db_connection
+
+
+def get_corpus_version() -> int:
+    """Phiên bản corpus hiện tại (tăng mỗi lần ingest thay đổi law_documents)."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT version FROM corpus_state WHERE id = 1;")
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else 1
+
+
+def bump_corpus_version(cur) -> int:
+    """
+    Tăng phiên bản corpus trong transaction của cursor (gọi cùng transaction với
+    thay đổi dữ liệu) và xoá câu trả lời đã cache của các phiên bản cũ.
+    """
+    cur.execute(
+        """
+        UPDATE corpus_state SET version = version + 1, updated_at = now()
+        WHERE id = 1 RETURNING version;
+        """
+    )
+    version = cur.fetchone()[0]
+    cur.execute("DELETE FROM answer_cache WHERE corpus_version < %s;", (version,))
+    cur.execute("DELETE FROM semantic_cache WHERE corpus_version < %s;", (version,))
+    return version
+
+
+def load_answer(key: str, ttl: float) -> dict[str, Any] | None:
+    """Kết quả đã cache (còn hạn ttl giây) theo key, hoặc None."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE answer_cache SET hits = hits + 1
+            WHERE key = %s AND created_at > now() - make_interval(secs => %s)
+            RETURNING result;
+            """,
+            (key, ttl),
+        )
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else None
+
+
+def save_answer(
+    key: str,
+    question: str,
+    model: str,
+    prompt_version: str,
+    corpus_version: int,
+    result: dict[str, Any],
+) -> None:
+    """Ghi (hoặc ghi đè) một câu trả lời vào bảng answer_cache."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO answer_cache (key, question, model, prompt_version, corpus_version, result)
+            VALUES (%s, %s, %s, %s, %s, %s::jsonb)
+            ON CONFLICT (key) DO UPDATE
+            SET result = EXCLUDED.result, created_at = now(), hits = 0;
+            """,
+            (key, question, model, prompt_version, corpus_version, json.dumps(result, ensure_ascii=False, default=str)),
+        )
+        cur.close()
+
+
+def find_similar_answers(
+    embedding,
+    model: str,
+    prompt_version: str,
+    corpus_version: int,
+    max_distance: float,
+    ttl: float,
+    limit: int = 5,
+) -> list[dict[str, Any]]:
+    """
+    Các câu hỏi đã trả lời gần nhất với embedding (khoảng cách cosine <= max_distance),
+    cùng model, prompt và phiên bản corpus, còn hạn ttl giây. Sắp theo khoảng cách tăng dần.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            WITH q AS (SELECT %s::vector AS vec)
+            SELECT s.id, s.question, s.embedding <=> q.vec AS distance, s.result
+            FROM semantic_cache s, q
+            WHERE s.model = %s AND s.prompt_version = %s AND s.corpus_version = %s
+              AND s.created_at > now() - make_interval(secs => %s)
+            ORDER BY s.embedding <=> q.vec
+            LIMIT %s;
+            """,
+            (embedding, model, prompt_version, corpus_version, ttl, limit),
+        )
+        rows = [
+            {"id": row[0], "question": row[1], "distance": float(row[2]), "result": row[3]}
+            for row in cur.fetchall()
+            if row[2] <= max_distance
+        ]
+        cur.close()
+    return rows
+
+
+def mark_semantic_hit(entry_id: int) -> None:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE semantic_cache SET hits = hits + 1 WHERE id = %s;", (entry_id,))
+        cur.close()
+
+
+def save_semantic_answer(
+    question: str,
+    embedding,
+    model: str,
+    prompt_version: str,
+    corpus_version: int,
+    result: dict[str, Any],
+) -> None:
+    """Lưu embedding câu hỏi cùng câu trả lời vào semantic_cache."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO semantic_cache (question, embedding, model, prompt_version, corpus_version, result)
+            VALUES (%s, %s::vector, %s, %s, %s, %s::jsonb);
+            """,
+            (question, embedding, model, prompt_version, corpus_version,
+             json.dumps(result, ensure_ascii=False, default=str)),
+        )
+        cur.close()
+
+
+def purge_answer_cache(ttl: float, max_rows: int) -> int:
+    """Xoá dòng hết hạn của answer_cache và giữ tối đa max_rows dòng mới nhất. Trả về số dòng đã xoá."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM answer_cache WHERE created_at <= now() - make_interval(secs => %s);",
+            (ttl,),
+        )
+        deleted = cur.rowcount
+        cur.execute(
+            """
+            DELETE FROM answer_cache WHERE key IN (
+                SELECT key FROM answer_cache ORDER BY created_at DESC OFFSET %s
+            );
+            """,
+            (max_rows,),
+        )
+        deleted += cur.rowcount
+        cur.close()
+    return deleted
+
+
+def purge_answers(ttl: float, max_rows: int) -> int:
+    """
+    Xoá câu trả lời hết hạn và giữ tối đa max_rows dòng mới nhất (answer_cache và
+    semantic_cache). Trả về số dòng đã xoá.
+    """
+    return purge_answer_cache(ttl, max_rows) + purge_semantic_cache(ttl, max_rows)
+
+
+def purge_semantic_cache(ttl: float, max_rows: int) -> int:
+    """Xoá dòng hết hạn của semantic_cache và giữ tối đa max_rows dòng mới nhất. Trả về số dòng đã xoá."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM semantic_cache WHERE created_at <= now() - make_interval(secs => %s);",
+            (ttl,),
+        )
+        deleted = cur.rowcount
+        cur.execute(
+            """
+            DELETE FROM semantic_cache WHERE id IN (
+                SELECT id FROM semantic_cache ORDER BY created_at DESC OFFSET %s
+            );
+            """,
+            (max_rows,),
+        )
+        deleted += cur.rowcount
+        cur.close()
+    return deleted
@@ -0,0 +1,100 @@
+"""
+models/clients.py – HTTP client dùng chung tới OpenRouter (LLM + embedding)
+
+- Một httpx.Client + một httpx.AsyncClient (keep-alive, tuỳ chọn HTTP/2, timeout cấu hình
+  trong config/rag_config.py) → mỗi request không phải bắt tay TLS lại.
+- get_openai_client(): OpenAI client gốc (dùng cho embedding) trên cùng connection pool.
+- Mọi request đi qua transport của utils/rate_limit.py (token bucket, giới hạn in-flight,
+  retry có backoff, gộp request trùng), nên retry của SDK OpenAI được tắt.
+
+Tầng models giữ client (như models/db.py giữ connection pool PostgreSQL);
+services/openrouter_service.py dựng ChatOpenAI trên các client này.
+"""
+
+import os
+import threading
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+from config.rag_config import (
+    LLM_HTTP2,
+    LLM_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+)
+from utils.rate_limit import AsyncRateLimitedTransport, RateLimitedTransport
+
+load_dotenv()
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+_lock = threading.Lock()
+_http_clients: dict[str, httpx.Client | httpx.AsyncClient] = {}
+_openai_clients: dict[str, openai.OpenAI] = {}
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 bật trong cấu hình và có gói h2."""
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("|-- Warning: LLM_HTTP2 cần gói h2 (pip install httpx[http2]), dùng HTTP/1.1.", flush=True)
+        return False
+    return True
+
+
+def _transport_options() -> dict:
+    return {
+        "http2": http2_enabled(),
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_http_client() -> httpx.Client:
+    """httpx.Client dùng chung (đồng bộ) cho mọi request tới OpenRouter."""
+    with _lock:
+        if "sync" not in _http_clients:
+            _http_clients["sync"] = httpx.Client(
+                transport=RateLimitedTransport(httpx.HTTPTransport(**_transport_options())),
+                timeout=_timeout(),
+            )
+        return _http_clients["sync"]
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """httpx.AsyncClient dùng chung (LangChain ainvoke / astream)."""
+    with _lock:
+        if "async" not in _http_clients:
+            _http_clients["async"] = httpx.AsyncClient(
+                transport=AsyncRateLimitedTransport(httpx.AsyncHTTPTransport(**_transport_options())),
+                timeout=_timeout(),
+            )
+        return _http_clients["async"]
+
+
+def get_openai_client() -> openai.OpenAI:
+    """OpenAI client gốc trỏ đến OpenRouter, dùng chung connection pool với LLM."""
+    http_client = get_http_client()
+    with _lock:
+        if "default" not in _openai_clients:
+            _openai_clients["default"] = openai.OpenAI(
+                api_key=os.getenv("OPENROUTER_API_KEY", ""),
+                base_url=OPENROUTER_BASE_URL,
+                http_client=http_client,
+                max_retries=0,
+            )
+        return _openai_clients["default"]
@@ -1,11 +1,25 @@
 """
-models/db.py – Kết nối PostgreSQL và khởi tạo schema
+models/db.py – Kết nối PostgreSQL (connection pool) và khởi tạo schema
 """
 
 import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_IDLE
 from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+from config.rag_config import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_HEALTHCHECK_IDLE,
+)
 
 load_dotenv()
 
@@ -14,10 +28,213 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 
 
 def get_connection():
-    """Trả về một kết nối psycopg2 tới PostgreSQL."""
+    """Trả về một kết nối psycopg2 riêng (ngoài pool) tới PostgreSQL."""
     return psycopg2.connect(DATABASE_URL)
 
 
+class _ConnectionPool:
+    """
+    Pool kết nối dùng chung, thread-safe, cho toàn bộ process.
+
+    Tự giữ danh sách kết nối rảnh (psycopg2 chỉ dùng để mở kết nối): mọi kết nối trả về
+    còn tốt đều được giữ lại để dùng lại, tối đa maxconn kết nối mở cùng lúc.
+    - Chờ kết nối rảnh (có timeout) thay vì báo lỗi ngay khi pool đầy.
+    - Health check kết nối rảnh lâu trước khi trả cho người dùng.
+    - Số liệu: số kết nối đang dùng, số lần phải chờ, tổng thời gian chờ.
+    """
+
+    def __init__(
+        self,
+        dsn: str | None,
+        minconn: int,
+        maxconn: int,
+        timeout: float,
+        healthcheck_idle: float,
+    ):
+        self._dsn = dsn
+        self._idle: list[Any] = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._maxconn = maxconn
+        self._timeout = timeout
+        self._healthcheck_idle = healthcheck_idle
+        self._lock = threading.Lock()
+        self._last_used: dict[int, float] = {}
+        self._registered: set[int] = set()
+        self._stats = {
+            "acquired": 0,
+            "in_use": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+        # Mở sẵn minconn kết nối
+        for _ in range(min(minconn, maxconn)):
+            conn = get_connection()
+            self._last_used[id(conn)] = time.monotonic()
+            self._idle.append(conn)
+
+    def acquire(self):
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["waits"] += 1
+            if not self._slots.acquire(timeout=self._timeout):
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise pg_pool.PoolError(
+                    f"Không lấy được kết nối DB sau {self._timeout:.1f}s (pool đầy: {self._maxconn})."
+                )
+        waited = time.monotonic() - start
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_time"] += waited
+        return conn
+
+    def _checkout(self):
+        # Dùng lại kết nối rảnh gần nhất; kết nối hỏng (DB restart, timeout mạng…) bị đóng và bỏ qua
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._prepare(get_connection())
+            if self._is_healthy(conn):
+                return self._prepare(conn)
+            self._discard(conn)
+
+    def _discard(self, conn) -> None:
+        """Đóng kết nối không giữ lại và xoá mọi trạng thái gắn với id() của nó."""
+        with self._lock:
+            self._stats["discarded"] += 1
+            self._last_used.pop(id(conn), None)
+            self._registered.discard(id(conn))
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _prepare(self, conn):
+        # Đăng ký adapter pgvector một lần cho mỗi kết nối mới:
+        # mảng NumPy ↔ cột vector, không cần str(list) thủ công
+        if id(conn) not in self._registered:
+            register_vector(conn)
+            conn.rollback()
+            with self._lock:
+                self._registered.add(id(conn))
+        return conn
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self._healthcheck_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def release(self, conn, broken: bool = False) -> None:
+        try:
+            if not conn.closed and not broken:
+                if conn.autocommit:
+                    conn.autocommit = False
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._last_used[id(conn)] = time.monotonic()
+                    self._idle.append(conn)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        stats["max_size"] = self._maxconn
+        stats["avg_wait_time"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+_pool: _ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> _ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _ConnectionPool(
+                    DATABASE_URL,
+                    minconn=DB_POOL_MIN_SIZE,
+                    maxconn=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE,
+                )
+    return _pool
+
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    """
+    Mượn một kết nối từ pool dùng chung.
+
+    Commit khi khối `with` kết thúc bình thường, rollback khi có exception,
+    sau đó trả kết nối về pool (kết nối hỏng sẽ bị loại bỏ).
+
+    Ví dụ:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+    """
+    pool = _get_pool()
+    conn = pool.acquire()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        pool.release(conn, broken=broken)
+
+
+def get_pool_stats() -> dict[str, Any]:
+    """Số liệu pool: in_use, waits, wait_time, avg_wait_time, timeouts, discarded…"""
+    return _get_pool().stats()
+
+
 def init_db():
     """
     Khởi tạo extension pgvector và tạo bảng law_documents nếu chưa tồn tại.
@@ -54,23 +271,142 @@ def init_db():
         );
     """)
 
-    # Tạo index IVFFLAT cho vector search (chỉ tạo khi chưa có)
+    # Index vector (HNSW/IVFFlat) do models/vector_index.py quản lý
+
+    # Hash nội dung + phiên bản văn bản (ingest tăng dần). Tính hash cho dữ liệu cũ.
+    cur.execute("ALTER TABLE law_documents ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+    cur.execute("ALTER TABLE law_documents ADD COLUMN IF NOT EXISTS doc_version INT;")
+    cur.execute("""
+        UPDATE law_documents
+        SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+        WHERE content_hash IS NULL;
+    """)
+
+    # Lịch sử các lần ingest của từng văn bản
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS law_document_versions (
+            id          BIGSERIAL PRIMARY KEY,
+            law_name    TEXT NOT NULL,
+            version     INT NOT NULL,
+            filename    TEXT,
+            file_hash   TEXT,
+            added       INT NOT NULL DEFAULT 0,
+            changed     INT NOT NULL DEFAULT 0,
+            removed     INT NOT NULL DEFAULT 0,
+            unchanged   INT NOT NULL DEFAULT 0,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            UNIQUE (law_name, version)
+        );
+    """)
+
+    # Full-text search không dấu: unaccent + hàm IMMUTABLE để dùng được trong cột generated
+    cur.execute("CREATE EXTENSION IF NOT EXISTS unaccent;")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION vn_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, lower($1)) $$;
+    """)
+    cur.execute("""
+        ALTER TABLE law_documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', vn_unaccent(content))) STORED;
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS law_documents_content_tsv_idx
+        ON law_documents USING GIN (content_tsv);
+    """)
+
+    # Số Chương chuẩn hoá (La Mã/Ả Rập → INT) + index cho tra cứu chính xác Điều/Chương
+    cur.execute("ALTER TABLE law_documents ADD COLUMN IF NOT EXISTS chapter_no INT;")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS law_documents_structure_idx
+        ON law_documents (law_name, chapter_no, article, clause);
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS law_documents_article_idx
+        ON law_documents (article, law_name, clause);
+    """)
+
+    # Khoá duy nhất cho chunk: dùng khi ingest (ON CONFLICT DO NOTHING + lọc trùng hàng loạt).
+    # Dữ liệu cũ có thể có bản trùng → xoá bản trùng (giữ id nhỏ nhất) trước khi tạo index.
     cur.execute("""
         DO $$
         BEGIN
             IF NOT EXISTS (
                 SELECT 1 FROM pg_indexes
                 WHERE tablename = 'law_documents'
-                  AND indexname = 'law_documents_embedding_idx'
+                  AND indexname = 'law_documents_chunk_key_idx'
             ) THEN
-                CREATE INDEX law_documents_embedding_idx
-                ON law_documents
-                USING ivfflat (embedding vector_cosine_ops)
-                WITH (lists = 100);
+                DELETE FROM law_documents a
+                USING law_documents b
+                WHERE a.id > b.id
+                  AND a.law_name = b.law_name
+                  AND a.chapter IS NOT DISTINCT FROM b.chapter
+                  AND a.article IS NOT DISTINCT FROM b.article
+                  AND a.clause IS NOT DISTINCT FROM b.clause
+                  AND a.chunk_index IS NOT DISTINCT FROM b.chunk_index;
+
+                CREATE UNIQUE INDEX law_documents_chunk_key_idx
+                ON law_documents (law_name, chapter, article, clause, chunk_index)
+                NULLS NOT DISTINCT;
             END IF;
         END
         $$;
     """)
 
+    # Cache embedding (key = hash(model + văn bản đã làm sạch))
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            key         TEXT PRIMARY KEY,
+            model       TEXT NOT NULL,
+            embedding   VECTOR(1024) NOT NULL,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+    # Phiên bản corpus: tăng mỗi lần ingest làm thay đổi law_documents (vô hiệu cache câu trả lời)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS corpus_state (
+            id          INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            version     BIGINT NOT NULL DEFAULT 1,
+            updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("INSERT INTO corpus_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;")
+
+    # Cache câu trả lời (key = hash(câu hỏi chuẩn hoá, model, prompt, phiên bản corpus))
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            key             TEXT PRIMARY KEY,
+            question        TEXT NOT NULL,
+            model           TEXT NOT NULL,
+            prompt_version  TEXT NOT NULL,
+            corpus_version  BIGINT NOT NULL,
+            result          JSONB NOT NULL,
+            hits            INT NOT NULL DEFAULT 0,
+            created_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS answer_cache_created_idx ON answer_cache (created_at);")
+
+    # Cache ngữ nghĩa: embedding câu hỏi (bge-m3) + câu trả lời, tra theo khoảng cách cosine
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS semantic_cache (
+            id              BIGSERIAL PRIMARY KEY,
+            question        TEXT NOT NULL,
+            embedding       VECTOR(1024) NOT NULL,
+            model           TEXT NOT NULL,
+            prompt_version  TEXT NOT NULL,
+            corpus_version  BIGINT NOT NULL,
+            result          JSONB NOT NULL,
+            hits            INT NOT NULL DEFAULT 0,
+            created_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS semantic_cache_embedding_idx
+        ON semantic_cache USING hnsw (embedding vector_cosine_ops);
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS semantic_cache_created_idx ON semantic_cache (created_at);")
+
     cur.close()
     conn.close()
@@ -1,26 +1,62 @@
-import os
-from dotenv import load_dotenv
-import openai
+from config.rag_config import EMBED_BATCH_SIZE
+from models import embedding_cache
+# OpenAI client trực tiếp (tương thích tốt nhất với OpenRouter), dùng chung connection pool với LLM
+from models.clients import get_openai_client
 
-load_dotenv()
+MODEL_NAME = "baai/bge-m3"
+EMBEDDING_DIM = 1024
 
-# Sử dụng OpenAI client trực tiếp để đảm bảo tương thích tốt nhất với OpenRouter
-_client = openai.OpenAI(
-    api_key=os.getenv("OPENROUTER_API_KEY", ""),
-    base_url="https://openrouter.ai/api/v1",
-)
 
-MODEL_NAME = "baai/bge-m3"
+def _clean_text(text: str) -> str:
+    return (text or "").strip().replace("\n", " ")
+
+
+def get_embeddings(
+    texts: list[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> list[list[float]]:
+    """
+    Tạo embedding cho nhiều đoạn văn bản, gửi theo batch thay vì từng request.
+
+    Args:
+        texts:      Danh sách văn bản cần embed.
+        batch_size: Số văn bản tối đa trong một request.
+
+    Văn bản đã từng embed (cùng MODEL_NAME) được lấy từ embedding_cache.
+
+    Returns:
+        Danh sách vector cùng thứ tự với `texts`.
+        Văn bản rỗng trả về vector 0 (không gọi API).
+    """
+    cleaned = [_clean_text(t) for t in texts]
+    results: list[list[float] | None] = [None] * len(cleaned)
+
+    # Gộp các văn bản trùng nhau để chỉ embed một lần
+    unique_texts = list(dict.fromkeys(t for t in cleaned if t))
+
+    # Tra cache trước, chỉ gọi API cho phần còn thiếu
+    by_text = embedding_cache.lookup(unique_texts, MODEL_NAME)
+    missing = [t for t in unique_texts if t not in by_text]
+    fresh: dict[str, list[float]] = {}
+
+    for start in range(0, len(missing), max(1, batch_size)):
+        batch = missing[start:start + batch_size]
+        response = get_openai_client().embeddings.create(
+            model=MODEL_NAME,
+            input=batch,
+        )
+        # Sắp theo index để chắc chắn khớp thứ tự đầu vào
+        for item in sorted(response.data, key=lambda d: d.index):
+            fresh[batch[item.index]] = item.embedding
+
+    embedding_cache.store(fresh, MODEL_NAME)
+    by_text.update(fresh)
+
+    for i, t in enumerate(cleaned):
+        results[i] = by_text[t] if t else [0.0] * EMBEDDING_DIM
+    return results
+
 
 def get_embedding(text: str) -> list[float]:
     """Tạo embedding vector 1024 chiều cho đoạn văn bản (BGE-M3)."""
-    clean_text = text.strip().replace("\n", " ")
-    if not clean_text:
-        return [0.0] * 1024
-        
-    response = _client.embeddings.create(
-        model=MODEL_NAME,
-        input=clean_text
-    )
-    return response.data[0].embedding
-
+    return get_embeddings([text])[0]
@@ -0,0 +1,126 @@
+"""
+models/embedding_cache.py – Cache embedding hai tầng: LRU trong process + bảng PostgreSQL
+
+Key = sha256(model + văn bản đã làm sạch) nên khi đổi MODEL_NAME, các vector cũ
+tự động không còn khớp (và được dọn khỏi bảng khi khởi động).
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import threading
+from typing import Any
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from models.db import db_connection
+from utils.lru_cache import LRUCache
+from config.rag_config import EMBED_CACHE_MEMORY_SIZE, EMBED_CACHE_PERSISTENT
+
+_memory = LRUCache(EMBED_CACHE_MEMORY_SIZE)
+_stats_lock = threading.Lock()
+_stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+
+
+def cache_key(clean_text: str, model: str) -> str:
+    """Hash của (model, văn bản đã làm sạch)."""
+    return hashlib.sha256(f"{model}\x00{clean_text}".encode("utf-8")).hexdigest()
+
+
+def _to_vector(value: Any) -> list[float]:
+    # Adapter pgvector trả về mảng NumPy; dạng chuỗi "[0.1,0.2,...]" khi chưa đăng ký adapter
+    if isinstance(value, str):
+        return json.loads(value)
+    return [float(v) for v in value]
+
+
+def lookup(texts: list[str], model: str) -> dict[str, list[float]]:
+    """
+    Tra cache cho danh sách văn bản (đã làm sạch, không trùng).
+
+    Returns:
+        Dict {văn bản: vector} cho các văn bản có trong cache.
+    """
+    found: dict[str, list[float]] = {}
+    keys = {t: cache_key(t, model) for t in texts}
+
+    # Tầng 1: LRU trong process
+    for text, key in keys.items():
+        vec = _memory.get(key)
+        if vec is not None:
+            found[text] = vec
+    memory_hits = len(found)
+
+    # Tầng 2: bảng embedding_cache
+    remaining = {key: text for text, key in keys.items() if text not in found}
+    if remaining and EMBED_CACHE_PERSISTENT:
+        try:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT key, embedding FROM embedding_cache WHERE key = ANY(%s) AND model = %s;",
+                    (list(remaining), model),
+                )
+                for key, embedding in cur.fetchall():
+                    vec = _to_vector(embedding)
+                    found[remaining[key]] = vec
+                    _memory.set(key, vec)
+                cur.close()
+        except Exception as e:
+            print(f"|-- Warning: Embedding cache lookup failed: {e}", flush=True)
+
+    with _stats_lock:
+        _stats["memory_hits"] += memory_hits
+        _stats["persistent_hits"] += len(found) - memory_hits
+        _stats["misses"] += len(texts) - len(found)
+    return found
+
+
+def store(vectors: dict[str, list[float]], model: str) -> None:
+    """Lưu các vector mới tạo vào cả hai tầng cache."""
+    if not vectors:
+        return
+    rows = []
+    for text, vec in vectors.items():
+        key = cache_key(text, model)
+        _memory.set(key, vec)
+        rows.append((key, model, np.asarray(vec, dtype=np.float32)))
+
+    if not EMBED_CACHE_PERSISTENT:
+        return
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            execute_values(
+                cur,
+                "INSERT INTO embedding_cache (key, model, embedding) VALUES %s ON CONFLICT (key) DO NOTHING;",
+                rows,
+                template="(%s, %s, %s::vector)",
+            )
+            cur.close()
+    except Exception as e:
+        print(f"|-- Warning: Embedding cache store failed: {e}", flush=True)
+
+
+def purge_other_models(model: str) -> int:
+    """Xoá vector của các model khác model hiện tại. Trả về số dòng đã xoá."""
+    _memory.clear()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM embedding_cache WHERE model <> %s;", (model,))
+        deleted = cur.rowcount
+        cur.close()
+    if deleted:
+        print(f"|-- Embedding cache: removed {deleted} vectors of old models.", flush=True)
+    return deleted
+
+
+def get_cache_stats() -> dict[str, Any]:
+    """Bộ đếm hit/miss của cả hai tầng."""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+    stats["hit_ratio"] = (stats["memory_hits"] + stats["persistent_hits"]) / total if total else 0.0
+    stats["memory_size"] = len(_memory)
+    return stats
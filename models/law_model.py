@@ -3,172 +3,682 @@ models/law_model.py – CRUD + Vector search cho bảng law_documents
 """
 
 from __future__ import annotations
-from typing import Any
-from models.db import get_connection
+import hashlib
+import io
+import re
+import struct
+import uuid
+from typing import Any, Callable
 
+import numpy as np
 
-def insert_chunk(chunk: dict[str, Any]) -> None:
+from models.db import db_connection
+from models.cache_model import bump_corpus_version
+from models.embedding import EMBEDDING_DIM
+from models.vector_index import apply_search_settings
+from utils.lru_cache import LRUCache
+from utils.text import VI_STOPWORDS, syllables
+
+
+# Insert từng dòng: chỉ dùng để chẩn đoán dòng lỗi khi COPY thất bại (_find_failed_rows)
+_INSERT_SQL = """
+    INSERT INTO law_documents (
+        law_name, 
+        chapter, 
+        article, 
+        article_name, 
+        clause, 
+        content,
+        chunk_id, 
+        chunk_index, 
+        embedding,
+        content_hash,
+        doc_version,
+        chapter_no
+    ) VALUES (
+        %(law_name)s, 
+        %(chapter)s, 
+        %(article)s, 
+        %(article_name)s, 
+        %(clause)s, 
+        %(content)s,
+        %(chunk_id)s, 
+        %(chunk_index)s, 
+        %(embedding)s,
+        %(content_hash)s,
+        %(doc_version)s,
+        %(chapter_no)s
+    )
+    ON CONFLICT (law_name, chapter, article, clause, chunk_index) DO NOTHING;
+"""
+
+
+class BulkInsertError(Exception):
     """
-    Insert một chunk luật vào bảng law_documents.
+    Lỗi khi insert hàng loạt. Transaction đã được rollback toàn bộ.
 
-    Args:
-        chunk: Dict với các key tương ứng cột trong bảng.
+    Attributes:
+        failed_rows: Danh sách (vị trí trong list chunks, thông báo lỗi).
     """
-    
-    sql = """
-        INSERT INTO law_documents (
-            law_name, 
-            chapter, 
-            article, 
-            article_name, 
-            clause, 
-            content,
-            chunk_id, 
-            chunk_index, 
-            embedding
-        ) VALUES (
-            %(law_name)s, 
-            %(chapter)s, 
-            %(article)s, 
-            %(article_name)s, 
-            %(clause)s, 
-            %(content)s,
-            %(chunk_id)s, 
-            %(chunk_index)s, 
-            %(embedding)s
-        );
-    """
-    conn = get_connection()
-
-    try:
+
+    def __init__(self, failed_rows: list[tuple[int, str]]):
+        self.failed_rows = failed_rows
+        super().__init__(f"{len(failed_rows)} chunk lỗi, đã rollback toàn bộ văn bản.")
+
+
+def to_vector_param(vec: Any) -> np.ndarray:
+    """Chuyển embedding sang mảng NumPy float32 để adapter pgvector bind trực tiếp."""
+    return np.asarray(vec, dtype=np.float32)
+
+
+def _row_params(chunk: dict[str, Any]) -> dict[str, Any]:
+    """Bổ sung các cột tuỳ chọn (content_hash, doc_version, chapter_no) nếu chunk chưa có."""
+    embedding = chunk.get("embedding")
+    return {
+        **chunk,
+        "embedding": to_vector_param(embedding) if embedding is not None else None,
+        "content_hash": chunk.get("content_hash") or content_hash(chunk.get("content", "")),
+        "doc_version": chunk.get("doc_version"),
+        "chapter_no": chunk.get("chapter_no") or chapter_to_number(chunk.get("chapter")),
+    }
+
+
+# ── COPY nhị phân ─────────────────────────────────────────────────────────────
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+
+
+def _enc_text(value: Any) -> bytes:
+    return str(value).encode("utf-8")
+
+
+def _enc_int4(value: Any) -> bytes:
+    return struct.pack(">i", int(value))
+
+
+def _enc_uuid(value: Any) -> bytes:
+    return uuid.UUID(str(value)).bytes
+
+
+def _enc_vector(value: Any) -> bytes:
+    # Định dạng nhị phân của pgvector: dim (int16), unused (int16), float4 big-endian * dim
+    values = np.asarray(value, dtype=">f4")
+    if values.shape != (EMBEDDING_DIM,):
+        raise ValueError(f"embedding có {values.size} chiều, cần {EMBEDDING_DIM}")
+    return struct.pack(">hh", EMBEDDING_DIM, 0) + values.tobytes()
+
+
+# (cột, hàm mã hoá) theo đúng thứ tự trong câu lệnh COPY
+_COPY_COLUMNS: list[tuple[str, Callable[[Any], bytes]]] = [
+    ("law_name", _enc_text),
+    ("chapter", _enc_text),
+    ("article", _enc_int4),
+    ("article_name", _enc_text),
+    ("clause", _enc_int4),
+    ("content", _enc_text),
+    ("chunk_id", _enc_uuid),
+    ("chunk_index", _enc_int4),
+    ("embedding", _enc_vector),
+    ("content_hash", _enc_text),
+    ("doc_version", _enc_int4),
+    ("chapter_no", _enc_int4),
+]
+
+
+def _encode_copy_row(chunk: dict[str, Any]) -> bytes:
+    chunk = _row_params(chunk)
+    parts = [struct.pack(">h", len(_COPY_COLUMNS))]
+    for col, encode in _COPY_COLUMNS:
+        value = chunk.get(col)
+        if value is None:
+            parts.append(struct.pack(">i", -1))
+        else:
+            data = encode(value)
+            parts.append(struct.pack(">i", len(data)))
+            parts.append(data)
+    return b"".join(parts)
+
+
+def _find_failed_rows(cur, chunks: list[dict[str, Any]]) -> list[tuple[int, str]]:
+    """Insert lại từng dòng trong SAVEPOINT để xác định dòng gây lỗi."""
+    failed: list[tuple[int, str]] = []
+    for i, chunk in enumerate(chunks):
+        cur.execute("SAVEPOINT bulk_row;")
+        try:
+            cur.execute(_INSERT_SQL, _row_params(chunk))
+            cur.execute("RELEASE SAVEPOINT bulk_row;")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT bulk_row;")
+            failed.append((i, str(e).strip()))
+    return failed
+
+
+def _encode_copy_buffer(chunks: list[dict[str, Any]]) -> io.BytesIO:
+    """Mã hoá chunks sang định dạng COPY BINARY; lỗi dữ liệu → BulkInsertError."""
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    failed: list[tuple[int, str]] = []
+    for i, chunk in enumerate(chunks):
+        try:
+            buf.write(_encode_copy_row(chunk))
+        except Exception as e:
+            failed.append((i, f"Dữ liệu không hợp lệ: {e}"))
+    if failed:
+        raise BulkInsertError(failed)
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+_COPY_COLUMN_LIST = ", ".join(col for col, _ in _COPY_COLUMNS)
+
+
+def _create_stage(cur) -> None:
+    """Bảng tạm cùng cấu trúc law_documents, tự xoá khi transaction kết thúc."""
+    cur.execute(
+        f"CREATE TEMP TABLE law_documents_stage ON COMMIT DROP AS "
+        f"SELECT {_COPY_COLUMN_LIST} FROM law_documents WITH NO DATA;"
+    )
+
+
+def _copy_to_stage(cur, buf: io.BytesIO) -> None:
+    cur.copy_expert(f"COPY law_documents_stage ({_COPY_COLUMN_LIST}) FROM STDIN WITH (FORMAT BINARY);", buf)
+
+
+def _insert_from_stage(cur) -> int:
+    cur.execute(f"""
+        INSERT INTO law_documents ({_COPY_COLUMN_LIST})
+        SELECT {_COPY_COLUMN_LIST} FROM law_documents_stage
+        ON CONFLICT (law_name, chapter, article, clause, chunk_index) DO NOTHING;
+    """)
+    return cur.rowcount
+
+
+def content_hash(text: str) -> str:
+    """Hash nội dung chunk (khớp với encode(sha256(convert_to(content, 'UTF8')), 'hex') trong SQL)."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def clause_key(chunk: dict[str, Any]) -> tuple[Any, ...]:
+    """Khoá định danh một Khoản trong văn bản: (chapter, article, clause)."""
+    return (chunk.get("chapter"), chunk.get("article"), chunk.get("clause"))
+
+
+def get_document_state(law_name: str) -> dict[str, Any]:
+    """
+    Trạng thái hiện tại của một văn bản trong DB.
+
+    Returns:
+        {
+            "version":   phiên bản mới nhất (0 nếu chưa có),
+            "file_hash": hash file của phiên bản mới nhất (None nếu chưa có),
+            "clauses":   {(chapter, article, clause): [content_hash theo chunk_index]},
+        }
+    """
+    with db_connection() as conn:
         cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT version, file_hash FROM law_document_versions
+            WHERE law_name = %s ORDER BY version DESC LIMIT 1;
+            """,
+            (law_name,),
+        )
+        latest = cur.fetchone()
+
+        cur.execute(
+            """
+            SELECT chapter, article, clause, content_hash
+            FROM law_documents
+            WHERE law_name = %s
+            ORDER BY chunk_index;
+            """,
+            (law_name,),
+        )
+        clauses: dict[tuple[Any, ...], list[str]] = {}
+        for chapter, article, clause, h in cur.fetchall():
+            clauses.setdefault((chapter, article, clause), []).append(h)
+        cur.close()
+
+    return {
+        "version": latest[0] if latest else 0,
+        "file_hash": latest[1] if latest else None,
+        "clauses": clauses,
+    }
+
+
+def _clause_arrays(clauses: list[tuple[Any, ...]]) -> tuple[list, list, list]:
+    return [k[0] for k in clauses], [k[1] for k in clauses], [k[2] for k in clauses]
+
+
+class DocumentWriter:
+    """
+    Ghi một văn bản theo luồng trong MỘT transaction (dùng với `with`).
+
+    Chunk đã embed được COPY vào bảng tạm theo từng batch ngay khi có (write), song song
+    với các batch còn đang embed; finish() xoá các Khoản cũ, chuyển bảng tạm sang
+    law_documents và ghi phiên bản. Thoát khối `with` mà chưa finish() (hoặc có exception)
+    → rollback, DB giữ nguyên phiên bản trước.
+
+    Ví dụ:
+        with DocumentWriter(law_name) as writer:
+            for batch in batches:
+                writer.write(batch)
+            synced = writer.finish(stale_clauses, [], filename, file_hash, stats)
+    """
+
+    def __init__(self, law_name: str):
+        self.law_name = law_name
+        self.version: int | None = None
+        # Chunk đã ghi (theo thứ tự) – để chạy lại từng dòng khi COPY lỗi
+        self.chunks: list[dict[str, Any]] = []
+        self._ctx = None
+        self._cur = None
+        self._finished = False
+        self._synced: dict[str, Any] = {}
+
+    def __enter__(self) -> "DocumentWriter":
+        self._ctx = db_connection()
+        conn = self._ctx.__enter__()
         try:
-            cur.execute(sql, chunk)
-            conn.commit()
+            self._cur = conn.cursor()
+            # Tuần tự hoá các phiên ingest cùng một văn bản
+            self._cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (self.law_name,))
+            self._cur.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM law_document_versions WHERE law_name = %s;",
+                (self.law_name,),
+            )
+            self.version = self._cur.fetchone()[0]
+            _create_stage(self._cur)
         except Exception as e:
-            conn.rollback()
-            # Xem SQL thực tế (mogrify)
-            full_sql = cur.mogrify(sql, chunk).decode('utf-8')
-            print(f"|-- Error INSERT: {e}", flush=True)
-            print(f"|-- SQL: {full_sql[:500]}...", flush=True)
-            raise e
-        finally:
-            cur.close()
-    except Exception as e:
-        print(f"Error inserting chunk: {e}")
-    finally:
-        conn.close()
+            self._ctx.__exit__(type(e), e, e.__traceback__)
+            raise BulkInsertError([(-1, str(e).strip())]) from e
+        return self
+
+    def write(self, chunks: list[dict[str, Any]]) -> None:
+        """COPY một batch chunk (đã có embedding và content_hash) vào bảng tạm."""
+        if not chunks:
+            return
+        offset = len(self.chunks)
+        for chunk in chunks:
+            chunk["doc_version"] = self.version
+        try:
+            buf = _encode_copy_buffer(chunks)
+        except BulkInsertError as e:
+            # Vị trí lỗi tính trên toàn bộ chunk của văn bản, không phải trong batch
+            raise BulkInsertError([(offset + pos, err) for pos, err in e.failed_rows]) from e
+        self.chunks.extend(chunks)
+        try:
+            _copy_to_stage(self._cur, buf)
+        except Exception as e:
+            self._raise_with_failed_rows(e)
+
+    def _raise_with_failed_rows(self, error: Exception) -> None:
+        """
+        COPY / INSERT của writer thất bại → rollback transaction của writer rồi chạy lại từng dòng
+        (SAVEPOINT) trên chính kết nối này để báo dòng lỗi, sau đó rollback lần nữa.
 
+        Không dùng kết nối thứ hai: transaction của writer còn mở sẽ giữ khoá dòng trên cùng các
+        khoá chunk, insert chẩn đoán chờ writer còn writer chờ chẩn đoán xong → deadlock.
+        """
+        print(f"|-- Error COPY ({len(self.chunks)} rows): {error}", flush=True)
+        cur = self._cur
+        failed: list[tuple[int, str]] = []
+        try:
+            cur.connection.rollback()
+            # Giữ khoá văn bản trong lúc chẩn đoán để không tranh dòng với phiên ingest khác
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (self.law_name,))
+            failed = _find_failed_rows(cur, self.chunks)
+            cur.connection.rollback()
+        except Exception as e:
+            print(f"|-- Warning: Không chẩn đoán được dòng lỗi: {e}", flush=True)
+        raise BulkInsertError(failed or [(-1, str(error).strip())]) from error
+
+    def finish(
+        self,
+        stale_clauses: list[tuple[Any, ...]],
+        skip_clauses: list[tuple[Any, ...]],
+        filename: str,
+        file_hash: str | None,
+        stats: dict[str, int],
+    ) -> dict[str, Any]:
+        """
+        Xoá chunk của các Khoản cũ, chuyển chunk từ bảng tạm sang law_documents và ghi phiên bản.
+
+        Args:
+            stale_clauses: Các khoá (chapter, article, clause) cần xoá khỏi DB.
+            skip_clauses:  Các Khoản không được ghi dù đã có chunk trong bảng tạm
+                           (ví dụ một phần chunk của Khoản embed lỗi).
+            filename:      Tên file upload.
+            file_hash:     Hash toàn bộ file; None khi phiên bản chưa đầy đủ (có Khoản bị bỏ qua),
+                           để lần upload lại không bị coi là giống hệt.
+            stats:         Số Khoản added/changed/removed/unchanged để lưu vào lịch sử.
+
+        Returns:
+            {"version": int, "inserted": int, "deleted_ids": list[int]}
+        """
+        cur = self._cur
+        try:
+            if skip_clauses:
+                cur.execute(
+                    """
+                    DELETE FROM law_documents_stage d
+                    USING unnest(%s::text[], %s::int[], %s::int[]) AS s(chapter, article, clause)
+                    WHERE d.chapter IS NOT DISTINCT FROM s.chapter
+                      AND d.article IS NOT DISTINCT FROM s.article
+                      AND d.clause IS NOT DISTINCT FROM s.clause;
+                    """,
+                    _clause_arrays(skip_clauses),
+                )
+
+            deleted_ids: list[int] = []
+            if stale_clauses:
+                cur.execute(
+                    """
+                    DELETE FROM law_documents d
+                    USING unnest(%s::text[], %s::int[], %s::int[]) AS s(chapter, article, clause)
+                    WHERE d.law_name = %s
+                      AND d.chapter IS NOT DISTINCT FROM s.chapter
+                      AND d.article IS NOT DISTINCT FROM s.article
+                      AND d.clause IS NOT DISTINCT FROM s.clause
+                    RETURNING d.id;
+                    """,
+                    (*_clause_arrays(stale_clauses), self.law_name),
+                )
+                deleted_ids = [row[0] for row in cur.fetchall()]
+
+            inserted = _insert_from_stage(cur)
+
+            cur.execute(
+                """
+                INSERT INTO law_document_versions (
+                    law_name, version, filename, file_hash,
+                    added, changed, removed, unchanged
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+                """,
+                (
+                    self.law_name, self.version, filename, file_hash,
+                    stats.get("added", 0), stats.get("changed", 0),
+                    stats.get("removed", 0), stats.get("unchanged", 0),
+                ),
+            )
+            # Dữ liệu đã đổi → câu trả lời đã cache không còn đúng
+            bump_corpus_version(cur)
+        except Exception as e:
+            self._raise_with_failed_rows(e)
+
+        self._finished = True
+        self._synced = {"version": self.version, "inserted": inserted, "deleted_ids": deleted_ids}
+        return self._synced
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None and not self._finished:
+            # Không finish(): bỏ mọi thay đổi thay vì commit nửa chừng
+            self._cur.connection.rollback()
+        self._cur.close()
+        self._ctx.__exit__(exc_type, exc, tb)
+        if exc_type is None and self._finished:
+            _law_names_cache.clear()
+            print(
+                f"|-- Synced '{self.law_name}' v{self.version}: +{self._synced['inserted']} rows, "
+                f"-{len(self._synced['deleted_ids'])} rows.",
+                flush=True,
+            )
 
-def vector_search(
-    query_embedding: list[float],
+
+def vector_search_many(
+    query_embeddings: list[list[float]],
     top_k: int = 100,
     threshold: float = 0.0,
 ) -> list[dict[str, Any]]:
     """
-    Tìm kiếm top-K chunks gần nhất bằng cosine similarity và lọc theo ngưỡng.
+    Vector search cho nhiều truy vấn trong một câu lệnh SQL duy nhất (UNNEST + LATERAL).
+
+    Mỗi vector truy vấn lấy top-K chunk gần nhất, lọc theo ngưỡng, sau đó gộp
+    theo id ngay trong Postgres: giữ similarity cao nhất và thứ hạng của chunk
+    trong từng truy vấn.
 
     Args:
-        query_embedding: Vector câu hỏi.
-        top_k: Số kết quả tối đa trước khi lọc.
+        query_embeddings: Danh sách vector truy vấn.
+        top_k: Số kết quả tối đa cho mỗi truy vấn trước khi lọc.
         threshold: Ngưỡng tương đồng tối thiểu (0.0 đến 1.0).
 
     Returns:
-        Danh sách dict chứa thông tin từng chunk.
+        Danh sách chunk đã khử trùng, sắp xếp theo similarity giảm dần.
+        Mỗi chunk có thêm key "query_ranks": {chỉ số truy vấn: thứ hạng (1-based)}.
     """
-    params: list[Any] = [str(query_embedding), str(query_embedding), threshold, top_k]
+    if not query_embeddings:
+        return []
 
-    sql = f"""
+    sql = """
+        WITH q AS (
+            SELECT ord - 1 AS query_idx, vec
+            FROM unnest(%s::vector[]) WITH ORDINALITY AS t(vec, ord)
+        ),
+        hits AS (
+            SELECT
+                q.query_idx,
+                h.id,
+                h.similarity,
+                ROW_NUMBER() OVER (PARTITION BY q.query_idx ORDER BY h.distance) AS rnk
+            FROM q
+            CROSS JOIN LATERAL (
+                SELECT id, embedding <=> q.vec AS distance, 1 - (embedding <=> q.vec) AS similarity
+                FROM law_documents
+                WHERE embedding IS NOT NULL
+                ORDER BY embedding <=> q.vec
+                LIMIT %s
+            ) h
+            WHERE h.similarity >= %s
+        ),
+        best AS (
+            SELECT
+                id,
+                MAX(similarity) AS similarity,
+                jsonb_object_agg(query_idx, rnk) AS query_ranks
+            FROM hits
+            GROUP BY id
+        )
         SELECT
-            id, 
-            law_name,
-            chapter, article, article_name, clause, content,
-            1 - (embedding <=> %s::vector) AS similarity
-        FROM law_documents
-        WHERE embedding IS NOT NULL
-          AND (1 - (embedding <=> %s::vector)) >= %s
-        ORDER BY embedding <=> %s::vector
-        LIMIT %s;
+            d.id,
+            d.law_name,
+            d.chapter, d.article, d.article_name, d.clause, d.chunk_index, d.content,
+            best.similarity,
+            best.query_ranks
+        FROM best
+        JOIN law_documents d ON d.id = best.id
+        ORDER BY best.similarity DESC;
     """
-    # Lưu ý: %s xuất hiện 3 lần cho embedding, ta cần 4 params
-    params = [str(query_embedding), str(query_embedding), threshold, str(query_embedding), top_k]
+    params = [[to_vector_param(vec) for vec in query_embeddings], top_k, threshold]
 
-    conn = get_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
+        apply_search_settings(cur)
         cur.execute(sql, params)
         cols = [desc[0] for desc in cur.description]
         rows = [dict(zip(cols, row)) for row in cur.fetchall()]
         cur.close()
-        print(f"|-- Vector Search found {len(rows)} results.", flush=True)
-        import json
-        with open("result.json", "w", encoding="utf-8") as f:
-            json.dump(rows, f, indent=4, ensure_ascii=False)
+        for row in rows:
+            # jsonb trả key dạng chuỗi → chuyển lại thành int
+            row["query_ranks"] = {int(k): v for k, v in (row["query_ranks"] or {}).items()}
+        print(
+            f"|-- Vector Search ({len(query_embeddings)} queries) found {len(rows)} unique results.",
+            flush=True,
+        )
+        return rows
+
+
+def build_lexical_query(texts: list[str]) -> str:
+    """
+    Tạo biểu thức tsquery từ các câu truy vấn.
+
+    Tiếng Việt là ngôn ngữ đơn âm tiết nên thuật ngữ ("trốn thuế", "trộm cắp")
+    được biểu diễn bằng cụm hai âm tiết liền kề (phrase `a <-> b`), nối bằng OR.
+    Âm tiết có nghĩa không nằm trong cụm nào (ví dụ "phạt" trong "bị phạt thế nào")
+    được thêm dưới dạng âm tiết đơn để từ khoá một âm tiết vẫn được khớp.
+    """
+    terms: list[str] = []
+    for text in texts:
+        tokens = syllables(text)
+        covered = [False] * len(tokens)
+        for i, (a, b) in enumerate(zip(tokens, tokens[1:])):
+            if a not in VI_STOPWORDS and b not in VI_STOPWORDS:
+                terms.append(f"{a} <-> {b}")
+                covered[i] = covered[i + 1] = True
+        terms.extend(
+            t for t, in_phrase in zip(tokens, covered)
+            if not in_phrase and t not in VI_STOPWORDS
+        )
+    return " | ".join(dict.fromkeys(terms))
+
+
+def lexical_search(
+    queries: list[str],
+    top_k: int = 50,
+) -> list[dict[str, Any]]:
+    """
+    Full-text search trên cột content_tsv (GIN index, chuẩn hoá không dấu).
+
+    Args:
+        queries: Các câu truy vấn (câu hỏi gốc + biến thể).
+        top_k: Số kết quả tối đa.
+
+    Returns:
+        Danh sách chunk theo thứ tự ts_rank_cd giảm dần, có key "lexical_score".
+        similarity = 0.0 (không có điểm vector).
+    """
+    tsquery = build_lexical_query(queries)
+    if not tsquery:
+        return []
+
+    sql = """
+        WITH q AS (SELECT to_tsquery('simple', vn_unaccent(%s)) AS tsq)
+        SELECT
+            d.id,
+            d.law_name,
+            d.chapter, d.article, d.article_name, d.clause, d.chunk_index, d.content,
+            0.0::float AS similarity,
+            ts_rank_cd(d.content_tsv, q.tsq) AS lexical_score
+        FROM law_documents d, q
+        WHERE d.content_tsv @@ q.tsq
+        ORDER BY lexical_score DESC
+        LIMIT %s;
+    """
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, (tsquery, top_k))
+        cols = [desc[0] for desc in cur.description]
+        rows = [dict(zip(cols, row)) for row in cur.fetchall()]
+        cur.close()
+        print(f"|-- Lexical search found {len(rows)} results.", flush=True)
         return rows
-    finally:
-        conn.close()
+
+
+def sample_contents(limit: int = 500) -> list[str]:
+    """Lấy ngẫu nhiên nội dung chunk (dùng cho benchmark theo phân bố độ dài thực tế)."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT content FROM law_documents ORDER BY random() LIMIT %s;", (limit,))
+        contents = [row[0] for row in cur.fetchall()]
+        cur.close()
+        return contents
 
 
 def count_records() -> int:
     """Đếm tổng số bản ghi trong bảng law_documents."""
-    conn = get_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT COUNT(*) FROM law_documents;")
         result = cur.fetchone()
         cur.close()
         return result[0] if result else 0
-    finally:
-        conn.close()
+
+
+_ROMAN_VALUES = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}
+
+
+def chapter_to_number(label: str | None) -> int | None:
+    """
+    Chuẩn hoá số Chương (La Mã hoặc Ả Rập) thành số nguyên.
+
+    Ví dụ: "Chương XVI" → 16, "Chương 2" → 2, "iv" → 4, "Chương mở đầu" → None.
+    """
+    if not label:
+        return None
+    m = re.match(r"(?:ch[ưu][ơo]ng\s+)?([IVXLCDM]+|\d+)\b", label.strip(), re.IGNORECASE)
+    if not m:
+        return None
+    token = m.group(1).upper()
+    if token.isdigit():
+        return int(token)
+    total = 0
+    for ch, nxt in zip(token, token[1:] + " "):
+        value = _ROMAN_VALUES[ch]
+        total += -value if _ROMAN_VALUES.get(nxt, 0) > value else value
+    return total
+
+
+_law_names_cache = LRUCache(maxsize=1, ttl=300)
+
+
+def list_law_names() -> list[str]:
+    """Danh sách tên văn bản trong DB (cache 5 phút, xoá khi ingest)."""
+    names = _law_names_cache.get("all")
+    if names is None:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT DISTINCT law_name FROM law_documents;")
+            names = [row[0] for row in cur.fetchall()]
+            cur.close()
+        _law_names_cache.set("all", names)
+    return names
 
 
 def keyword_search(
     articles: list[str] | None = None,
     chapters: list[str] | None = None,
+    law_names: list[str] | None = None,
 ) -> list[dict[str, Any]]:
     """
     Tìm kiếm chunk chính xác theo Điều/Chương được đề cập trong câu hỏi.
     Các chunk tìm được sẽ có similarity = 1.0 (ưu tiên tối đa).
 
+    Dùng so sánh bằng trên cột số (article, chapter_no) nên được phục vụ bởi
+    index law_documents_article_idx / law_documents_structure_idx thay vì quét bảng.
+
     Args:
-        articles: Danh sách số điều cần tìm, ví dụ ["2", "185"].
-        chapters: Danh sách số/tên chương cần tìm, ví dụ ["I", "2"].
+        articles:  Danh sách số điều cần tìm, ví dụ ["2", "185"].
+        chapters:  Danh sách số chương (La Mã/Ả Rập), ví dụ ["I", "2"].
+        law_names: Giới hạn trong các văn bản này (None = mọi văn bản).
 
     Returns:
         Danh sách chunk khớp, với similarity = 1.0.
     """
-    if not articles and not chapters:
+    article_nos = [int(a) for a in (articles or []) if str(a).isdigit()]
+    chapter_nos = [n for n in (chapter_to_number(c) for c in (chapters or [])) if n is not None]
+    if not article_nos and not chapter_nos:
         return []
 
-    conditions: list[str] = []
-    params: list[Any] = []
-
-    if articles:
-        placeholders = ", ".join(["%s"] * len(articles))
-        conditions.append(f"article::text IN ({placeholders})")
-        params.extend(articles)
-
-    if chapters:
-        or_parts = []
-        for ch in chapters:
-            or_parts.append("chapter ILIKE %s")
-            params.append(f"%{ch}%")
-        conditions.append(f"({' OR '.join(or_parts)})")
+    # Luôn lọc theo law_name để index (law_name, chapter_no, …) dùng được cho Chương
+    scope = law_names or list_law_names()
+    if not scope:
+        return []
 
-    where_clause = " OR ".join(conditions)
-    sql = f"""
+    sql = """
         SELECT
             id,
             law_name,
-            chapter, article, article_name, clause, content,
+            chapter, article, article_name, clause, chunk_index, content,
             1.0::float AS similarity
         FROM law_documents
-        WHERE {where_clause}
-        ORDER BY article, clause;
+        WHERE law_name = ANY(%s)
+          AND (article = ANY(%s::int[]) OR chapter_no = ANY(%s::int[]))
+        ORDER BY article, clause, chunk_index;
     """
+    params = [scope, article_nos, chapter_nos]
 
-    conn = get_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute(sql, params)
         cols = [desc[0] for desc in cur.description]
@@ -176,48 +686,24 @@ def keyword_search(
         cur.close()
         print(f"|-- Keyword search found {len(rows)} exact matches.", flush=True)
         return rows
-    finally:
-        conn.close()
 
 
-def check_chunk_exists(
-    law_name: str,
-    chapter: str | None = None,
-    article: int | None = None,
-    clause: int | None = None,
-) -> bool:
-    """
-    Kiểm tra xem chunk đã tồn tại trong DB chưa dựa trên law_name, chapter, article, clause.
-    """
-    conn = get_connection()
-    try:
+def backfill_chapter_numbers() -> int:
+    """Tính chapter_no cho dữ liệu cũ (chưa có cột này khi ingest). Trả về số dòng cập nhật."""
+    with db_connection() as conn:
         cur = conn.cursor()
-        
-        # Xây dựng câu lệnh WHERE linh hoạt cho các giá trị None
-        sql = "SELECT 1 FROM law_documents WHERE law_name = %s"
-        params = [law_name]
-        
-        if chapter:
-            sql += " AND chapter = %s"
-            params.append(chapter)
-        else:
-            sql += " AND chapter IS NULL"
-            
-        if article:
-            sql += " AND article = %s"
-            params.append(article)
-        else:
-            sql += " AND article IS NULL"
-            
-        if clause:
-            sql += " AND clause = %s"
-            params.append(clause)
-        else:
-            sql += " AND clause IS NULL"
-            
-        cur.execute(sql, params)
-        exists = cur.fetchone() is not None
+        cur.execute("SELECT DISTINCT chapter FROM law_documents WHERE chapter IS NOT NULL AND chapter_no IS NULL;")
+        labels = [row[0] for row in cur.fetchall()]
+        updated = 0
+        for label in labels:
+            number = chapter_to_number(label)
+            if number is not None:
+                cur.execute(
+                    "UPDATE law_documents SET chapter_no = %s WHERE chapter = %s AND chapter_no IS NULL;",
+                    (number, label),
+                )
+                updated += cur.rowcount
         cur.close()
-        return exists
-    finally:
-        conn.close()
+    if updated:
+        print(f"|-- Backfilled chapter_no for {updated} rows.", flush=True)
+    return updated
@@ -0,0 +1,247 @@
+"""
+models/vector_index.py – Quản lý index vector (HNSW / IVFFlat) cho law_documents.embedding
+
+- Chọn loại index qua VECTOR_INDEX_TYPE trong config/rag_config.py.
+- IVFFlat: số list tính theo số dòng, rebuild khi dữ liệu tăng/giảm nhiều.
+- Áp dụng ivfflat.probes / hnsw.ef_search cho từng truy vấn (SET LOCAL).
+- Báo cáo kích thước index và thời gian build.
+
+Chạy tay:
+    python -m models.vector_index report
+    python -m models.vector_index rebuild [--force]
+"""
+
+from __future__ import annotations
+import json
+import math
+import sys
+import time
+from typing import Any
+
+from models.db import db_connection
+from config.rag_config import (
+    VECTOR_INDEX_TYPE,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    IVFFLAT_PROBES,
+    IVFFLAT_REBUILD_FACTOR,
+    VECTOR_INDEX_MAINTENANCE_WORK_MEM,
+)
+
+INDEX_NAME = "law_documents_embedding_idx"
+_NEW_INDEX_NAME = f"{INDEX_NAME}_new"
+
+# ivfflat.probes = round(sqrt(lists)) với lists đọc từ catalog ngay trong câu lệnh SET:
+# không cache trong process nên mọi process thấy index mới ngay sau khi rebuild (kể cả rebuild
+# từ process khác), và không tốn thêm round-trip. Cùng công thức với search_probes().
+_SET_PROBES_FROM_CATALOG = """
+    SELECT set_config('ivfflat.probes', COALESCE(
+        (SELECT GREATEST(1, ROUND(SQRT(split_part(opt, '=', 2)::int)))::int::text
+         FROM pg_class c, unnest(c.reloptions) AS opt
+         WHERE c.relname = %s AND opt LIKE 'lists=%%'),
+        '1'), true);
+"""
+
+
+def recommended_lists(rows: int) -> int:
+    """Số list IVFFlat theo khuyến nghị pgvector: rows/1000 (≤ 1 triệu dòng), sqrt(rows) khi lớn hơn."""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return max(1, int(math.sqrt(rows)))
+
+
+def _current_index(cur) -> dict[str, Any] | None:
+    """Thông tin index hiện tại: method, lists (IVFFlat), định nghĩa."""
+    cur.execute(
+        """
+        SELECT am.amname, c.reloptions, pg_get_indexdef(c.oid)
+        FROM pg_class c
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE c.relname = %s;
+        """,
+        (INDEX_NAME,),
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    method, reloptions, definition = row
+    options = dict(opt.split("=", 1) for opt in (reloptions or []))
+    return {
+        "method": method,
+        "lists": int(options["lists"]) if "lists" in options else None,
+        "definition": definition,
+    }
+
+
+def _count_rows(cur) -> int:
+    cur.execute("SELECT COUNT(*) FROM law_documents WHERE embedding IS NOT NULL;")
+    return cur.fetchone()[0]
+
+
+def _index_ddl(name: str, rows: int) -> tuple[str, dict[str, Any]]:
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        params = {"lists": recommended_lists(rows)}
+        return (
+            f"CREATE INDEX CONCURRENTLY {name} ON law_documents "
+            f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {params['lists']});",
+            params,
+        )
+    if VECTOR_INDEX_TYPE == "hnsw":
+        params = {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+        return (
+            f"CREATE INDEX CONCURRENTLY {name} ON law_documents "
+            f"USING hnsw (embedding vector_cosine_ops) "
+            f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});",
+            params,
+        )
+    raise ValueError(f"VECTOR_INDEX_TYPE không hợp lệ: {VECTOR_INDEX_TYPE!r} (cần 'hnsw' hoặc 'ivfflat')")
+
+
+def _needs_rebuild(current: dict[str, Any] | None, rows: int) -> str | None:
+    """Lý do cần rebuild, hoặc None nếu index hiện tại vẫn phù hợp."""
+    if current is None:
+        # IVFFlat trên bảng rỗng cho centroid vô nghĩa → đợi có dữ liệu
+        if VECTOR_INDEX_TYPE == "ivfflat" and rows == 0:
+            return None
+        return "missing"
+    if current["method"] != VECTOR_INDEX_TYPE:
+        return f"method {current['method']} → {VECTOR_INDEX_TYPE}"
+    if VECTOR_INDEX_TYPE == "ivfflat" and rows > 0:
+        target = recommended_lists(rows)
+        lists = current["lists"] or 1
+        if max(lists, target) / min(lists, target) >= IVFFLAT_REBUILD_FACTOR:
+            return f"lists {lists} → {target}"
+    return None
+
+
+def rebuild_vector_index(force: bool = False) -> dict[str, Any]:
+    """
+    Build lại index vector nếu cần (hoặc luôn build khi force=True).
+
+    Build index mới bằng CREATE INDEX CONCURRENTLY rồi đổi tên, nên truy vấn
+    vẫn chạy được trong lúc build. Gọi sau mỗi lần ingest hàng loạt.
+
+    Returns:
+        Báo cáo: {"rebuilt": bool, "reason": str | None, "build_seconds": float, ...}
+    """
+    with db_connection() as conn:
+        conn.autocommit = True
+        cur = conn.cursor()
+        rows = _count_rows(cur)
+        current = _current_index(cur)
+        reason = "force" if force else _needs_rebuild(current, rows)
+        if reason is None:
+            cur.close()
+            return {"rebuilt": False, "reason": None, "rows": rows}
+
+        ddl, params = _index_ddl(_NEW_INDEX_NAME, rows)
+        print(f"|-- Rebuilding vector index ({reason}): {VECTOR_INDEX_TYPE} {params}", flush=True)
+
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {_NEW_INDEX_NAME};")
+        cur.execute("SELECT set_config('maintenance_work_mem', %s, false);", (VECTOR_INDEX_MAINTENANCE_WORK_MEM,))
+        t0 = time.time()
+        cur.execute(ddl)
+        build_seconds = time.time() - t0
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME};")
+        cur.execute(f"ALTER INDEX {_NEW_INDEX_NAME} RENAME TO {INDEX_NAME};")
+        cur.execute("RESET maintenance_work_mem;")
+
+        cur.execute(
+            """
+            INSERT INTO vector_index_builds (method, params, rows, build_seconds, reason)
+            VALUES (%s, %s::jsonb, %s, %s, %s);
+            """,
+            (VECTOR_INDEX_TYPE, json.dumps(params), rows, build_seconds, reason),
+        )
+        cur.close()
+
+    print(f"|-- Vector index built in {build_seconds:.2f}s ({rows} rows).", flush=True)
+    return {
+        "rebuilt": True,
+        "reason": reason,
+        "rows": rows,
+        "method": VECTOR_INDEX_TYPE,
+        "params": params,
+        "build_seconds": build_seconds,
+    }
+
+
+def ensure_vector_index() -> dict[str, Any]:
+    """Tạo bảng lịch sử build và đảm bảo index đúng loại đã cấu hình. Gọi khi app khởi động."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS vector_index_builds (
+                id            BIGSERIAL PRIMARY KEY,
+                method        TEXT NOT NULL,
+                params        JSONB,
+                rows          BIGINT,
+                build_seconds DOUBLE PRECISION,
+                reason        TEXT,
+                built_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        cur.close()
+    return rebuild_vector_index()
+
+
+def search_probes(lists: int | None) -> int:
+    """Số probes IVFFlat cho mỗi truy vấn."""
+    if IVFFLAT_PROBES is not None:
+        return IVFFLAT_PROBES
+    return max(1, round(math.sqrt(lists or 1)))
+
+
+def apply_search_settings(cur) -> None:
+    """
+    Đặt tham số tìm kiếm cho transaction hiện tại (SET LOCAL):
+    hnsw.ef_search với HNSW, ivfflat.probes với IVFFlat.
+    """
+    if VECTOR_INDEX_TYPE == "hnsw":
+        cur.execute("SELECT set_config('hnsw.ef_search', %s, true);", (str(HNSW_EF_SEARCH),))
+    elif IVFFLAT_PROBES is not None:
+        cur.execute("SELECT set_config('ivfflat.probes', %s, true);", (str(IVFFLAT_PROBES),))
+    else:
+        cur.execute(_SET_PROBES_FROM_CATALOG, (INDEX_NAME,))
+
+
+def index_report() -> dict[str, Any]:
+    """Kích thước, loại, tham số index và lần build gần nhất."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        rows = _count_rows(cur)
+        current = _current_index(cur)
+        size_bytes = None
+        if current:
+            cur.execute("SELECT pg_relation_size(%s::regclass);", (INDEX_NAME,))
+            size_bytes = cur.fetchone()[0]
+        cur.execute(
+            """
+            SELECT method, params, rows, build_seconds, reason, built_at
+            FROM vector_index_builds ORDER BY built_at DESC LIMIT 1;
+            """
+        )
+        last = cur.fetchone()
+        cur.close()
+
+    return {
+        "configured_method": VECTOR_INDEX_TYPE,
+        "method": current["method"] if current else None,
+        "lists": current["lists"] if current else None,
+        "recommended_lists": recommended_lists(rows),
+        "probes": search_probes(current["lists"]) if current and current["method"] == "ivfflat" else None,
+        "definition": current["definition"] if current else None,
+        "rows": rows,
+        "size_bytes": size_bytes,
+        "size_mb": size_bytes / (1024 * 1024) if size_bytes is not None else None,
+        "last_build": dict(zip(["method", "params", "rows", "build_seconds", "reason", "built_at"], last))
+        if last else None,
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command == "rebuild":
+        print(rebuild_vector_index(force="--force" in sys.argv))
+    print(index_report())
@@ -0,0 +1,141 @@
+"""
+services/answer_cache.py – Cache câu trả lời hoàn chỉnh theo câu hỏi (khớp chính xác)
+
+Key = hash(câu hỏi đã chuẩn hoá, model trả lời, PROMPT_VERSION, phiên bản corpus).
+Hai tầng: LRU + TTL trong process, bảng answer_cache trong PostgreSQL.
+Ingest tăng phiên bản corpus (models/cache_model.bump_corpus_version) nên mọi câu
+trả lời cũ tự động không còn khớp.
+"""
+
+from __future__ import annotations
+import hashlib
+import threading
+import time
+import unicodedata
+from typing import Any
+
+from models.cache_model import get_corpus_version, load_answer, save_answer, purge_answer_cache, purge_answers
+from services.openrouter_service import CHAT_MODEL
+from services.prompt_builder import PROMPT_VERSION
+from utils.lru_cache import LRUCache
+from config.rag_config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_PERSISTENT,
+    ANSWER_CACHE_PURGE_EVERY,
+)
+
+_memory = LRUCache(ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+_stats_lock = threading.Lock()
+_stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0}
+
+# Các trường của kết quả run_rag được lưu lại (đủ để chat view hiển thị như câu trả lời mới)
+CACHED_RESULT_FIELDS = ("answer", "citations", "chunks", "candidates", "search_query", "expansion", "timings")
+
+
+def normalize_question(question: str) -> str:
+    """Chuẩn hoá Unicode (NFC), chữ thường, gộp khoảng trắng, bỏ dấu câu cuối câu."""
+    text = " ".join(unicodedata.normalize("NFC", question).lower().split())
+    return text.rstrip(" ?.!…")
+
+
+def cache_key(question: str, corpus_version: int, model: str = CHAT_MODEL) -> str:
+    raw = f"{normalize_question(question)}\x00{model}\x00{PROMPT_VERSION}\x00{corpus_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _count(field: str) -> int:
+    with _stats_lock:
+        _stats[field] += 1
+        return _stats[field]
+
+
+def get_cached_answer(question: str, corpus_version: int | None) -> dict[str, Any] | None:
+    """
+    Kết quả đã cache cho câu hỏi ở phiên bản corpus cho trước, hoặc None.
+    Kết quả trả về có "cached": True và timings["total"] là thời gian tra cache.
+    """
+    if corpus_version is None:
+        return None
+    t0 = time.time()
+    key = cache_key(question, corpus_version)
+
+    result = _memory.get(key)
+    if result is not None:
+        _count("memory_hits")
+    elif ANSWER_CACHE_PERSISTENT:
+        try:
+            result = load_answer(key, ANSWER_CACHE_TTL)
+        except Exception as e:
+            print(f"|-- Warning: Answer cache lookup failed: {e}", flush=True)
+        if result is not None:
+            _memory.set(key, result)
+            _count("persistent_hits")
+    if result is None:
+        _count("misses")
+        return None
+
+    print(f"|-- Answer cache hit: {question!r}", flush=True)
+    timings = dict(result.get("timings") or {})
+    timings["original_total"] = timings.get("total")
+    timings["total"] = time.time() - t0
+    return {**result, "timings": timings, "cached": True}
+
+
+def store_answer(question: str, result: dict[str, Any], corpus_version: int | None) -> None:
+    """
+    Lưu kết quả run_rag. corpus_version là phiên bản đọc TRƯỚC khi chạy pipeline,
+    để câu trả lời sinh ra trong lúc ingest không bị gắn với corpus mới.
+    """
+    # Kết quả lấy từ cache (kể cả cache ngữ nghĩa) không ghi lại dưới câu hỏi mới;
+    # câu trả lời bị rút gọn do quá hạn cũng không cache
+    if corpus_version is None or not result.get("answer") or result.get("cached"):
+        return
+    if (result.get("timings") or {}).get("degraded"):
+        return
+    try:
+        key = cache_key(question, corpus_version)
+        payload = {field: result.get(field) for field in CACHED_RESULT_FIELDS}
+        _memory.set(key, payload)
+        if ANSWER_CACHE_PERSISTENT:
+            save_answer(key, normalize_question(question), CHAT_MODEL, PROMPT_VERSION, corpus_version, payload)
+        stores = _count("stores")
+        # Giữ bảng trong giới hạn cả khi process chạy lâu (không chỉ dọn lúc khởi động)
+        if ANSWER_CACHE_PERSISTENT and stores % ANSWER_CACHE_PURGE_EVERY == 0:
+            deleted = purge_answer_cache(ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+            if deleted:
+                print(f"|-- Answer cache: removed {deleted} expired/excess answers.", flush=True)
+    except Exception as e:
+        print(f"|-- Warning: Answer cache store failed: {e}", flush=True)
+
+
+def current_corpus_version() -> int | None:
+    """Phiên bản corpus (None nếu tắt cache hoặc không đọc được)."""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    try:
+        return get_corpus_version()
+    except Exception as e:
+        print(f"|-- Warning: Answer cache unavailable: {e}", flush=True)
+        return None
+
+
+def purge_expired() -> int:
+    """Dọn bảng answer_cache (hết hạn / vượt ANSWER_CACHE_SIZE). Gọi khi app khởi động."""
+    if not (ANSWER_CACHE_ENABLED and ANSWER_CACHE_PERSISTENT):
+        return 0
+    deleted = purge_answers(ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+    if deleted:
+        print(f"|-- Answer cache: removed {deleted} expired answers.", flush=True)
+    return deleted
+
+
+def get_answer_cache_stats() -> dict[str, Any]:
+    """Bộ đếm hit/miss của cả hai tầng."""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+    stats["hit_ratio"] = (stats["memory_hits"] + stats["persistent_hits"]) / total if total else 0.0
+    stats["memory_size"] = len(_memory)
+    return stats
@@ -7,11 +7,12 @@ from __future__ import annotations
 import io
 import re
 import uuid
-import json
-from typing import Any
+from typing import Any, Iterator
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from utils.debug_dump import debug_dump, dump_id
+
 # ── Cấu hình Splitter dự phòng ───────────────────────────────────────────────
 _sub_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1200,
@@ -125,11 +126,11 @@ def _parse_to_hierarchy(text: str) -> dict[str, Any]:
     return hierarchy
 
 
-def _build_chunks_from_hierarchy(
+def _iter_chunks_from_hierarchy(
     hierarchy: dict[str, Any], 
     meta: dict[str, Any]
-) -> list[dict[str, Any]]:
-    chunks: list[dict[str, Any]] = []
+) -> Iterator[dict[str, Any]]:
+    """Sinh lần lượt từng chunk (theo thứ tự Điều → Khoản), chunk của một Khoản luôn liền nhau."""
     shared_chunk_id = str(uuid.uuid4())
     chunk_idx = 0
 
@@ -137,7 +138,7 @@ def _build_chunks_from_hierarchy(
         art: dict, 
         chapter_label: str | None, 
         chapter_title: str | None
-    ):
+    ) -> Iterator[dict[str, Any]]:
         nonlocal chunk_idx
         art_num = art["article_num"]
         art_title = art.get("article_name", "")
@@ -161,7 +162,7 @@ def _build_chunks_from_hierarchy(
                 
                 header = " ".join(header_parts)
                 
-                chunks.append({
+                yield {
                     **meta,
                     "chapter": chapter_label,
                     "article": art_num,
@@ -171,31 +172,41 @@ def _build_chunks_from_hierarchy(
                     "chunk_id": shared_chunk_id,
                     "chunk_index": chunk_idx,
                     "embedding": None,
-                })
+                }
                 chunk_idx += 1
 
     for art in hierarchy["orphan_articles"]:
-        _process_article(art, None, None)
+        yield from _process_article(art, None, None)
     for chap in hierarchy["chapters"]:
         for art in chap["articles"]:
-            _process_article(art, chap["chapter_name"], chap.get("chapter_title"))
+            yield from _process_article(art, chap["chapter_name"], chap.get("chapter_title"))
 
-    return chunks
 
+def _build_chunks_from_hierarchy(
+    hierarchy: dict[str, Any], 
+    meta: dict[str, Any]
+) -> list[dict[str, Any]]:
+    return list(_iter_chunks_from_hierarchy(hierarchy, meta))
 
-def _text_to_chunks(text: str, meta: dict[str, Any]) -> list[dict[str, Any]]:
+
+def _iter_text_chunks(text: str, meta: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    """
+    Phiên bản generator của _text_to_chunks: chunk được trả ngay khi dựng xong,
+    để các bước embed / ghi DB bắt đầu trước khi parse hết văn bản.
+    """
     hierarchy = _parse_to_hierarchy(text)
+    debug_dump(dump_id(), "hierarchy.json", hierarchy)
+
+    produced = False
+    for chunk in _iter_chunks_from_hierarchy(hierarchy, meta):
+        produced = True
+        yield chunk
     
-    with open("hierarchy_debug.json", "w", encoding="utf-8") as f:
-        json.dump(hierarchy, f, indent=4, ensure_ascii=False)
-        
-    chunks = _build_chunks_from_hierarchy(hierarchy, meta)
-    
-    if not chunks:
+    if not produced:
         shared_chunk_id = str(uuid.uuid4())
         raw_texts = _sub_splitter.split_text(text)
         for i, t in enumerate(raw_texts):
-            chunks.append({
+            chunk = {
                 **meta,
                 "chapter": None, 
                 "article": None, 
@@ -205,30 +216,50 @@ def _text_to_chunks(text: str, meta: dict[str, Any]) -> list[dict[str, Any]]:
                 "chunk_id": shared_chunk_id, 
                 "chunk_index": i, 
                 "embedding": None
-            })
-    
-    with open("chunks_debug.json", "w", encoding="utf-8") as f:
-        json.dump(chunks, f, indent=4, ensure_ascii=False)
-        
-    return chunks
+            }
+            yield chunk
 
 
-def parse_pdf(file_bytes: bytes, filename: str) -> list[dict[str, Any]]:
+def _text_to_chunks(text: str, meta: dict[str, Any]) -> list[dict[str, Any]]:
+    return list(_iter_text_chunks(text, meta))
+
+
+def _extract_pdf_text(file_bytes: bytes) -> str:
     try: import pdfplumber
     except ImportError: raise ImportError("Cần cài pdfplumber: pip install pdfplumber")
-    meta = _make_meta_from_filename(filename)
     pages = []
     with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
         for page in pdf.pages:
             t = page.extract_text()
             if t: pages.append(t)
-    return _text_to_chunks("\n\n".join(pages), meta)
+    return "\n\n".join(pages)
 
 
-def parse_docx(file_bytes: bytes, filename: str) -> list[dict[str, Any]]:
+def _extract_docx_text(file_bytes: bytes) -> str:
     try: from docx import Document
     except ImportError: raise ImportError("Cần cài python-docx: pip install python-docx")
-    meta = _make_meta_from_filename(filename)
     doc = Document(io.BytesIO(file_bytes))
-    full_text = "\n\n".join([p.text.strip() for p in doc.paragraphs if p.text.strip()])
-    return _text_to_chunks(full_text, meta)
+    return "\n\n".join([p.text.strip() for p in doc.paragraphs if p.text.strip()])
+
+
+def parse_pdf(file_bytes: bytes, filename: str) -> list[dict[str, Any]]:
+    return _text_to_chunks(_extract_pdf_text(file_bytes), _make_meta_from_filename(filename))
+
+
+def parse_docx(file_bytes: bytes, filename: str) -> list[dict[str, Any]]:
+    return _text_to_chunks(_extract_docx_text(file_bytes), _make_meta_from_filename(filename))
+
+
+def iter_chunks(file_bytes: bytes, filename: str, file_type: str) -> Iterator[dict[str, Any]]:
+    """
+    Parse file thành chunk theo kiểu generator ("pdf" | "docx").
+    Trích xuất văn bản vẫn chạy một lần (cần toàn văn để tách Chương/Điều),
+    chunk được sinh dần trong lúc dựng.
+    """
+    if file_type == "pdf":
+        text = _extract_pdf_text(file_bytes)
+    elif file_type == "docx":
+        text = _extract_docx_text(file_bytes)
+    else:
+        raise ValueError(f"Định dạng file không được hỗ trợ: {filename}")
+    yield from _iter_text_chunks(text, _make_meta_from_filename(filename))
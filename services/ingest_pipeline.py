@@ -0,0 +1,322 @@
+"""
+services/ingest_pipeline.py – Pipeline ingest theo bước, chạy song song với hàng đợi có giới hạn
+
+    parse (generator) ─▶ [embed queue] ─▶ INGEST_EMBED_WORKERS luồng embed ─▶ [write queue] ─▶ 1 luồng ghi DB
+
+- Parse + so sánh: chunk sinh ra đến đâu thì tính content_hash và so với DB theo từng Khoản
+  đến đó; chỉ chunk của Khoản mới / đã thay đổi được gom batch (EMBED_BATCH_SIZE) gửi đi embed.
+- Embed: nhiều batch gọi API đồng thời (giới hạn tốc độ / retry do utils/rate_limit.py lo).
+- Ghi: một luồng duy nhất COPY từng batch vào bảng tạm của DocumentWriter (một transaction),
+  cuối cùng xoá Khoản cũ, chuyển sang law_documents và ghi phiên bản.
+
+Hàng đợi chứa tối đa INGEST_QUEUE_SIZE batch: bước nhanh bị chặn khi bước sau chưa kịp xử lý
+(backpressure), bộ nhớ không phình và thời gian tổng ≈ thời gian của bước chậm nhất.
+Các luồng không gọi Streamlit; controller đọc stats() để cập nhật progress bar.
+"""
+
+from __future__ import annotations
+import queue
+import threading
+import time
+from typing import Any, Iterator
+
+from config.rag_config import EMBED_BATCH_SIZE, INGEST_EMBED_WORKERS, INGEST_QUEUE_SIZE
+from models.embedding import get_embeddings
+from models.law_model import BulkInsertError, DocumentWriter, clause_key, content_hash
+
+# Đánh dấu hết dữ liệu trong hàng đợi
+_DONE = object()
+
+STAGES = ("parse", "embed", "write")
+
+
+class _ClauseDiff:
+    """So sánh từng Khoản với phiên bản trong DB ngay khi parse xong Khoản đó."""
+
+    def __init__(self, old_clauses: dict[tuple, list[str]]):
+        self.old = old_clauses
+        self.items: dict[tuple, list[tuple[int, dict[str, Any]]]] = {}
+        self.status: dict[tuple, str] = {}
+        self.sent: dict[tuple, int] = {}
+
+    def add(self, key: tuple, index: int, chunk: dict[str, Any]) -> None:
+        self.items.setdefault(key, []).append((index, chunk))
+
+    def close(self, key: tuple) -> list[tuple[int, dict[str, Any]]]:
+        """
+        Khoản `key` vừa parse xong một đoạn liền nhau; trả về các chunk cần embed.
+        Một Khoản xuất hiện lại sau đó (hiếm) được so sánh lại trên toàn bộ chunk của nó.
+        """
+        items = self.items[key]
+        previous = self.status.get(key)
+        if previous in ("added", "changed"):
+            # Đã gửi đi embed: giữ trạng thái, chỉ gửi phần mới
+            status = previous
+        elif key not in self.old:
+            status = "added"
+        elif [c["content_hash"] for _, c in items] != self.old[key]:
+            status = "changed"
+        else:
+            status = "unchanged"
+        self.status[key] = status
+        if status == "unchanged":
+            return []
+        fresh = items[self.sent.get(key, 0):]
+        self.sent[key] = len(items)
+        return fresh
+
+    def keys(self, status: str) -> list[tuple]:
+        return [k for k, s in self.status.items() if s == status]
+
+    def removed(self) -> list[tuple]:
+        return [k for k in self.old if k not in self.status]
+
+
+class IngestPipeline:
+    """
+    Chạy ingest một văn bản trên các luồng nền.
+
+    Ví dụ:
+        pipeline = IngestPipeline(chunks, law_name, state["clauses"], filename, file_hash)
+        pipeline.start()
+        while not pipeline.join(timeout=0.25):
+            show(pipeline.stats())
+        result = pipeline.result()
+    """
+
+    def __init__(
+        self,
+        chunks: Iterator[dict[str, Any]],
+        law_name: str,
+        old_clauses: dict[tuple, list[str]],
+        filename: str,
+        file_hash: str,
+        embed_workers: int = INGEST_EMBED_WORKERS,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        batch_size: int = EMBED_BATCH_SIZE,
+    ):
+        self.law_name = law_name
+        self.filename = filename
+        self.file_hash = file_hash
+        self.errors: list[str] = []
+        self.synced: dict[str, Any] | None = None
+        self.parse_error: Exception | None = None
+
+        self._chunks = chunks
+        self._diff = _ClauseDiff(old_clauses)
+        self._embed_workers = max(1, embed_workers)
+        self._batch_size = max(1, batch_size)
+        self._embed_queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._write_queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop = threading.Event()
+        self._failed_clauses: set[tuple] = set()
+        self._written: list[tuple[int, dict[str, Any]]] = []
+        self._summary: dict[str, Any] = {}
+
+        self._lock = threading.Lock()
+        self._counts = {stage: 0 for stage in STAGES}
+        self._counts["pending"] = 0
+        self._last = {name: 0.0 for name in self._counts}
+        self._parse_done = False
+        self._started = 0.0
+        self._finished = 0.0
+        self._threads: list[threading.Thread] = []
+
+    # ── Điều khiển ───────────────────────────────────────────────────────────
+    def start(self) -> None:
+        self._started = time.time()
+        self._threads = [threading.Thread(target=self._parse_stage, name="ingest-parse", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._embed_stage, name=f"ingest-embed-{i}", daemon=True)
+            for i in range(self._embed_workers)
+        ]
+        self._threads.append(threading.Thread(target=self._write_stage, name="ingest-write", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Chờ luồng ghi (luồng kết thúc sau cùng); True khi pipeline đã xong."""
+        writer = self._threads[-1]
+        writer.join(timeout)
+        return not writer.is_alive()
+
+    def _count(self, stage: str, n: int) -> None:
+        with self._lock:
+            self._counts[stage] += n
+            self._last[stage] = time.time()
+
+    # ── Các bước ─────────────────────────────────────────────────────────────
+    def _parse_stage(self) -> None:
+        batch: list[tuple[int, dict[str, Any]]] = []
+
+        def emit(items: list[tuple[int, dict[str, Any]]]) -> None:
+            nonlocal batch
+            if items:
+                self._count("pending", len(items))
+            for item in items:
+                batch.append(item)
+                if len(batch) >= self._batch_size:
+                    self._embed_queue.put(batch)
+                    batch = []
+
+        current = None
+        try:
+            for index, chunk in enumerate(self._chunks):
+                if self._stop.is_set():
+                    break
+                chunk["content_hash"] = content_hash(chunk["content"])
+                key = clause_key(chunk)
+                if current is not None and key != current:
+                    emit(self._diff.close(current))
+                current = key
+                self._diff.add(key, index, chunk)
+                self._count("parse", 1)
+            if current is not None and not self._stop.is_set():
+                emit(self._diff.close(current))
+            if batch:
+                self._embed_queue.put(batch)
+        except Exception as e:
+            self.parse_error = e
+            self._stop.set()
+        finally:
+            with self._lock:
+                self._parse_done = True
+            for _ in range(self._embed_workers):
+                self._embed_queue.put(_DONE)
+
+    def _embed_stage(self) -> None:
+        while True:
+            batch = self._embed_queue.get()
+            if batch is _DONE:
+                self._write_queue.put(_DONE)
+                return
+            if self._stop.is_set():
+                continue
+            error = None
+            try:
+                vectors = get_embeddings([chunk["content"] for _, chunk in batch], batch_size=len(batch))
+                for (_, chunk), vec in zip(batch, vectors):
+                    chunk["embedding"] = vec
+            except Exception as e:
+                error = e
+            self._count("embed", len(batch))
+            self._write_queue.put((batch, error))
+
+    def _write_stage(self) -> None:
+        finished_workers = 0
+        writer: DocumentWriter | None = None
+        try:
+            while finished_workers < self._embed_workers:
+                item = self._write_queue.get()
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+                batch, error = item
+                if error is not None:
+                    # Khoản embed lỗi: giữ nguyên bản cũ trong DB, không ghi bản mới dở dang
+                    self.errors.extend(f"[chunk {i}] {error}" for i, _ in batch)
+                    self._failed_clauses.update(clause_key(chunk) for _, chunk in batch)
+                    continue
+                if self._stop.is_set():
+                    continue
+                if writer is None:
+                    writer = DocumentWriter(self.law_name).__enter__()
+                self._written.extend(batch)
+                writer.write([chunk for _, chunk in batch])
+                self._count("write", len(batch))
+
+            if self.parse_error is not None:
+                return
+            summary = self._summarize()
+            if writer is None and summary["removed"]:
+                writer = DocumentWriter(self.law_name).__enter__()
+            if writer is not None:
+                self.synced = writer.finish(
+                    stale_clauses=summary["changed"] + summary["removed"],
+                    skip_clauses=list(self._failed_clauses),
+                    filename=self.filename,
+                    # Có Khoản embed lỗi: không lưu hash để lần upload lại cùng file không bị
+                    # coi là "giống hệt" và các Khoản đó được thử lại
+                    file_hash=None if self._failed_clauses else self.file_hash,
+                    stats={
+                        "added": len(summary["added"]),
+                        "changed": len(summary["changed"]),
+                        "removed": len(summary["removed"]),
+                        "unchanged": summary["unchanged"],
+                    },
+                )
+        except BulkInsertError as e:
+            self._stop.set()
+            for pos, err in e.failed_rows:
+                label = self._written[pos][0] if 0 <= pos < len(self._written) else "*"
+                self.errors.append(f"[chunk {label}] {err}")
+            self.errors.append(f"Đã rollback {len(self._written)} chunks của văn bản.")
+        except Exception as e:
+            self._stop.set()
+            self.errors.append(f"Lỗi ghi DB: {e}")
+        finally:
+            if writer is not None:
+                # Đã finish() → commit; chưa (lỗi / parse hỏng) → rollback
+                try:
+                    writer.__exit__(None, None, None)
+                except Exception as e:
+                    self.errors.append(f"Lỗi ghi DB: {e}")
+                    self.synced = None
+            # Xả hàng đợi để các luồng embed không bị chặn khi bước ghi dừng sớm
+            while finished_workers < self._embed_workers:
+                if self._write_queue.get() is _DONE:
+                    finished_workers += 1
+            self._finished = time.time()
+
+    def _summarize(self) -> dict[str, Any]:
+        failed = self._failed_clauses
+        added = [k for k in self._diff.keys("added") if k not in failed]
+        changed = [k for k in self._diff.keys("changed") if k not in failed]
+        self._summary = {
+            "added": added,
+            "changed": changed,
+            "removed": self._diff.removed(),
+            "unchanged": len(self._diff.keys("unchanged")),
+        }
+        return self._summary
+
+    # ── Kết quả / số liệu ────────────────────────────────────────────────────
+    def stats(self) -> dict[str, Any]:
+        """Số chunk đã qua từng bước, thông lượng (chunk/s) và độ đầy hàng đợi."""
+        now = self._finished or time.time()
+        with self._lock:
+            counts = dict(self._counts)
+            last = dict(self._last)
+            parse_done = self._parse_done
+        done = {"parse": parse_done, "embed": bool(self._finished), "write": bool(self._finished)}
+        rates = {}
+        for stage in STAGES:
+            # Bước đã xong: tính tới lần cuối nó xử lý một mục, để thông lượng không bị "loãng"
+            end = (last[stage] or now) if done[stage] else now
+            rates[stage] = counts[stage] / max(1e-6, end - self._started)
+        return {
+            **counts,
+            "parse_done": parse_done,
+            "elapsed": now - self._started,
+            "rates": rates,
+            "embed_queue": self._embed_queue.qsize(),
+            "write_queue": self._write_queue.qsize(),
+        }
+
+    def result(self) -> dict[str, Any]:
+        """
+        Kết quả sau khi join() trả True:
+            {"synced", "errors", "parse_error", "total", "pending",
+             "added", "changed", "removed", "unchanged", "stats"}
+        """
+        stats = self.stats()
+        summary = self._summary or {"added": [], "changed": [], "removed": [], "unchanged": 0}
+        return {
+            "synced": self.synced,
+            "errors": list(self.errors),
+            "parse_error": self.parse_error,
+            "total": stats["parse"],
+            "pending": stats["pending"],
+            **summary,
+            "stats": stats,
+        }
@@ -1,27 +1,64 @@
 """
 services/openrouter_service.py – LangChain ChatOpenAI qua OpenRouter
+
+Registry LLM dùng chung cho cả process:
+- ChatOpenAI được tạo một lần cho mỗi cặp (model, temperature) và dùng lại.
+- Dùng httpx.Client / httpx.AsyncClient chung của models/clients.py (keep-alive, HTTP/2 tuỳ chọn,
+  transport giới hạn tốc độ / retry / gộp request của utils/rate_limit.py), nên retry của
+  LangChain được tắt.
 """
 
 import os
-from dotenv import load_dotenv
+import threading
+
 from langchain_openai import ChatOpenAI
 
-load_dotenv()
+from config.rag_config import LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS
+from models.clients import OPENROUTER_BASE_URL, get_async_http_client, get_http_client, http2_enabled
+from utils.rate_limit import get_rate_limit_stats
 
 CHAT_MODEL = os.getenv("OPENROUTER_CHAT_MODEL", "openrouter/auto")
 
+_lock = threading.Lock()
+_llms: dict[tuple[str, float], ChatOpenAI] = {}
+
 
 def get_llm(temperature: float = 0.2, model_name: str | None = None) -> ChatOpenAI:
     """
     Trả về LangChain ChatOpenAI trỏ đến OpenRouter.
-    Dùng trong LCEL chain.
+    Dùng trong LCEL chain. Mỗi cặp (model, temperature) chỉ tạo một lần.
     """
-    return ChatOpenAI(
-        model=model_name or CHAT_MODEL,
-        temperature=temperature,
-        openai_api_key=os.getenv("OPENROUTER_API_KEY", ""),
-        openai_api_base="https://openrouter.ai/api/v1",
+    key = (model_name or CHAT_MODEL, float(temperature))
+    llm = _llms.get(key)
+    if llm is not None:
+        return llm
+
+    http_client = get_http_client()
+    http_async_client = get_async_http_client()
+    with _lock:
+        if key not in _llms:
+            _llms[key] = ChatOpenAI(
+                model=key[0],
+                temperature=key[1],
+                openai_api_key=os.getenv("OPENROUTER_API_KEY", ""),
+                openai_api_base=OPENROUTER_BASE_URL,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                max_retries=0,
+            )
+        return _llms[key]
+
+
+def get_client_stats() -> dict:
+    """Số LLM trong registry, cấu hình connection pool và số liệu rate limit / retry."""
+    stats = get_rate_limit_stats()
+    stats.update(
+        llms=[f"{model} @ {temperature}" for model, temperature in _llms],
+        http2=http2_enabled(),
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
     )
+    return stats
 
 
 def chat_completion(messages: list[dict], temperature: float = 0.2) -> str:
@@ -3,10 +3,22 @@ services/prompt_builder.py – LangChain ChatPromptTemplate cho RAG luật Việ
 """
 
 from __future__ import annotations
+import hashlib
+from functools import lru_cache
 from typing import Any
 
 from langchain_core.prompts import ChatPromptTemplate
 
+from services.openrouter_service import CHAT_MODEL
+from config.rag_config import CONTEXT_TOKEN_BUDGET, CONTEXT_TOKENIZER_FALLBACK, CONTEXT_MAX_OVERLAP_CHARS
+
+# Header parser gắn vào chunk ("Chương … Điều … Khoản …:") không dài quá ngưỡng này
+_MAX_HEADER_CHARS = 300
+# Overlap ngắn hơn ngưỡng này coi là trùng ngẫu nhiên, không cắt
+_MIN_OVERLAP_CHARS = 20
+# Token cho "[i] ", xuống dòng và dấu phân cách "---" giữa các nhóm
+_GROUP_OVERHEAD_TOKENS = 8
+
 # ── System prompt ─────────────────────────────────────────────────────────────
 SYSTEM_PROMPT = """Bạn là **trợ lý pháp lý AI** chuyên về luật Việt Nam, hỗ trợ người dùng tra cứu, giải thích và áp dụng các quy định pháp luật một cách chính xác.
 
@@ -28,27 +40,79 @@ SYSTEM_PROMPT = """Bạn là **trợ lý pháp lý AI** chuyên về luật Vi
 - Kết thúc mỗi câu trả lời bằng phần **📌 Nguồn tham khảo:**."""
 
 # ── LangChain ChatPromptTemplate ─────────────────────────────────────────────
+HUMAN_PROMPT = "CONTEXT:\n{context}\n\nCÂU HỎI: {question}"
+
 RAG_PROMPT = ChatPromptTemplate.from_messages(
     [
         ("system", SYSTEM_PROMPT),
-        (
-            "human",
-            "CONTEXT:\n{context}\n\nCÂU HỎI: {question}",
-        ),
+        ("human", HUMAN_PROMPT),
     ]
 )
 
+# Phiên bản prompt (hash nội dung): đổi prompt → câu trả lời đã cache tự động không còn khớp
+PROMPT_VERSION = hashlib.sha256(f"{SYSTEM_PROMPT}\x00{HUMAN_PROMPT}".encode("utf-8")).hexdigest()[:12]
 
-def build_context(chunks: list[dict[str, Any]]) -> str:
-    """
-    Ghép danh sách chunks thành chuỗi context đưa vào prompt.
-
-    Args:
-        chunks: Kết quả vector search (list dict từ law_model.py).
 
-    Returns:
-        Chuỗi context gồm các đoạn trích dẫn có header.
+def count_tokens(text: str, model: str = CHAT_MODEL) -> int:
     """
+    Số token của văn bản theo tokenizer của model trả lời (tiktoken).
+    Model không có trong tiktoken (vd. "openrouter/auto") dùng CONTEXT_TOKENIZER_FALLBACK;
+    thiếu tiktoken thì ước lượng ~3 ký tự / token.
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text))
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        print("|-- Warning: tiktoken chưa được cài, đếm token bằng ước lượng.", flush=True)
+        return None
+    try:
+        return tiktoken.encoding_for_model(model.split("/")[-1])
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding(CONTEXT_TOKENIZER_FALLBACK)
+    except Exception as e:
+        print(f"|-- Warning: Không tải được tokenizer {CONTEXT_TOKENIZER_FALLBACK}: {e}", flush=True)
+        return None
+
+
+def _strip_header(content: str) -> str:
+    """Bỏ header "Chương … Điều … Khoản …:" mà parser gắn vào đầu mỗi chunk."""
+    head, sep, body = content.partition(":\n")
+    if sep and len(head) <= _MAX_HEADER_CHARS:
+        return body.strip()
+    return content.strip()
+
+
+def _strip_overlap(previous: str, text: str) -> str:
+    """Bỏ phần đầu của text trùng với phần cuối của đoạn trước (overlap của text splitter)."""
+    longest = min(len(previous), len(text), CONTEXT_MAX_OVERLAP_CHARS)
+    for size in range(longest, _MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+
+def _group_ref(chunk: dict[str, Any]) -> str:
+    ref = chunk.get("law_name", "")
+    if chunk.get("chapter"):
+        ref += f" – {chunk['chapter']}"
+    if chunk.get("article"):
+        ref += f" – Điều {chunk['article']}"
+        if chunk.get("article_name"):
+            ref += f" ({chunk['article_name']})"
+    return ref
+
+
+def _verbatim_context(chunks: list[dict[str, Any]]) -> str:
+    """Context kiểu cũ (ghép nguyên văn từng chunk), dùng để tính số token tiết kiệm."""
     parts: list[str] = []
     for i, chunk in enumerate(chunks, 1):
         law   = chunk.get("law_name", "")
@@ -71,6 +135,85 @@ def build_context(chunks: list[dict[str, Any]]) -> str:
     return "\n\n---\n\n".join(parts)
 
 
+def pack_context(
+    chunks: list[dict[str, Any]],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    model: str = CHAT_MODEL,
+) -> tuple[str, dict[str, Any]]:
+    """
+    Đóng gói chunks thành context trong giới hạn token.
+
+    - Lấy chunk theo thứ tự rerank tới khi hết budget token.
+    - Gộp các Khoản của cùng một Điều dưới một header duy nhất, sắp theo thứ tự văn bản.
+    - Bỏ header lặp trong từng chunk và phần overlap giữa các đoạn con liên tiếp.
+
+    Returns:
+        (context, stats) với stats gồm raw_tokens (ghép nguyên văn), packed_tokens,
+        tokens_saved, chunks_used, chunks_dropped.
+    """
+    groups: dict[Any, list[dict[str, Any]]] = {}
+    used = 0
+    dropped = 0
+    for chunk in chunks:
+        key = (chunk.get("law_name"), chunk.get("article")) if chunk.get("article") else ("id", chunk.get("id"))
+        cost = count_tokens(_strip_header(chunk.get("content", "")), model)
+        if key not in groups:
+            cost += count_tokens(_group_ref(chunk), model) + _GROUP_OVERHEAD_TOKENS
+        if used + cost > budget:
+            dropped += 1
+            continue
+        groups.setdefault(key, []).append(chunk)
+        used += cost
+
+    parts: list[str] = []
+    for i, members in enumerate(groups.values(), 1):
+        members = sorted(members, key=lambda c: (c.get("clause") or 0, c.get("chunk_index") or 0))
+        lines: list[str] = []
+        prev: dict[str, Any] | None = None
+        prev_body = ""
+        for chunk in members:
+            body = _strip_header(chunk.get("content", ""))
+            if prev is not None and prev.get("chunk_index") is not None and chunk.get("chunk_index") is not None:
+                step = chunk["chunk_index"] - prev["chunk_index"]
+                if step == 1 and chunk.get("clause") == prev.get("clause"):
+                    # Đoạn con nối tiếp của cùng Khoản: bỏ overlap, nối vào dòng trước
+                    lines[-1] += " " + _strip_overlap(prev_body, body)
+                    prev, prev_body = chunk, body
+                    continue
+                if step > 1:
+                    lines.append("[…]")
+            lines.append(body)
+            prev, prev_body = chunk, body
+        parts.append(f"[{i}] {_group_ref(members[0])}\n" + "\n".join(lines))
+
+    context = "\n\n---\n\n".join(parts)
+    raw_tokens = count_tokens(_verbatim_context(chunks), model)
+    packed_tokens = count_tokens(context, model)
+    stats = {
+        "raw_tokens": raw_tokens,
+        "packed_tokens": packed_tokens,
+        "tokens_saved": raw_tokens - packed_tokens,
+        "chunks_used": len(chunks) - dropped,
+        "chunks_dropped": dropped,
+        "budget": budget,
+    }
+    return context, stats
+
+
+def build_context(chunks: list[dict[str, Any]]) -> str:
+    """
+    Ghép danh sách chunks thành chuỗi context đưa vào prompt (đóng gói theo budget token,
+    xem pack_context).
+
+    Args:
+        chunks: Kết quả vector search (list dict từ law_model.py).
+
+    Returns:
+        Chuỗi context gồm các đoạn trích dẫn có header.
+    """
+    return pack_context(chunks)[0]
+
+
 def format_citations(chunks: list[dict[str, Any]]) -> list[str]:
     """Tạo danh sách chuỗi trích dẫn hiển thị trong UI."""
     citations: list[str] = []
@@ -1,24 +1,48 @@
 """
 services/query_expansion.py – Mở rộng truy vấn bằng các từ đồng nghĩa pháp lý.
+
+Chính sách mở rộng (decide_expansion) quyết định cho từng câu hỏi: bỏ qua LLM khi
+câu hỏi nêu Điều/Chương cụ thể hoặc vector search trên câu gốc đã rất khớp, xin ít
+biến thể hơn khi kết quả sơ bộ khá tốt, và dùng lại biến thể đã sinh (cache).
+Mọi quyết định được ghi vào EXPANSION_LOG_PATH để đánh giá lại (eval_expansion.py).
 """
 
 from __future__ import annotations
+import json
+import os
+import threading
+import time
+import unicodedata
+from typing import Any, AsyncIterator
+
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from services.openrouter_service import get_llm
+from utils.lru_cache import LRUCache
+from utils.text import syllables
+from config.rag_config import (
+    EXPANSION_SKIP_SIMILARITY,
+    EXPANSION_LIGHT_SIMILARITY,
+    EXPANSION_LIGHT_VARIANTS,
+    EXPANSION_SHORT_QUERY_SYLLABLES,
+    EXPANSION_LONG_QUERY_SYLLABLES,
+    EXPANSION_CACHE_SIZE,
+    EXPANSION_CACHE_TTL,
+    EXPANSION_LOG_PATH,
+)
 
 SIMILAR_QUESTIONS_PROMPT = ChatPromptTemplate.from_messages([
     ("system", """Bạn là chuyên gia ngôn ngữ pháp lý Việt Nam. 
-Nhiệm vụ của bạn là lấy một câu hỏi của người dùng và viết lại nó thành 5 câu hỏi khác nhau nhưng có cùng ý nghĩa nội dung.
+Nhiệm vụ của bạn là lấy một câu hỏi của người dùng và viết lại nó thành {n} câu hỏi khác nhau nhưng có cùng ý nghĩa nội dung.
 
 QUY TẮC:
-1. Trả về đúng 5 câu hỏi, mỗi câu trên một dòng.
+1. Trả về đúng {n} câu hỏi, mỗi câu trên một dòng.
 2. Các câu hỏi phải đa dạng về cách dùng từ nhưng giữ nguyên ý nghĩa cốt lõi của câu hỏi gốc.
 3. Tập trung vào các thuật ngữ chuyên môn có khả năng xuất hiện trong văn bản luật.
 4. KHÔNG trả lời câu hỏi, chỉ viết lại câu hỏi.
 5. Chỉ trả về các câu hỏi, không thêm bất kỳ văn bản giải thích nào khác.
 
-Ví dụ:
+Ví dụ (5 câu hỏi):
 Input: "lấy trộm xe máy bị phạt thế nào?"
 Output:
 Xử lý hành vi trộm cắp xe gắn máy như thế nào?
@@ -30,26 +54,170 @@ Quy định về việc xử phạt hành vi lấy cắp xe máy?
     ("human", "{question}")
 ])
 
-def generate_similar_questions(question: str) -> list[str]:
+EXPANSION_MODEL = "openai/gpt-4o-mini"
+MAX_VARIANTS = 5
+
+# Biến thể đã sinh: key = câu hỏi đã chuẩn hoá → danh sách biến thể (dài nhất đã có)
+_expansion_cache = LRUCache(EXPANSION_CACHE_SIZE, ttl=EXPANSION_CACHE_TTL)
+_log_lock = threading.Lock()
+
+
+def _cache_key(question: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", question).lower().split())
+
+
+def decide_expansion(
+    question: str,
+    refs: dict[str, list[str]] | None = None,
+    top_similarity: float | None = None,
+) -> dict[str, Any]:
     """
-    Sử dụng LLM để viết lại câu hỏi thành 5 biến thể khác nhau.
-    Trả về list gồm [câu hỏi gốc, biến thể 1, ..., biến thể 5]
+    Chính sách mở rộng câu hỏi: có gọi LLM không, xin bao nhiêu biến thể, có dùng lại cache không.
+
+    Args:
+        question:       Câu hỏi gốc.
+        refs:           Kết quả extract_legal_references (Điều/Chương cụ thể).
+        top_similarity: Similarity cao nhất của vector search trên câu hỏi gốc.
+
+    Returns:
+        {"expand": bool, "n_variants": int, "reason": str, "cached": bool, "syllables": int}
+    """
+    n_syllables = len(syllables(question))
+    decision = {"expand": True, "n_variants": MAX_VARIANTS, "reason": "default", "cached": False, "syllables": n_syllables}
+
+    if refs and (refs.get("articles") or refs.get("chapters")):
+        # Tham chiếu chính xác → keyword search đã lấy đúng Điều/Chương
+        decision.update(expand=False, n_variants=0, reason="exact_reference")
+    elif top_similarity is not None and top_similarity >= EXPANSION_SKIP_SIMILARITY:
+        decision.update(expand=False, n_variants=0, reason="strong_first_pass")
+    elif n_syllables <= EXPANSION_SHORT_QUERY_SYLLABLES:
+        # Câu quá ngắn (chỉ vài từ khoá) được lợi nhiều nhất từ việc viết lại
+        decision.update(reason="short_query")
+    elif top_similarity is not None and top_similarity >= EXPANSION_LIGHT_SIMILARITY:
+        decision.update(n_variants=EXPANSION_LIGHT_VARIANTS, reason="good_first_pass")
+    elif n_syllables >= EXPANSION_LONG_QUERY_SYLLABLES:
+        # Câu dài đã đủ ngữ cảnh, chỉ cần vài cách diễn đạt khác
+        decision.update(n_variants=EXPANSION_LIGHT_VARIANTS, reason="long_query")
+
+    if decision["expand"]:
+        cached = _expansion_cache.get(_cache_key(question))
+        if cached is not None and len(cached) >= decision["n_variants"]:
+            decision["cached"] = True
+    return decision
+
+
+def cached_variants(question: str, n: int) -> list[str] | None:
+    """Biến thể đã sinh trước đó cho câu hỏi này (None nếu chưa có đủ n biến thể)."""
+    cached = _expansion_cache.get(_cache_key(question))
+    if cached is None or len(cached) < n:
+        return None
+    return cached[:n]
+
+
+def _remember_variants(question: str, variants: list[str]) -> None:
+    key = _cache_key(question)
+    previous = _expansion_cache.get(key) or []
+    if len(variants) > len(previous):
+        _expansion_cache.set(key, list(variants))
+
+
+def log_expansion_decision(
+    question: str,
+    decision: dict[str, Any],
+    top_similarity: float | None,
+    n_generated: int,
+    latency: float,
+) -> None:
+    """Ghi một dòng JSONL cho mỗi quyết định (dùng làm tập replay cho eval_expansion.py)."""
+    record = {
+        "ts": time.time(),
+        "question": question,
+        "top_similarity": top_similarity,
+        **decision,
+        "n_generated": n_generated,
+        "latency": latency,
+    }
+    action = f"{decision['n_variants']} variants" if decision["expand"] else "skip"
+    if decision["cached"]:
+        action += " (cached)"
+    print(f"|-- Expansion policy: {decision['reason']} → {action} ({latency:.2f}s)", flush=True)
+    try:
+        os.makedirs(os.path.dirname(EXPANSION_LOG_PATH) or ".", exist_ok=True)
+        with _log_lock, open(EXPANSION_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"|-- Warning: Failed to log expansion decision: {e}", flush=True)
+
+
+def expansion_stats() -> dict[str, Any]:
+    """Hit/miss của cache biến thể."""
+    return _expansion_cache.stats()
+
+
+def generate_similar_questions(question: str, n: int = MAX_VARIANTS, use_cache: bool = True) -> list[str]:
+    """
+    Sử dụng LLM để viết lại câu hỏi thành n biến thể khác nhau (mặc định 5).
+    Trả về list gồm [câu hỏi gốc, biến thể 1, ..., biến thể n]
     """
     questions = [question]
+    if n <= 0:
+        return questions
+    if use_cache:
+        cached = cached_variants(question, n)
+        if cached is not None:
+            return questions + cached
     try:
-        llm = get_llm(model_name="openai/gpt-4o-mini")
+        llm = get_llm(model_name=EXPANSION_MODEL)
         chain = SIMILAR_QUESTIONS_PROMPT | llm | StrOutputParser()
-        response = chain.invoke({"question": question})
+        response = chain.invoke({"question": question, "n": n})
         
         # Tách các dòng và làm sạch
         lines = [line.strip() for line in response.strip().split('\n') if line.strip()]
         
-        # Chỉ lấy tối đa 5 biến thể đầu tiên
-        variants = lines[:5]
+        # Chỉ lấy tối đa n biến thể đầu tiên
+        variants = lines[:n]
         questions.extend(variants)
+        _remember_variants(question, variants)
         
         print(f"|-- Generated {len(variants)} similar questions", flush=True)
         return questions
     except Exception as e:
         print(f"|-- Warning: Query Expansion error: {e}", flush=True)
         return questions
+
+
+async def astream_similar_questions(question: str, n: int = MAX_VARIANTS) -> AsyncIterator[str]:
+    """
+    Phiên bản streaming của generate_similar_questions: trả từng biến thể ngay khi
+    LLM viết xong dòng đó (không gồm câu hỏi gốc), để bước tìm kiếm bắt đầu sớm.
+    Lỗi LLM chỉ được log lại; các biến thể đã trả về vẫn dùng được.
+    """
+    cached = cached_variants(question, n)
+    if cached is not None:
+        for variant in cached:
+            yield variant
+        return
+
+    variants: list[str] = []
+    buffer = ""
+    try:
+        llm = get_llm(model_name=EXPANSION_MODEL)
+        chain = SIMILAR_QUESTIONS_PROMPT | llm | StrOutputParser()
+        async for piece in chain.astream({"question": question, "n": n}):
+            buffer += piece
+            while "\n" in buffer and len(variants) < n:
+                line, buffer = buffer.split("\n", 1)
+                if line.strip():
+                    variants.append(line.strip())
+                    yield line.strip()
+            if len(variants) >= n:
+                break
+        if buffer.strip() and len(variants) < n:
+            variants.append(buffer.strip())
+            yield buffer.strip()
+        print(f"|-- Generated {len(variants)} similar questions (streamed)", flush=True)
+    except Exception as e:
+        print(f"|-- Warning: Query Expansion error: {e}", flush=True)
+    finally:
+        if variants:
+            _remember_variants(question, variants)
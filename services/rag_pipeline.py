@@ -1,25 +1,60 @@
 """
 services/rag_pipeline.py – LangChain LCEL RAG pipeline
-Pipeline: embed → (keyword search + vector search) → merge → rerank → build context → LLM → answer
+Pipeline: (query expansion ∥ keyword search ∥ vector search) → lexical + merge → rerank → build context → LLM → answer
+
+run_rag trả về câu trả lời hoàn chỉnh; stream_rag trả metadata truy xuất trước rồi từng token.
 """
 
 from __future__ import annotations
+import asyncio
+import itertools
 import re
-from typing import Any
+from typing import Any, AsyncIterator, Iterator
 
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 
-from models.embedding import get_embedding
-from models.law_model import vector_search, keyword_search
-from services.prompt_builder import RAG_PROMPT, build_context, format_citations
-from services.openrouter_service import get_llm
+from models.embedding import get_embeddings
+from models.law_model import vector_search_many, keyword_search, lexical_search, list_law_names, to_vector_param
+from models.cache_model import find_similar_answers, mark_semantic_hit, purge_semantic_cache, save_semantic_answer
+from utils import event_loop
+from utils.text import fold_vietnamese
+from utils.debug_dump import debug_dump, dump_id
+from services.prompt_builder import RAG_PROMPT, PROMPT_VERSION, pack_context, format_citations
+from services.openrouter_service import CHAT_MODEL, get_llm
+from services.answer_cache import CACHED_RESULT_FIELDS
 import os
 import json
 import time
-from services.reranker import rerank
-from services.query_expansion import generate_similar_questions
-from config.rag_config import SIM_THRESHOLD, RERANK_THRESHOLD, MAX_CANDIDATES_FETCH
+from services.reranker import RerankCancelled, rerank
+from services.query_expansion import astream_similar_questions, decide_expansion, log_expansion_decision
+from config.rag_config import (
+    SIM_THRESHOLD,
+    RERANK_THRESHOLD,
+    MAX_CANDIDATES_FETCH,
+    LEXICAL_TOP_K,
+    RRF_K,
+    RERANK_MAX_CANDIDATES,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_PURGE_EVERY,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MAX_DISTANCE,
+    SEMANTIC_CACHE_LOG_PATH,
+    REQUEST_DEADLINE,
+    DEADLINE_EXPANSION,
+    DEADLINE_EMBEDDING,
+    DEADLINE_SEARCH,
+    DEADLINE_RERANK,
+    DEADLINE_LLM,
+    DEGRADED_RERANK_TOP_N,
+    DEGRADED_CONTEXT_CHUNKS,
+    DEBUG_DUMPS,
+)
+
+LLM_TIMEOUT_ANSWER = "Hệ thống đang quá tải, chưa thể tạo câu trả lời trong thời gian cho phép. Vui lòng thử lại sau."
+
+# Số lần ghi semantic_cache trong process (dọn bảng sau mỗi ANSWER_CACHE_PURGE_EVERY lần)
+_semantic_stores = itertools.count(1)
 
 
 
@@ -38,7 +73,7 @@ def extract_legal_references(question: str) -> dict[str, list[str]]:
     articles = re.findall(r"[đd]i[eềệểẹẻ]u\s+?(\d+)", question, re.IGNORECASE)
 
     # Chương X
-    chapters = re.findall(r"ch[ưươ]ng\s+([\dIVXLivxl]+)", question, re.IGNORECASE)
+    chapters = re.findall(r"ch[ưu][ơo]ng\s+([\dIVXLivxl]+)\b", question, re.IGNORECASE)
 
     return {
         "articles": list(dict.fromkeys(articles)),   # deduplicate, giữ thứ tự
@@ -46,6 +81,51 @@ def extract_legal_references(question: str) -> dict[str, list[str]]:
     }
 
 
+def fuse_rankings(
+    vector_hits: list[dict[str, Any]],
+    lexical_hits: list[dict[str, Any]],
+    k: int = RRF_K,
+) -> list[dict[str, Any]]:
+    """
+    Reciprocal Rank Fusion: score(chunk) = Σ 1 / (k + rank) trên mọi danh sách xếp hạng.
+
+    Mỗi truy vấn mở rộng là một danh sách (thứ hạng lấy từ "query_ranks" của
+    vector_search_many), full-text search là thêm một danh sách.
+
+    Returns:
+        Danh sách chunk không trùng, sắp xếp theo "rrf_score" giảm dần.
+    """
+    by_id: dict[Any, dict[str, Any]] = {}
+    scores: dict[Any, float] = {}
+
+    for chunk in vector_hits:
+        cid = chunk["id"]
+        by_id[cid] = chunk
+        scores[cid] = sum(1.0 / (k + rank) for rank in chunk.get("query_ranks", {}).values())
+
+    for rank, chunk in enumerate(lexical_hits, 1):
+        cid = chunk["id"]
+        if cid in by_id:
+            by_id[cid]["lexical_score"] = chunk.get("lexical_score")
+        else:
+            by_id[cid] = chunk
+        scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+
+    for cid, chunk in by_id.items():
+        chunk["rrf_score"] = scores[cid]
+    return sorted(by_id.values(), key=lambda c: c["rrf_score"], reverse=True)
+
+
+def detect_law_scope(question: str) -> list[str]:
+    """
+    Tìm tên văn bản (law_name trong DB) được nhắc tới trong câu hỏi.
+
+    Ví dụ: "Điều 466 bộ luật dân sự" → ["Bộ Luật Dân Sự"].
+    """
+    folded = fold_vietnamese(question)
+    return [name for name in list_law_names() if fold_vietnamese(name) in folded]
+
+
 def _build_chain():
     """
     Xây dựng LCEL chain cho RAG.
@@ -60,147 +140,532 @@ def _build_chain():
     chain = RAG_PROMPT | llm | StrOutputParser()
     return chain
 
-def run_rag(
-    question: str,
-) -> dict[str, Any]:
-    total_start = time.time()
-    print(f"\n--- [RAG START] Question: {question} ---", flush=True)
+def merge_vector_hits(hit_lists: list[list[dict[str, Any]]]) -> list[dict[str, Any]]:
     """
-    Chạy toàn bộ RAG pipeline tự động dựa trên ngưỡng điểm số (Threshold-based).
+    Gộp kết quả vector search của nhiều lần gọi (mỗi lần một nhóm truy vấn) theo id:
+    giữ similarity cao nhất, hợp các "query_ranks".
+    """
+    by_id: dict[Any, dict[str, Any]] = {}
+    for hits in hit_lists:
+        for chunk in hits:
+            cid = chunk["id"]
+            if cid not in by_id:
+                by_id[cid] = chunk
+                continue
+            merged = by_id[cid]
+            merged["similarity"] = max(merged["similarity"], chunk["similarity"])
+            merged["query_ranks"] = {**merged["query_ranks"], **chunk["query_ranks"]}
+    return sorted(by_id.values(), key=lambda c: c["similarity"], reverse=True)
 
-    Quy trình:
-    1. Embed câu hỏi.
-    2. Keyword search: phát hiện Chương/Điều cụ thể → fetch DB (sim = 1.0).
-    3. Vector search: lấy kết quả theo ngưỡng SIM_THRESHOLD.
-    4. Merge + deduplicate.
-    5. Rerank: chấm lại toàn bộ ứng viên bằng search_query.
-    6. Build context → Invoke LLM → Trả về kết quả.
+
+def _search_queries(queries: list[str], offset: int) -> list[dict[str, Any]]:
+    """Embed + vector search một nhóm truy vấn; chỉ số truy vấn trong query_ranks bắt đầu từ offset."""
+    hits = vector_search_many(get_embeddings(queries), top_k=MAX_CANDIDATES_FETCH, threshold=SIM_THRESHOLD)
+    for chunk in hits:
+        chunk["query_ranks"] = {offset + idx: rank for idx, rank in chunk["query_ranks"].items()}
+    return hits
+
+
+def _critical_path(spans: dict[str, tuple[float, float]]) -> list[str]:
+    """
+    Các bước nằm trên đường găng của phần truy xuất: bước truy xuất kết thúc muộn nhất,
+    cộng "expand" nếu bước đó phải chờ biến thể câu hỏi (vector của biến thể, lexical)
+    và "first_pass" nếu việc mở rộng phải chờ kết quả sơ bộ của câu hỏi gốc.
     """
+    retrieval = {name: span for name, span in spans.items() if name in ("keyword", "vector", "lexical", "expand")}
+    if not retrieval:
+        return []
+    last = max(retrieval, key=lambda name: retrieval[name][1])
+    path = [last]
+    if last in ("vector", "lexical") and "expand" in spans and retrieval[last][1] > spans["expand"][1]:
+        path = ["expand", last]
+        # Chính sách mở rộng đã chờ kết quả sơ bộ của câu hỏi gốc
+        if "first_pass" in spans and spans["expand"][0] >= spans["first_pass"][1]:
+            path.insert(0, "first_pass")
+    return path
 
-    # 1. Trích xuất tham chiếu luật và Mở rộng câu hỏi thành nhiều câu tương tự
+
+def _semantic_lookup(question: str, query_vector: list[float], corpus_version: int) -> dict[str, Any] | None:
+    """Câu hỏi đã trả lời gần nhất (trong ngưỡng khoảng cách) có cùng tham chiếu Điều/Chương."""
     refs = extract_legal_references(question)
-    print(f"|-- [1/8] Refs Extraction: Articles={refs['articles']}, Chapters={refs['chapters']}", flush=True)
-    
+    entries = find_similar_answers(
+        to_vector_param(query_vector), CHAT_MODEL, PROMPT_VERSION, corpus_version,
+        SEMANTIC_CACHE_MAX_DISTANCE, ANSWER_CACHE_TTL,
+    )
+    for entry in entries:
+        # "Điều 173 ..." và "Điều 174 ..." rất gần nhau về ngữ nghĩa nhưng là hai câu hỏi khác nhau
+        if extract_legal_references(entry["question"]) != refs:
+            continue
+        mark_semantic_hit(entry["id"])
+        print(
+            f"|-- Semantic cache hit: {question!r} ≈ {entry['question']!r} (distance {entry['distance']:.3f})",
+            flush=True,
+        )
+        try:
+            os.makedirs(os.path.dirname(SEMANTIC_CACHE_LOG_PATH) or ".", exist_ok=True)
+            with open(SEMANTIC_CACHE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "ts": time.time(),
+                    "question": question,
+                    "matched_question": entry["question"],
+                    "distance": entry["distance"],
+                    "corpus_version": corpus_version,
+                }, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"|-- Warning: Failed to log semantic cache hit: {e}", flush=True)
+        return entry
+    return None
+
+
+async def _asemantic_cache_hit(question: str, corpus_version: int | None) -> dict[str, Any] | None:
+    """
+    Câu trả lời đã cache của một câu hỏi tương tự (cùng phiên bản corpus), hoặc None.
+    Embedding câu hỏi được embedding_cache giữ lại cho bước vector search sau đó.
+    """
+    if corpus_version is None or not SEMANTIC_CACHE_ENABLED:
+        return None
     t0 = time.time()
-    all_queries = generate_similar_questions(question)
-    time_expand = time.time() - t0
-    print(f"|-- [2/8] Multi-Query Expansion: {len(all_queries)} queries generated ({time_expand:.2f}s)", flush=True)
-    
-    # 2. Keyword search (dựa trên câu hỏi gốc và các tham chiếu)
-    kw_hits = keyword_search(
-        articles=refs["articles"] or None, 
-        chapters=refs["chapters"] or None
+    try:
+        query_vector = (await asyncio.to_thread(get_embeddings, [question]))[0]
+        entry = await asyncio.to_thread(_semantic_lookup, question, query_vector, corpus_version)
+    except Exception as e:
+        print(f"|-- Warning: Semantic cache lookup failed: {e}", flush=True)
+        return None
+    if entry is None:
+        return None
+
+    result = dict(entry["result"])
+    timings = dict(result.get("timings") or {})
+    timings["original_total"] = timings.get("total")
+    timings["semantic_lookup"] = time.time() - t0
+    timings["total"] = timings["semantic_lookup"]
+    return {
+        **result,
+        "timings": timings,
+        "cached": "semantic",
+        "semantic_match": {"question": entry["question"], "distance": entry["distance"]},
+    }
+
+
+def _semantic_store(question: str, result: dict[str, Any], corpus_version: int | None) -> None:
+    """Lưu câu trả lời do LLM sinh ra (có tài liệu trích dẫn) vào cache ngữ nghĩa."""
+    if corpus_version is None or not SEMANTIC_CACHE_ENABLED or not result.get("chunks") or result.get("cached"):
+        return
+    if (result.get("timings") or {}).get("degraded"):
+        return
+    try:
+        query_vector = get_embeddings([question])[0]
+        payload = {field: result.get(field) for field in CACHED_RESULT_FIELDS}
+        save_semantic_answer(
+            question, to_vector_param(query_vector), CHAT_MODEL, PROMPT_VERSION, corpus_version, payload
+        )
+        # Giữ bảng (và index HNSW của nó) trong giới hạn cả khi process chạy lâu
+        if next(_semantic_stores) % ANSWER_CACHE_PURGE_EVERY == 0:
+            deleted = purge_semantic_cache(ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+            if deleted:
+                print(f"|-- Semantic cache: removed {deleted} expired/excess answers.", flush=True)
+    except Exception as e:
+        print(f"|-- Warning: Semantic cache store failed: {e}", flush=True)
+
+
+class _StageTimer:
+    """Ghi khoảng thời gian (bắt đầu, kết thúc) của từng bước để tính timings và đường găng."""
+
+    def __init__(self, deadline: float = REQUEST_DEADLINE):
+        self.start = time.time()
+        self.deadline = self.start + deadline
+        self.spans: dict[str, tuple[float, float]] = {}
+        self.extra: dict[str, Any] = {}
+        # Các bước đã bị rút gọn do quá hạn (hiển thị trong chat view)
+        self.degraded: list[str] = []
+
+    def remaining(self) -> float:
+        """Thời gian còn lại (giây) trước hạn chót của cả request."""
+        return max(0.0, self.deadline - time.time())
+
+    def budget(self, stage_deadline: float) -> float:
+        """Hạn của một bước: hạn riêng của bước, nhưng không vượt hạn của cả request."""
+        return min(stage_deadline, self.remaining())
+
+    def degrade(self, message: str) -> None:
+        self.degraded.append(message)
+        print(f"|-- Degraded: {message}", flush=True)
+
+    def record(self, name: str, t0: float, t1: float) -> None:
+        prev = self.spans.get(name)
+        self.spans[name] = (min(prev[0], t0), max(prev[1], t1)) if prev else (t0, t1)
+
+    async def timed(self, name: str, awaitable):
+        t0 = time.time()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, t0, time.time())
+
+    def duration(self, name: str) -> float:
+        return self.spans[name][1] - self.spans[name][0] if name in self.spans else 0.0
+
+    def timings(self) -> dict[str, Any]:
+        result = {name: end - begin for name, (begin, end) in self.spans.items()}
+        result.setdefault("rerank", 0.0)
+        result.update(self.extra)
+        result["degraded"] = list(self.degraded)
+        result["critical_path"] = " → ".join(
+            _critical_path(self.spans) + [n for n in ("rerank", "llm") if n in self.spans]
+        )
+        result["total"] = time.time() - self.start
+        return result
+
+
+async def _gather_within(
+    timer: _StageTimer,
+    tasks: list[asyncio.Task],
+    stage_deadline: float,
+    label: str,
+) -> list[Any]:
+    """
+    Chờ các task trong hạn của bước; task chưa xong hoặc lỗi bị bỏ qua (ghi nhận degradation).
+    Trả về kết quả của các task hoàn thành, theo thứ tự ban đầu.
+    """
+    if not tasks:
+        return []
+    limit = timer.budget(stage_deadline)
+    done, pending = await asyncio.wait(tasks, timeout=limit)
+    for task in pending:
+        task.cancel()
+    failed = [t for t in done if t.exception() is not None]
+    if pending:
+        timer.degrade(f"{label} > {limit:.1f}s: bỏ {len(pending)}/{len(tasks)} truy vấn")
+    for task in failed:
+        timer.degrade(f"{label} lỗi: {task.exception()}")
+    return [t.result() for t in tasks if t in done and t.exception() is None]
+
+
+async def _aretrieve(question: str, timer: _StageTimer) -> dict[str, Any]:
+    """
+    Phần truy xuất của pipeline (mọi thứ trước khi gọi LLM trả lời), chồng các bước độc lập.
+
+    Quy trình:
+    1. Đồng thời: keyword search theo Chương/Điều · embed + vector search câu hỏi gốc.
+       Chính sách mở rộng (decide_expansion) dựa vào tham chiếu và similarity sơ bộ
+       quyết định có gọi LLM không và xin bao nhiêu biến thể.
+    2. Mỗi biến thể được embed + vector search ngay khi LLM viết xong.
+    3. Lexical search (câu hỏi gốc + biến thể), gộp với vector search bằng RRF, merge + deduplicate.
+    4. Rerank (cascade): sơ loại rẻ → cross-encoder chấm top-N ứng viên.
+    5. Build context.
+
+    Returns:
+        Kết quả như run_rag (chưa có "timings"), kèm "context" cho LLM.
+        "answer" khác None khi không cần gọi LLM (không đủ tài liệu).
+    """
+    print(f"\n--- [RAG START] Question: {question} ---", flush=True)
+    timed = timer.timed
+
+    # 1. Trích xuất tham chiếu luật (regex, không tốn thời gian)
+    refs = extract_legal_references(question)
+
+    async def keyword_stage() -> list[dict[str, Any]]:
+        laws = await asyncio.to_thread(detect_law_scope, question) if (refs["articles"] or refs["chapters"]) else []
+        refs["laws"] = laws
+        print(
+            f"|-- [1/8] Refs Extraction: Articles={refs['articles']}, Chapters={refs['chapters']}, Laws={refs['laws']}",
+            flush=True,
+        )
+        # Keyword search (dựa trên câu hỏi gốc và các tham chiếu)
+        return await asyncio.to_thread(
+            keyword_search,
+            articles=refs["articles"] or None,
+            chapters=refs["chapters"] or None,
+            law_names=refs["laws"] or None,
+        )
+
+    async def expansion_stage() -> tuple[list[str], list[asyncio.Task], dict[str, Any]]:
+        # Chính sách mở rộng cần similarity sơ bộ của câu hỏi gốc (trừ khi đã có Điều/Chương cụ thể)
+        top_similarity = None
+        first_pass_late = False
+        if not (refs["articles"] or refs["chapters"]):
+            limit = timer.budget(DEADLINE_EMBEDDING + DEADLINE_SEARCH)
+            done, _ = await asyncio.wait({original_task}, timeout=limit)
+            if done and original_task.exception() is None:
+                top_similarity = max((c["similarity"] for c in original_task.result()), default=0.0)
+            else:
+                first_pass_late = True
+        decision = decide_expansion(question, refs, top_similarity)
+        if first_pass_late:
+            # Embedding / vector search đang chậm: không chồng thêm truy vấn biến thể
+            decision.update(expand=False, n_variants=0, reason="deadline")
+            timer.degrade("first pass chậm hoặc lỗi: bỏ mở rộng câu hỏi")
+
+        # Mỗi biến thể được tìm kiếm ngay khi LLM trả về, không chờ đủ n câu
+        variants: list[str] = []
+        searches: list[asyncio.Task] = []
+
+        async def stream_variants() -> None:
+            async for variant in astream_similar_questions(question, decision["n_variants"]):
+                variants.append(variant)
+                searches.append(asyncio.create_task(
+                    timed("vector", asyncio.to_thread(_search_queries, [variant], len(variants)))
+                ))
+
+        t0 = time.time()
+        if decision["expand"]:
+            limit = timer.budget(DEADLINE_EXPANSION)
+            try:
+                await asyncio.wait_for(timed("expand", stream_variants()), timeout=limit)
+            except asyncio.TimeoutError:
+                if variants:
+                    timer.degrade(f"expansion > {limit:.1f}s: dùng {len(variants)}/{decision['n_variants']} biến thể")
+                else:
+                    timer.degrade(f"expansion > {limit:.1f}s: chỉ dùng câu hỏi gốc")
+        log_expansion_decision(question, decision, top_similarity, len(variants), time.time() - t0)
+        return variants, searches, decision
+
+    # 2. Keyword search + tìm kiếm câu hỏi gốc chạy trong lúc chờ mở rộng câu hỏi
+    kw_task = asyncio.create_task(timed("keyword", keyword_stage()))
+    original_task = asyncio.create_task(
+        timed("first_pass", timed("vector", asyncio.to_thread(_search_queries, [question], 0)))
     )
-    
-    # 3. Vector search cho từng câu hỏi và gộp kết quả
-    t1 = time.time()
-    all_vec_results = []
-    
-    for idx, q in enumerate(all_queries):
-        print(f"    |-- Vector searching query {idx+1}: {q[:60]}...", flush=True)
-        q_vec = get_embedding(q)
-        q_results = vector_search(q_vec, top_k=MAX_CANDIDATES_FETCH, threshold=SIM_THRESHOLD)
-        all_vec_results.extend(q_results)
-    all_vec_results.sort(key=lambda x: x["similarity"], reverse=True)
-    time_vector = time.time() - t1
-    print(f"|-- [4/8] Multi-Vector Search: {len(all_vec_results)} raw results total ({time_vector:.2f}s)", flush=True)
-
-    # 4. Merge + deduplicate (ưu tiên kết quả keyword search, sau đó là vector search)
+    variants, variant_tasks, expansion = await expansion_stage()
+    all_queries = [question] + variants
+    print(
+        f"|-- [2/8] Multi-Query Expansion: {len(all_queries)} queries "
+        f"({expansion['reason']}, {timer.duration('expand'):.2f}s)",
+        flush=True,
+    )
+
+    # 3. Lexical search (full-text không dấu) trên câu hỏi gốc + biến thể,
+    #    chạy song song với các vector search còn dở
+    lex_task = asyncio.create_task(timed("lexical", asyncio.to_thread(lexical_search, all_queries, top_k=LEXICAL_TOP_K)))
+    all_vec_results = merge_vector_hits(await _gather_within(
+        timer, [original_task, *variant_tasks], DEADLINE_EMBEDDING + DEADLINE_SEARCH, "vector search",
+    ))
+    kw_hits = (await _gather_within(timer, [kw_task], DEADLINE_SEARCH, "keyword search") or [[]])[0]
+    lex_hits = (await _gather_within(timer, [lex_task], DEADLINE_SEARCH, "lexical search") or [[]])[0]
+    timer.extra["retrieval"] = time.time() - timer.start
+    print(
+        f"|-- [4/8] Multi-Vector Search: {len(all_vec_results)} unique results total "
+        f"(retrieval ready after {timer.extra['retrieval']:.2f}s)",
+        flush=True,
+    )
+
+    # 4. Gộp vector + lexical bằng Reciprocal Rank Fusion, giữ top RERANK_MAX_CANDIDATES.
+    #    Kết quả keyword search (tham chiếu chính xác) luôn đứng đầu.
+    fused = fuse_rankings(all_vec_results, lex_hits)[:RERANK_MAX_CANDIDATES]
+
     seen_ids: set = set()
     candidates: list[dict] = []
     
     # Gộp kết quả, lọc trùng theo ID
-    for chunk in (kw_hits + all_vec_results):
+    for chunk in (kw_hits + fused):
         cid = chunk.get("id")
         if cid not in seen_ids:
             seen_ids.add(cid)
             candidates.append(chunk)
 
-    print(f"|-- [5/8] Combined & Deduplicated: {len(candidates)} unique candidates", flush=True)
+    print(
+        f"|-- [5/8] Fused (RRF) & Deduplicated: {len(candidates)} unique candidates "
+        f"({len(all_vec_results)} vector, {len(lex_hits)} lexical, {len(kw_hits)} keyword)",
+        flush=True,
+    )
 
-    # [DEBUG] Lưu candidates ra file JSON
-    try:
-        with open("debug_candidates.json", "w", encoding="utf-8") as f:
-            json.dump(candidates, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"|-- Warning: Failed to save debug_candidates.json: {e}", flush=True)
+    # [DEBUG] Lưu candidates ra file JSON (chỉ khi DEBUG_DUMPS bật, ngoài event loop)
+    dump = dump_id()
+    if DEBUG_DUMPS:
+        await asyncio.to_thread(debug_dump, dump, "candidates.json", candidates)
+
+    result: dict[str, Any] = {
+        "answer":       None,
+        "context":      None,
+        "citations":    [],
+        "chunks":       [],
+        "candidates":   candidates,
+        "search_query": all_queries,
+        "expansion":    expansion,
+    }
 
     if not candidates:
-        return {
-            "answer":       f" Không tìm thấy tài liệu luật nào đủ độ tin cậy để trả lời câu hỏi này (Similarity < {SIM_THRESHOLD}).",
-            "citations":    [],
-            "chunks":       [],
-            "candidates":   [],
-            "search_query": all_queries,
-            "timings": {
-                "expand": time_expand,
-                "vector": time_vector,
-                "rerank": 0.0,
-                "total": time.time() - total_start
-            }
-        }
-
-    # 6. Rerank: Sử dụng TẤT CẢ các câu hỏi đã mở rộng (nối lại) để chấm điểm
+        result["answer"] = f" Không tìm thấy tài liệu luật nào đủ độ tin cậy để trả lời câu hỏi này (Similarity < {SIM_THRESHOLD})."
+        return result
+
+    # 5. Rerank: Sử dụng TẤT CẢ các câu hỏi đã mở rộng (nối lại) để chấm điểm
     combined_query = " ".join(all_queries)
-    t2 = time.time()
-    chunks = rerank(combined_query, candidates, score_threshold=RERANK_THRESHOLD)
-    time_rerank = time.time() - t2
-    print(f"|-- [6/8] Reranking (using combined queries): {len(chunks)} chunks kept ({time_rerank:.2f}s)", flush=True)
+    rerank_timings: dict[str, Any] = {}
+    rerank_pool = candidates
+    if timer.remaining() < DEADLINE_RERANK + DEADLINE_LLM:
+        # Không đủ thời gian cho rerank đầy đủ: chỉ chấm top-N theo thứ tự truy xuất
+        rerank_pool = candidates[:DEGRADED_RERANK_TOP_N]
+        timer.degrade(f"rerank: còn {timer.remaining():.1f}s, chỉ chấm {len(rerank_pool)}/{len(candidates)} ứng viên")
+    limit = timer.budget(DEADLINE_RERANK)
+    try:
+        # Cùng hạn chót cho reranker: quá hạn thì cross-encoder dừng giữa các batch thay vì chạy nốt
+        chunks = await asyncio.wait_for(timed("rerank", asyncio.to_thread(
+            rerank, combined_query, list(rerank_pool), score_threshold=RERANK_THRESHOLD, timings=rerank_timings,
+            deadline=time.time() + limit,
+        )), timeout=limit)
+    except (asyncio.TimeoutError, RerankCancelled):
+        # Cross-encoder quá tải: giữ thứ tự truy xuất (keyword → RRF), bỏ điểm rerank
+        chunks = candidates[:DEGRADED_CONTEXT_CHUNKS]
+        timer.extra["rerank_abandoned"] = True
+        timer.degrade(f"rerank > {limit:.1f}s: bỏ lời gọi reranker, dùng top {len(chunks)} theo thứ tự truy xuất")
+    else:
+        timer.extra.update(rerank_timings)
+        print(
+            f"|-- [6/8] Reranking (using combined queries): {len(chunks)} chunks kept ({timer.duration('rerank'):.2f}s; "
+            f"{rerank_timings['rerank_scored']}/{rerank_timings['rerank_candidates']} scored by cross-encoder "
+            f"({rerank_timings['rerank_cache_hits']} from cache), "
+            f"stage1 {rerank_timings['rerank_stage1']:.3f}s, stage2 {rerank_timings['rerank_stage2']:.2f}s)",
+            flush=True,
+        )
 
     # [DEBUG] Lưu kết quả sau Rerank ra file JSON
-    try:
-        with open("debug_results.json", "w", encoding="utf-8") as f:
-            json.dump(chunks, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"|-- Warning: Failed to save debug_results.json: {e}", flush=True)
+    if DEBUG_DUMPS:
+        await asyncio.to_thread(debug_dump, dump, "results.json", chunks)
 
     if not chunks:
-        return {
-            "answer":       f"Tìm thấy tài liệu liên quan nhưng độ chính xác không đủ cao (Rerank < {RERANK_THRESHOLD}) để đưa ra câu trả lời.",
-            "citations":    [],
-            "chunks":       [],
-            "candidates":   candidates,
-            "search_query": all_queries,
-            "timings": {
-                "expand": time_expand,
-                "vector": time_vector,
-                "rerank": time_rerank,
-                "total": time.time() - total_start
-            }
-        }
-
-    # 7. Build context
-    context = build_context(chunks)
-
-    # 8. Trả về kết quả (Đã gỡ bỏ Streaming)
-    citations = format_citations(chunks)
-    
-    # Chuẩn bị chain
-    llm = get_llm()
-    chain = RAG_PROMPT | llm | StrOutputParser()
+        result["answer"] = f"Tìm thấy tài liệu liên quan nhưng độ chính xác không đủ cao (Rerank < {RERANK_THRESHOLD}) để đưa ra câu trả lời."
+        return result
+
+    # 6. Build context (ít chunk hơn nếu thời gian còn lại không đủ cho LLM)
+    if timer.remaining() < DEADLINE_LLM and len(chunks) > DEGRADED_CONTEXT_CHUNKS:
+        timer.degrade(
+            f"context: còn {timer.remaining():.1f}s, trả lời từ {DEGRADED_CONTEXT_CHUNKS}/{len(chunks)} chunks"
+        )
+        chunks = chunks[:DEGRADED_CONTEXT_CHUNKS]
+    result["chunks"] = chunks
+    result["citations"] = format_citations(chunks)
+    result["context"], context_stats = pack_context(chunks)
+    timer.extra["context_tokens"] = context_stats["packed_tokens"]
+    timer.extra["context_tokens_saved"] = context_stats["tokens_saved"]
+    print(
+        f"|-- Context: {context_stats['packed_tokens']} tokens "
+        f"(saved {context_stats['tokens_saved']} of {context_stats['raw_tokens']}; "
+        f"{context_stats['chunks_used']} chunks used, {context_stats['chunks_dropped']} over budget)",
+        flush=True,
+    )
 
     # [DEBUG] Lưu Prompt đầy đủ ra file TXT
-    try:
-        full_prompt_text = RAG_PROMPT.format(context=context, question=question)
-        with open("debug_prompt.txt", "w", encoding="utf-8") as f:
-            f.write(full_prompt_text)
-    except Exception as e:
-        print(f"|-- Warning: Failed to save debug_prompt.txt: {e}", flush=True)
+    if DEBUG_DUMPS:
+        full_prompt_text = RAG_PROMPT.format(context=result["context"], question=question)
+        await asyncio.to_thread(debug_dump, dump, "prompt.txt", full_prompt_text)
 
-    print(f"|-- [7/8] Invoking LLM...", flush=True)
-    answer = chain.invoke({"context": context, "question": question})
-    print(f"|-- [8/8] RAG Complete. Response Length: {len(answer)} chars", flush=True)
-    
-    return {
-        "answer":       answer,
-        "citations":    citations,
-        "chunks":       chunks,
-        "candidates":   candidates,
-        "search_query": all_queries,
-        "timings": {
-            "expand": time_expand,
-            "vector": time_vector,
-            "rerank": time_rerank,
-            "total": time.time() - total_start
-        }
-    }
+    return result
+
+
+async def arun_rag(
+    question: str,
+    corpus_version: int | None = None,
+) -> dict[str, Any]:
+    """
+    Chạy toàn bộ RAG pipeline: cache ngữ nghĩa → truy xuất (_aretrieve) → Invoke LLM → Trả về kết quả.
+
+    corpus_version: phiên bản corpus đọc trước khi chạy; None = không dùng cache ngữ nghĩa.
+
+    timings: thời lượng từng bước (expand, keyword, vector, lexical, rerank, llm),
+    "retrieval" = thời gian thực tới khi có ứng viên, "critical_path" = các bước
+    quyết định thời gian chờ.
+    """
+    cached = await _asemantic_cache_hit(question, corpus_version)
+    if cached is not None:
+        return cached
+
+    timer = _StageTimer()
+    result = await _aretrieve(question, timer)
+    context = result.pop("context")
+
+    if result["answer"] is None:
+        print("|-- [7/8] Invoking LLM...", flush=True)
+        chain = _build_chain()
+        limit = timer.budget(DEADLINE_LLM)
+        try:
+            result["answer"] = await asyncio.wait_for(
+                timer.timed("llm", chain.ainvoke({"context": context, "question": question})), timeout=limit
+            )
+            print(f"|-- [8/8] RAG Complete. Response Length: {len(result['answer'])} chars", flush=True)
+        except asyncio.TimeoutError:
+            timer.degrade(f"llm > {limit:.1f}s: không nhận được câu trả lời")
+            result["answer"] = LLM_TIMEOUT_ANSWER
+
+    result["timings"] = timer.timings()
+    await asyncio.to_thread(_semantic_store, question, result, corpus_version)
+    return result
+
+
+async def astream_rag(
+    question: str,
+    corpus_version: int | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Phiên bản streaming của arun_rag. Lần lượt trả về các sự kiện:
+        {"type": "meta", ...}   – kết quả truy xuất (citations, chunks, candidates, ...),
+                                  "answer" khác None nếu không cần gọi LLM;
+        {"type": "token", "text": str} – từng đoạn câu trả lời;
+        {"type": "done", "answer": str, "timings": dict} – timings có thêm "ttft".
+    Trúng cache ngữ nghĩa: "meta" (kèm answer, semantic_match) rồi "done" ngay.
+    """
+    cached = await _asemantic_cache_hit(question, corpus_version)
+    if cached is not None:
+        yield {"type": "meta", **cached}
+        yield {"type": "done", "answer": cached["answer"], "timings": cached["timings"]}
+        return
+
+    timer = _StageTimer()
+    result = await _aretrieve(question, timer)
+    context = result.pop("context")
+    yield {"type": "meta", **result, "timings": timer.timings()}
+
+    answer = result["answer"]
+    if answer is None:
+        print("|-- [7/8] Streaming LLM...", flush=True)
+        chain = _build_chain()
+        parts: list[str] = []
+        t0 = time.time()
+        llm_deadline = t0 + timer.budget(DEADLINE_LLM)
+        stream = chain.astream({"context": context, "question": question}).__aiter__()
+        while True:
+            try:
+                token = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, llm_deadline - time.time()))
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                # Hết hạn: dừng stream, giữ phần câu trả lời đã nhận
+                await stream.aclose()
+                timer.degrade(f"llm > {llm_deadline - t0:.1f}s: câu trả lời bị cắt")
+                note = LLM_TIMEOUT_ANSWER if not parts else "\n\n_(Câu trả lời bị cắt do quá thời gian chờ.)_"
+                parts.append(note)
+                yield {"type": "token", "text": note}
+                break
+            if not parts:
+                # Time-to-first-token tính từ lúc nhận câu hỏi
+                timer.extra["ttft"] = time.time() - timer.start
+            parts.append(token)
+            yield {"type": "token", "text": token}
+        timer.record("llm", t0, time.time())
+        answer = "".join(parts)
+        print(
+            f"|-- [8/8] RAG Complete. Response Length: {len(answer)} chars "
+            f"(first token after {timer.extra.get('ttft', 0.0):.2f}s)",
+            flush=True,
+        )
+
+    timings = timer.timings()
+    await asyncio.to_thread(_semantic_store, question, {**result, "answer": answer, "timings": timings}, corpus_version)
+    yield {"type": "done", "answer": answer, "timings": timings}
+
+
+def run_rag(
+    question: str,
+    corpus_version: int | None = None,
+) -> dict[str, Any]:
+    """
+    Wrapper đồng bộ của arun_rag (gọi từ controller / thread Streamlit).
+    Chạy trên event loop nền dùng chung để giữ kết nối keep-alive tới OpenRouter.
+    """
+    return event_loop.run(arun_rag(question, corpus_version))
+
+
+def stream_rag(
+    question: str,
+    corpus_version: int | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Wrapper đồng bộ của astream_rag: generator dùng được trực tiếp trong Streamlit."""
+    yield from event_loop.iterate(astream_rag(question, corpus_version))
@@ -1,7 +1,19 @@
 """
 services/reranker.py – Reranking sử dụng BAAI/bge-reranker-v2-m3
 Chấm điểm lại các chunk sau Vector Search để cải thiện độ chính xác.
+
+Reranking theo cascade hai bước:
+1. Sơ loại rẻ: điểm cosine đã có từ vector search + độ trùng âm tiết/cụm hai
+   âm tiết (không dấu) với câu hỏi → giữ top RERANK_CASCADE_TOP_N.
+2. Chỉ các ứng viên còn lại mới được chấm bằng cross-encoder; cặp (câu hỏi,
+   chunk) đã chấm gần đây lấy từ cache, chỉ cặp chưa có mới gửi vào model.
+
+rerank(deadline=...) dừng cross-encoder giữa các batch khi quá hạn (RerankCancelled),
+để lời gọi bị caller bỏ (asyncio.wait_for hết giờ) không chiếm worker.
 """
+import hashlib
+import time
+import unicodedata
 from typing import Any
 
 # Model name – có thể thay bằng model nhẹ hơn nếu cần tốc độ
@@ -10,14 +22,135 @@ RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
 
 import streamlit as st
 
+from config.rag_config import (
+    RERANKER_BACKEND,
+    RERANK_CASCADE_TOP_N,
+    RERANK_CASCADE_DENSE_WEIGHT,
+    RERANK_CACHE_SIZE,
+    RERANK_CACHE_TTL,
+    RERANKER_WORKER_ADDRESS,
+)
+from services.reranker_backends import RerankCancelled
+from services.reranker_worker import RerankerWorker, RemoteReranker
+from utils.lru_cache import LRUCache
+from utils.text import VI_STOPWORDS, fold_vietnamese, syllables
+
+# Điểm đã chấm: key = (hash câu hỏi đã chuẩn hoá, chunk id, model:backend)
+_score_cache = LRUCache(RERANK_CACHE_SIZE, ttl=RERANK_CACHE_TTL)
+_SCORE_MODEL_KEY = f"{RERANKER_MODEL}:{RERANKER_BACKEND}"
+# Worker trong process (khi không dùng RERANKER_WORKER_ADDRESS), để xem thống kê mà không load model
+_worker: RerankerWorker | None = None
+
+_FOLDED_STOPWORDS = {fold_vietnamese(w) for w in VI_STOPWORDS}
+
+
 @st.cache_resource
 def _get_reranker():
-    """Load model một lần duy nhất và giữ lại trong bộ nhớ Streamlit."""
-    from sentence_transformers import CrossEncoder
-    print(f"--- Loading Reranker model: {RERANKER_MODEL}...", flush=True)
-    model = CrossEncoder(RERANKER_MODEL, max_length=512)
-    print(f"--- Reranker is ready.", flush=True)
-    return model
+    """
+    Worker reranker dùng chung cho mọi session: thread gom batch trong process này,
+    hoặc client tới worker ở process riêng khi đặt RERANKER_WORKER_ADDRESS.
+    """
+    if RERANKER_WORKER_ADDRESS:
+        print(f"--- Using Reranker worker at {RERANKER_WORKER_ADDRESS}", flush=True)
+        return RemoteReranker(RERANKER_WORKER_ADDRESS)
+    global _worker
+    print(f"--- Loading Reranker model: {RERANKER_MODEL} (backend: {RERANKER_BACKEND})...", flush=True)
+    _worker = RerankerWorker(RERANKER_MODEL)
+    print("--- Reranker is ready.", flush=True)
+    return _worker
+
+
+def get_reranker_worker_stats() -> dict[str, Any] | None:
+    """
+    Độ sâu hàng đợi, số batch và kích thước batch trung bình của worker reranker.
+    None nếu worker trong process chưa được khởi tạo (chưa có câu hỏi nào).
+    """
+    if RERANKER_WORKER_ADDRESS:
+        return _get_reranker().stats()
+    return _worker.stats() if _worker is not None else None
+
+
+def _query_hash(question: str) -> str:
+    """Hash câu hỏi sau khi chuẩn hoá Unicode (NFC), chữ thường và gộp khoảng trắng."""
+    normalized = " ".join(unicodedata.normalize("NFC", question).lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _score_pairs(
+    question: str, chunks: list[dict[str, Any]], deadline: float | None = None
+) -> tuple[list[float], int]:
+    """
+    Điểm cross-encoder cho từng chunk: lấy từ cache nếu có, chỉ chấm các cặp chưa có.
+    Quá deadline (time.time()) → RerankCancelled.
+
+    Returns:
+        (điểm theo thứ tự chunks, số cặp lấy từ cache)
+    """
+    qhash = _query_hash(question)
+    keys = [(qhash, chunk.get("id"), _SCORE_MODEL_KEY) for chunk in chunks]
+    scores: list[float | None] = [
+        _score_cache.get(key) if key[1] is not None else None for key in keys
+    ]
+
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if missing:
+        model = _get_reranker()
+        predicted = model.predict([(question, chunks[i].get("content", "")) for i in missing], deadline=deadline)
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+            if keys[i][1] is not None:
+                _score_cache.set(keys[i], scores[i])
+    return scores, len(chunks) - len(missing)
+
+
+def invalidate_chunks(chunk_ids) -> int:
+    """Xoá điểm đã cache của các chunk bị xoá/sửa (gọi sau khi ingest). Trả về số cặp đã xoá."""
+    ids = set(chunk_ids)
+    if not ids:
+        return 0
+    return _score_cache.discard_where(lambda key: key[1] in ids)
+
+
+def get_rerank_cache_stats() -> dict[str, Any]:
+    """Bộ đếm hit/miss của cache điểm reranker."""
+    return _score_cache.stats()
+
+
+def _terms(text: str) -> set[str]:
+    """Âm tiết không dấu (bỏ hư từ) và các cụm hai âm tiết liền nhau."""
+    tokens = syllables(fold_vietnamese(text))
+    stop = _FOLDED_STOPWORDS
+    unigrams = {t for t in tokens if t not in stop}
+    bigrams = {f"{a} {b}" for a, b in zip(tokens, tokens[1:]) if a not in stop and b not in stop}
+    return unigrams | bigrams
+
+
+def first_pass_scores(question: str, chunks: list[dict[str, Any]]) -> list[float]:
+    """
+    Điểm sơ loại (không cần model): kết hợp cosine similarity từ vector search
+    với tỉ lệ từ khoá của câu hỏi xuất hiện trong chunk.
+
+    Chunk không đến từ vector search (keyword / full-text) chỉ dùng độ trùng từ khoá.
+    """
+    query_terms = _terms(question)
+    scores = []
+    for chunk in chunks:
+        overlap = len(query_terms & _terms(chunk.get("content", ""))) / len(query_terms) if query_terms else 0.0
+        if "query_ranks" in chunk:
+            dense = float(chunk.get("similarity") or 0.0)
+            scores.append(RERANK_CASCADE_DENSE_WEIGHT * dense + (1 - RERANK_CASCADE_DENSE_WEIGHT) * overlap)
+        else:
+            scores.append(overlap)
+    return scores
+
+
+def _prune(question: str, chunks: list[dict[str, Any]], top_n: int | None) -> list[dict[str, Any]]:
+    """Bước 1 của cascade: giữ top_n chunk theo điểm sơ loại (giữ nguyên nếu không cần cắt)."""
+    if top_n is None or len(chunks) <= top_n:
+        return list(chunks)
+    for chunk, score in zip(chunks, first_pass_scores(question, chunks)):
+        chunk["first_pass_score"] = score
+    return sorted(chunks, key=lambda c: c["first_pass_score"], reverse=True)[:top_n]
 
 
 def rerank(
@@ -25,6 +158,9 @@ def rerank(
     chunks: list[dict[str, Any]],
     top_k: int | None = None,
     score_threshold: float = 0.7,
+    cascade_top_n: int | None = RERANK_CASCADE_TOP_N,
+    timings: dict[str, Any] | None = None,
+    deadline: float | None = None,
 ) -> list[dict[str, Any]]:
     """
     Sắp xếp lại danh sách chunks dựa trên điểm Reranker và lọc theo ngưỡng.
@@ -34,6 +170,12 @@ def rerank(
         chunks:          Danh sách chunk từ vector search (top-N bước sơ bộ).
         top_k:           Số lượng tối đa chunk giữ lại (Optional).
         score_threshold: Ngưỡng điểm tối thiểu để giữ lại chunk (mặc định 0.7).
+        cascade_top_n:   Số ứng viên sau bước sơ loại được chấm bằng cross-encoder
+                         (None = chấm toàn bộ).
+        timings:         Nếu truyền vào, ghi thời gian từng bước (rerank_stage1,
+                         rerank_stage2) và số ứng viên (rerank_candidates, rerank_scored).
+        deadline:        Hạn chót (time.time()); quá hạn thì cross-encoder dừng giữa các batch
+                         và hàm raise RerankCancelled.
 
     Returns:
         Danh sách chunk đã được rerank và lọc, sắp xếp theo điểm giảm dần.
@@ -41,11 +183,17 @@ def rerank(
     if not chunks:
         return []
 
-    model = _get_reranker()
+    # Bước 1: sơ loại rẻ
+    n_candidates = len(chunks)
+    t0 = time.time()
+    chunks = _prune(question, chunks, cascade_top_n)
+    time_stage1 = time.time() - t0
 
-    # Tạo cặp (câu hỏi, nội dung chunk) để chấm điểm
-    pairs = [(question, chunk.get("content", "")) for chunk in chunks]
-    scores = model.predict(pairs)
+    # Bước 2: cross-encoder chỉ chấm các ứng viên còn lại
+    t1 = time.time()
+    if deadline is not None and time.time() >= deadline:
+        raise RerankCancelled()
+    scores, cache_hits = _score_pairs(question, chunks, deadline)
 
     # Gắn điểm reranker vào từng chunk
     for chunk, score in zip(chunks, scores):
@@ -53,6 +201,14 @@ def rerank(
 
     # Sắp xếp toàn bộ theo điểm giảm dần
     chunks.sort(key=lambda c: c["rerank_score"], reverse=True)
+    time_stage2 = time.time() - t1
+
+    if timings is not None:
+        timings["rerank_stage1"] = time_stage1
+        timings["rerank_stage2"] = time_stage2
+        timings["rerank_candidates"] = n_candidates
+        timings["rerank_scored"] = len(chunks)
+        timings["rerank_cache_hits"] = cache_hits
 
     # Lấy các chunk đạt ngưỡng
     reranked = [c for c in chunks if c["rerank_score"] >= score_threshold]
@@ -70,3 +226,23 @@ def rerank(
     if top_k is not None:
         return reranked[:top_k]
     return reranked
+
+
+def cascade_recall(
+    question: str,
+    chunks: list[dict[str, Any]],
+    k: int = 10,
+    top_n: int | None = RERANK_CASCADE_TOP_N,
+) -> float:
+    """
+    Recall của bước sơ loại so với rerank toàn bộ: tỉ lệ top-k của cross-encoder
+    (chấm trên tất cả ứng viên) vẫn còn trong top_n sau bước sơ loại.
+    Dùng để chọn RERANK_CASCADE_TOP_N (xem bench_reranker.py).
+    """
+    if not chunks:
+        return 1.0
+    scores, _ = _score_pairs(question, chunks)
+    order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+    full_top = {chunks[i]["id"] for i in order[:k]}
+    survivors = {c["id"] for c in _prune(question, chunks, top_n)}
+    return len(full_top & survivors) / len(full_top)
@@ -0,0 +1,172 @@
+"""
+services/reranker_backends.py – Backend chấm điểm cho cross-encoder reranker
+
+- "torch":     sentence-transformers CrossEncoder (fp32).
+- "onnx-int8": ONNX Runtime với model quantize động int8 (nhanh hơn nhiều trên CPU).
+
+Cả hai backend xếp các cặp theo độ dài rồi chia batch (length-bucketing) và chỉ
+pad tới độ dài dài nhất trong từng batch, thay vì pad mọi cặp lên 512 token.
+predict() nhận thêm should_stop: được kiểm tra trước mỗi batch để dừng sớm khi
+caller đã bỏ cuộc (quá hạn), không chấm tiếp phần còn lại.
+"""
+
+from __future__ import annotations
+import os
+from typing import Any, Callable
+
+import numpy as np
+
+from config.rag_config import (
+    RERANKER_BATCH_SIZE,
+    RERANKER_MAX_LENGTH,
+    RERANKER_ONNX_DIR,
+    RERANKER_ONNX_THREADS,
+)
+
+
+class RerankCancelled(Exception):
+    """Lời gọi chấm điểm bị bỏ giữa chừng vì đã quá hạn của caller."""
+
+
+def length_buckets(lengths: list[int], batch_size: int) -> list[list[int]]:
+    """Chia chỉ số các cặp thành batch sau khi sắp theo độ dài tăng dần."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class TorchBackend:
+    """CrossEncoder của sentence-transformers (fp32)."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, max_length: int = RERANKER_MAX_LENGTH, batch_size: int = RERANKER_BATCH_SIZE):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.batch_size = batch_size
+
+    def predict(self, pairs: list[tuple[str, str]], should_stop: Callable[[], bool] | None = None) -> list[float]:
+        if not pairs:
+            return []
+        # Độ dài ký tự đủ tốt để xếp nhóm, không phải tokenize hai lần
+        lengths = [len(q) + len(d) for q, d in pairs]
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for idx in length_buckets(lengths, self.batch_size):
+            if should_stop is not None and should_stop():
+                raise RerankCancelled()
+            batch = [pairs[i] for i in idx]
+            scores[idx] = self.model.predict(batch, batch_size=len(batch), show_progress_bar=False)
+        return scores.tolist()
+
+
+def _ensure_onnx_int8(model_name: str, model_dir: str) -> str:
+    """Export model sang ONNX và quantize động int8 (chỉ làm một lần). Trả về đường dẫn model int8."""
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+    if os.path.exists(int8_path):
+        return int8_path
+
+    try:
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        raise ImportError("Cần cài onnxruntime, onnx, transformers, torch: pip install onnxruntime onnx")
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    print(f"--- Exporting {model_name} to ONNX: {fp32_path}", flush=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    dummy = tokenizer(["câu hỏi"], ["nội dung điều luật"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17,
+        )
+
+    print(f"--- Quantizing (dynamic int8): {int8_path}", flush=True)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(model_dir)
+    return int8_path
+
+
+class OnnxInt8Backend:
+    """ONNX Runtime trên CPU với model int8 quantize động."""
+
+    name = "onnx-int8"
+
+    def __init__(
+        self,
+        model_name: str,
+        max_length: int = RERANKER_MAX_LENGTH,
+        batch_size: int = RERANKER_BATCH_SIZE,
+        model_dir: str = RERANKER_ONNX_DIR,
+    ):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError:
+            raise ImportError("Cần cài onnxruntime: pip install onnxruntime onnx")
+
+        path = _ensure_onnx_int8(model_name, model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_length = max_length
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if RERANKER_ONNX_THREADS:
+            options.intra_op_num_threads = RERANKER_ONNX_THREADS
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def predict(self, pairs: list[tuple[str, str]], should_stop: Callable[[], bool] | None = None) -> list[float]:
+        if not pairs:
+            return []
+        # Tokenize không pad, sau đó pad động theo từng batch cùng độ dài
+        encoded = self.tokenizer(
+            [q for q, _ in pairs],
+            [d for _, d in pairs],
+            truncation=True,
+            max_length=self.max_length,
+        )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        scores = np.empty(len(pairs), dtype=np.float32)
+
+        for idx in length_buckets(lengths, self.batch_size):
+            if should_stop is not None and should_stop():
+                raise RerankCancelled()
+            batch = self.tokenizer.pad(
+                {
+                    "input_ids": [encoded["input_ids"][i] for i in idx],
+                    "attention_mask": [encoded["attention_mask"][i] for i in idx],
+                },
+                return_tensors="np",
+            )
+            feeds = {name: batch[name].astype(np.int64) for name in self.input_names}
+            logits = self.session.run(None, feeds)[0]
+            # Giống CrossEncoder (num_labels = 1): sigmoid trên logit
+            scores[idx] = 1.0 / (1.0 + np.exp(-logits[:, 0]))
+        return scores.tolist()
+
+
+BACKENDS: dict[str, Any] = {
+    TorchBackend.name: TorchBackend,
+    OnnxInt8Backend.name: OnnxInt8Backend,
+}
+
+
+def load_backend(name: str, model_name: str):
+    """Khởi tạo backend reranker theo tên ("torch" | "onnx-int8")."""
+    if name not in BACKENDS:
+        raise ValueError(f"RERANKER_BACKEND không hợp lệ: {name!r} (chọn một trong {list(BACKENDS)})")
+    return BACKENDS[name](model_name)
@@ -0,0 +1,282 @@
+"""
+services/reranker_worker.py – Worker reranker dùng chung, gom batch động giữa các session
+
+- RerankerWorker: một thread riêng sở hữu model và hàng đợi. Các lời gọi predict()
+  đồng thời (từ nhiều session Streamlit) được gom trong RERANKER_BATCH_WINDOW_MS
+  rồi chấm trong một batch, kết quả trả lại đúng cho từng caller.
+- Chạy như process riêng để mọi process Streamlit trên máy dùng chung một bản model:
+      python -m services.reranker_worker
+  rồi đặt RERANKER_WORKER_ADDRESS = "127.0.0.1:6010" trong config/rag_config.py.
+  RemoteReranker là client tương ứng (cùng giao diện predict / stats).
+  multiprocessing.connection unpickle dữ liệu nhận được nên khoá xác thực phải bí mật:
+  đặt RERANKER_WORKER_AUTHKEY (bắt buộc với địa chỉ không phải loopback), hoặc để worker
+  local tự sinh khoá ngẫu nhiên vào RERANKER_WORKER_AUTHKEY_FILE.
+- predict() nhận deadline (time.time()): yêu cầu đã quá hạn bị bỏ khỏi hàng đợi, batch mà
+  mọi yêu cầu đã quá hạn dừng ngay giữa các batch con; số yêu cầu bị bỏ ghi ở stats()["abandoned"].
+"""
+
+from __future__ import annotations
+import ipaddress
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Client, Listener
+from typing import Any
+
+from config.rag_config import (
+    RERANKER_BACKEND,
+    RERANKER_BATCH_WINDOW_MS,
+    RERANKER_WORKER_MAX_PAIRS,
+    RERANKER_WORKER_ADDRESS,
+    RERANKER_WORKER_AUTHKEY_FILE,
+)
+from services.reranker_backends import RerankCancelled, load_backend
+
+_AUTHKEY_ENV = "RERANKER_WORKER_AUTHKEY"
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """'host:port' → (host, port)."""
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _authkey(host: str, create: bool = False) -> bytes:
+    """
+    Khoá xác thực cho worker tại `host`: RERANKER_WORKER_AUTHKEY nếu có đặt; nếu không,
+    chỉ cho phép địa chỉ loopback với khoá ngẫu nhiên trong RERANKER_WORKER_AUTHKEY_FILE
+    (worker sinh mới mỗi lần khởi động khi create=True, client đọc lại khi kết nối).
+    """
+    key = os.getenv(_AUTHKEY_ENV)
+    if key:
+        return key.encode("utf-8")
+    if not _is_loopback(host):
+        raise RuntimeError(
+            f"Reranker worker tại {host} không phải loopback: cần đặt biến môi trường {_AUTHKEY_ENV} "
+            f"(khoá bí mật dùng chung cho worker và client)."
+        )
+    path = RERANKER_WORKER_AUTHKEY_FILE
+    if create:
+        key = secrets.token_hex(32)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(key)
+        return key.encode("utf-8")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip().encode("utf-8")
+    except FileNotFoundError:
+        raise RuntimeError(f"Chưa có khoá worker ({path}): chạy python -m services.reranker_worker trước.") from None
+
+
+class RerankerWorker:
+    """Thread sở hữu backend reranker; gom các yêu cầu đồng thời thành một batch."""
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str = RERANKER_BACKEND,
+        window_ms: float = RERANKER_BATCH_WINDOW_MS,
+        max_pairs: int = RERANKER_WORKER_MAX_PAIRS,
+    ):
+        self.model = load_backend(backend, model_name)
+        self.window = window_ms / 1000.0
+        self.max_pairs = max_pairs
+        self._queue: queue.Queue[tuple[list[tuple[str, str]], Future, float | None]] = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "pairs": 0, "batches": 0, "max_batch_pairs": 0, "busy_seconds": 0.0, "abandoned": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="reranker-worker", daemon=True)
+        self._thread.start()
+
+    def predict(self, pairs: list[tuple[str, str]], deadline: float | None = None) -> list[float]:
+        """
+        Gửi các cặp vào hàng đợi và chờ điểm (chặn tới khi batch chứa chúng được chấm).
+        Quá deadline (time.time()) → RerankCancelled; worker không chấm tiếp phần của yêu cầu này.
+        """
+        if not pairs:
+            return []
+        future: Future = Future()
+        self._queue.put((list(pairs), future, deadline))
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise RerankCancelled() from None
+
+    def _abandon(self, requests: list[tuple[list[tuple[str, str]], Future, float | None]]) -> None:
+        for _, future, _ in requests:
+            future.set_exception(RerankCancelled())
+        with self._lock:
+            self._stats["abandoned"] += len(requests)
+
+    def _collect(self) -> list[tuple[list[tuple[str, str]], Future, float | None]]:
+        """Lấy yêu cầu đầu tiên rồi gom thêm trong cửa sổ thời gian / tới giới hạn số cặp."""
+        batch = [self._queue.get()]
+        n_pairs = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while n_pairs < self.max_pairs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_pairs += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            now = time.time()
+            expired = [item for item in batch if item[2] is not None and item[2] <= now]
+            if expired:
+                self._abandon(expired)
+                batch = [item for item in batch if item[2] is None or item[2] > now]
+                if not batch:
+                    continue
+            pairs = [pair for request_pairs, _, _ in batch for pair in request_pairs]
+            # Chỉ dừng giữa chừng khi mọi yêu cầu trong batch đều đã quá hạn
+            deadlines = [item[2] for item in batch]
+            last = None if None in deadlines else max(deadlines)
+            t0 = time.time()
+            try:
+                scores = self.model.predict(pairs, should_stop=None if last is None else lambda: time.time() >= last)
+            except RerankCancelled:
+                self._abandon(batch)
+                continue
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            busy = time.time() - t0
+
+            offset = 0
+            for request_pairs, future, _ in batch:
+                future.set_result(scores[offset:offset + len(request_pairs)])
+                offset += len(request_pairs)
+
+            with self._lock:
+                self._stats["requests"] += len(batch)
+                self._stats["pairs"] += len(pairs)
+                self._stats["batches"] += 1
+                self._stats["max_batch_pairs"] = max(self._stats["max_batch_pairs"], len(pairs))
+                self._stats["busy_seconds"] += busy
+
+    def stats(self) -> dict[str, Any]:
+        """Độ sâu hàng đợi và kích thước batch trung bình."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_pairs"] = stats["pairs"] / stats["batches"] if stats["batches"] else 0.0
+        stats["avg_batch_requests"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        stats["mode"] = "thread"
+        return stats
+
+
+class RemoteReranker:
+    """Client của worker chạy ở process riêng (multiprocessing.connection)."""
+
+    def __init__(self, address: str = RERANKER_WORKER_ADDRESS):
+        self.address = parse_address(address)
+        self._local = threading.local()
+
+    def _conn(self):
+        # Mỗi thread một kết nối: các session gửi song song, worker gom batch phía server
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Đọc khoá mỗi lần kết nối: worker khởi động lại sinh khoá mới
+            conn = Client(self.address, authkey=_authkey(self.address[0]))
+            self._local.conn = conn
+        return conn
+
+    def _call(self, message: tuple) -> Any:
+        try:
+            conn = self._conn()
+            conn.send(message)
+            status, payload = conn.recv()
+        except (EOFError, OSError):
+            # Worker restart: bỏ kết nối cũ, thử lại một lần
+            self._local.conn = None
+            conn = self._conn()
+            conn.send(message)
+            status, payload = conn.recv()
+        if status == "cancelled":
+            raise RerankCancelled()
+        if status == "error":
+            raise RuntimeError(f"Reranker worker error: {payload}")
+        return payload
+
+    def predict(self, pairs: list[tuple[str, str]], deadline: float | None = None) -> list[float]:
+        if not pairs:
+            return []
+        # deadline theo time.time() nên dùng được ở process worker trên cùng máy
+        return self._call(("predict", (list(pairs), deadline)))
+
+    def stats(self) -> dict[str, Any]:
+        stats = self._call(("stats", None))
+        stats["mode"] = f"process @ {self.address[0]}:{self.address[1]}"
+        return stats
+
+
+def _serve_connection(conn, worker: RerankerWorker) -> None:
+    with conn:
+        while True:
+            try:
+                command, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if command == "predict":
+                    pairs, deadline = payload
+                    conn.send(("ok", worker.predict(pairs, deadline=deadline)))
+                elif command == "stats":
+                    conn.send(("ok", worker.stats()))
+                else:
+                    conn.send(("error", f"unknown command {command!r}"))
+            except RerankCancelled:
+                conn.send(("cancelled", None))
+            except Exception as e:
+                conn.send(("error", str(e)))
+
+
+def serve(address: str, model_name: str) -> None:
+    """Chạy worker ở process hiện tại, mỗi client một thread, dùng chung một RerankerWorker."""
+    host, port = parse_address(address)
+    authkey = _authkey(host, create=True)
+    worker = RerankerWorker(model_name)
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"--- Reranker worker listening on {address} (backend: {RERANKER_BACKEND})", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"|-- Warning: Reranker worker rejected a connection: {e}", flush=True)
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, worker), daemon=True).start()
+
+
+if __name__ == "__main__":
+    import sys
+    from dotenv import load_dotenv
+    from services.reranker import RERANKER_MODEL
+
+    load_dotenv()
+    serve(sys.argv[1] if len(sys.argv) > 1 else (RERANKER_WORKER_ADDRESS or "127.0.0.1:6010"), RERANKER_MODEL)
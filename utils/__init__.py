@@ -0,0 +1 @@
+# utils package
@@ -0,0 +1,36 @@
+"""
+utils/debug_dump.py – Ghi dữ liệu trung gian ra file để soi lỗi (chỉ khi DEBUG_DUMPS bật)
+"""
+
+from __future__ import annotations
+import json
+import os
+import time
+import uuid
+from typing import Any
+
+from config.rag_config import DEBUG_DUMPS, DEBUG_DUMP_DIR
+
+
+def dump_id() -> str:
+    """Định danh dùng chung cho các file dump của một request / một lần ingest."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def debug_dump(dump: str, name: str, payload: Any) -> None:
+    """
+    Ghi payload vào DEBUG_DUMP_DIR/<dump>-<name> (JSON, hoặc text nếu payload là str).
+    Không làm gì khi DEBUG_DUMPS tắt; lỗi ghi file chỉ được log lại.
+    """
+    if not DEBUG_DUMPS:
+        return
+    path = os.path.join(DEBUG_DUMP_DIR, f"{dump}-{name}")
+    try:
+        os.makedirs(DEBUG_DUMP_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            if isinstance(payload, str):
+                f.write(payload)
+            else:
+                json.dump(payload, f, ensure_ascii=False, indent=4, default=str)
+    except Exception as e:
+        print(f"|-- Warning: Failed to save {path}: {e}", flush=True)
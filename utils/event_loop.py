@@ -0,0 +1,42 @@
+"""
+utils/event_loop.py – Event loop asyncio chạy nền, dùng chung cho cả process
+
+Client HTTP async (httpx.AsyncClient) gắn với event loop đã tạo ra kết nối của nó;
+asyncio.run() tạo loop mới mỗi lần gọi nên không giữ được kết nối keep-alive.
+Mọi coroutine của pipeline chạy trên một loop duy nhất ở thread nền.
+"""
+
+from __future__ import annotations
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator
+
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Event loop nền (tạo ở lần gọi đầu tiên)."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-loop", daemon=True).start()
+        return _loop
+
+
+def run(coro: Awaitable[Any]) -> Any:
+    """Chạy coroutine trên loop nền và chờ kết quả (gọi từ code đồng bộ)."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iterate(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """Duyệt async generator từ code đồng bộ, mỗi phần tử được lấy trên loop nền."""
+    try:
+        while True:
+            try:
+                yield run(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        run(agen.aclose())
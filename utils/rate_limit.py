@@ -0,0 +1,411 @@
+"""
+utils/rate_limit.py – Transport httpx cho OpenRouter: giới hạn tốc độ, retry, gộp request
+
+Bọc transport (đồng bộ và async) của các client dùng chung trong models/clients.py,
+nên LLM, query expansion và embedding đều đi qua cùng một lớp:
+- Token bucket: trung bình LLM_RATE_LIMIT_RPS request/giây, cho phép dồn LLM_RATE_LIMIT_BURST.
+- Tối đa LLM_MAX_IN_FLIGHT request đang chạy trong cả process (tính tới khi đọc xong body).
+- Retry khi gặp 429 / 5xx / lỗi kết nối, backoff mũ có jitter, tôn trọng header Retry-After.
+- Single-flight: các request không-stream giống hệt nhau đang chạy đồng thời chỉ gửi một lần,
+  mọi caller nhận cùng một response.
+Số liệu (retry, 429, thời gian chờ, request được gộp…) lấy qua get_rate_limit_stats().
+"""
+
+from __future__ import annotations
+import asyncio
+import email.utils
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+
+import httpx
+
+from config.rag_config import (
+    LLM_RATE_LIMIT_RPS,
+    LLM_RATE_LIMIT_BURST,
+    LLM_MAX_IN_FLIGHT,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_RETRY_AFTER_MAX,
+    LLM_COALESCE_REQUESTS,
+)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Chu kỳ thử lại khi coroutine chờ slot in-flight (slot dùng chung với các thread đồng bộ)
+_ASYNC_POLL_INTERVAL = 0.02
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "throttled": 0,
+    "server_errors": 0,
+    "transport_errors": 0,
+    "failures": 0,
+    "coalesced": 0,
+    "rate_limit_waits": 0,
+    "rate_limit_wait_time": 0.0,
+    "in_flight_waits": 0,
+    "backoff_time": 0.0,
+}
+
+
+def _count(name: str, amount: float = 1) -> None:
+    with _stats_lock:
+        _stats[name] += amount
+
+
+class _TokenBucket:
+    """Token bucket thread-safe; reserve() trả về số giây caller phải chờ trước khi gửi."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Cho phép âm: các caller sau xếp hàng phía sau token đã đặt trước
+            self.tokens -= 1.0
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _InFlightLimiter:
+    """Giới hạn số request đang chạy, dùng chung giữa thread đồng bộ và coroutine."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def _full(self) -> bool:
+        return bool(self.limit) and self.active >= self.limit
+
+    def _take(self) -> None:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self._full():
+                return False
+            self._take()
+            return True
+
+    def acquire(self) -> None:
+        with self._cond:
+            if self._full():
+                _count("in_flight_waits")
+            while self._full():
+                self._cond.wait()
+            self._take()
+
+    async def aacquire(self) -> None:
+        if self.try_acquire():
+            return
+        _count("in_flight_waits")
+        while not self.try_acquire():
+            await asyncio.sleep(_ASYNC_POLL_INTERVAL)
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+_bucket = _TokenBucket(LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST)
+_limiter = _InFlightLimiter(LLM_MAX_IN_FLIGHT)
+
+
+def _rate_limit_delay() -> float:
+    delay = _bucket.reserve()
+    if delay > 0:
+        _count("rate_limit_waits")
+        _count("rate_limit_wait_time", delay)
+    return delay
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Giá trị header Retry-After (giây hoặc HTTP-date) → số giây, None nếu không có."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff với full jitter."""
+    return random.uniform(0.0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float | None:
+    """Số giây chờ trước khi gửi lại, hoặc None nếu trả response cho caller."""
+    if response.status_code not in RETRY_STATUSES:
+        return None
+    _count("throttled" if response.status_code == 429 else "server_errors")
+    if attempt >= LLM_MAX_RETRIES:
+        _count("failures")
+        return None
+    retry_after = _retry_after(response)
+    if retry_after is None:
+        return _backoff(attempt)
+    if retry_after > LLM_RETRY_AFTER_MAX:
+        _count("failures")
+        return None
+    # Thêm jitter nhỏ để các caller cùng bị 429 không gửi lại cùng lúc
+    return retry_after + random.uniform(0.0, LLM_BACKOFF_BASE)
+
+
+def _transport_error_delay(attempt: int) -> float | None:
+    _count("transport_errors")
+    if attempt >= LLM_MAX_RETRIES:
+        _count("failures")
+        return None
+    return _backoff(attempt)
+
+
+def _coalesce_key(request: httpx.Request) -> str | None:
+    """Khoá single-flight cho request JSON không-stream; None nếu không được gộp."""
+    if not LLM_COALESCE_REQUESTS or request.method != "POST":
+        return None
+    try:
+        body = request.content
+        if json.loads(body).get("stream"):
+            return None
+    except (httpx.RequestNotRead, ValueError, AttributeError):
+        return None
+    digest = hashlib.sha256()
+    for part in (request.method, str(request.url), request.headers.get("authorization", "")):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Body của response; trả slot in-flight khi đóng (đọc xong hoặc bị huỷ)."""
+
+    def __init__(self, stream: httpx.SyncByteStream):
+        self._stream = stream
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                _limiter.release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self._stream = stream
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                _limiter.release()
+
+
+def _copy_response(payload: tuple[int, httpx.Headers, bytes], request: httpx.Request) -> httpx.Response:
+    status_code, headers, content = payload
+    return httpx.Response(status_code, headers=headers, content=content, request=request)
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Transport đồng bộ (httpx.Client, OpenAI client cho embedding)."""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+        self._flights: dict[str, Future] = {}
+        self._flights_lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = _coalesce_key(request)
+        if key is None:
+            return self._send(request)
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            _count("coalesced")
+            return _copy_response(flight.result(), request)
+
+        try:
+            response = self._send(request)
+            try:
+                # Body thô (chưa giải nén): client của từng caller tự decode như bình thường
+                payload = (response.status_code, response.headers, b"".join(response.iter_raw()))
+            finally:
+                response.close()
+            flight.set_result(payload)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+        return _copy_response(payload, request)
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            delay = _rate_limit_delay()
+            if delay > 0:
+                time.sleep(delay)
+            _limiter.acquire()
+            _count("requests")
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError:
+                _limiter.release()
+                delay = _transport_error_delay(attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                _limiter.release()
+                raise
+            else:
+                response = httpx.Response(
+                    response.status_code,
+                    headers=response.headers,
+                    stream=_ReleasingStream(response.stream),
+                    extensions=response.extensions,
+                    request=request,
+                )
+                delay = _retry_delay(response, attempt)
+                if delay is None:
+                    return response
+                response.close()
+
+            _count("retries")
+            _count("backoff_time", delay)
+            print(f"|-- OpenRouter retry {attempt + 1}/{LLM_MAX_RETRIES} sau {delay:.2f}s", flush=True)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """Transport async (httpx.AsyncClient của LangChain ainvoke / astream)."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self._flights: dict[str, asyncio.Task] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = _coalesce_key(request)
+        if key is None:
+            return await self._send(request)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            _count("coalesced")
+        else:
+            # Request chạy trong task riêng: caller nào bị huỷ (deadline) cũng không huỷ request chung
+            flight = self._flights[key] = asyncio.create_task(self._fetch(request))
+            flight.add_done_callback(lambda task: self._finish(key, task))
+        return _copy_response(await asyncio.shield(flight), request)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            # Đánh dấu exception đã đọc khi mọi caller đã huỷ, tránh cảnh báo của asyncio
+            task.exception()
+
+    async def _fetch(self, request: httpx.Request) -> tuple[int, httpx.Headers, bytes]:
+        response = await self._send(request)
+        try:
+            return response.status_code, response.headers, b"".join([c async for c in response.aiter_raw()])
+        finally:
+            await response.aclose()
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            delay = _rate_limit_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await _limiter.aacquire()
+            _count("requests")
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError:
+                _limiter.release()
+                delay = _transport_error_delay(attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                _limiter.release()
+                raise
+            else:
+                response = httpx.Response(
+                    response.status_code,
+                    headers=response.headers,
+                    stream=_AsyncReleasingStream(response.stream),
+                    extensions=response.extensions,
+                    request=request,
+                )
+                delay = _retry_delay(response, attempt)
+                if delay is None:
+                    return response
+                await response.aclose()
+
+            _count("retries")
+            _count("backoff_time", delay)
+            print(f"|-- OpenRouter retry {attempt + 1}/{LLM_MAX_RETRIES} sau {delay:.2f}s", flush=True)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def get_rate_limit_stats() -> dict[str, Any]:
+    """Số request, retry, 429, lỗi, request được gộp, thời gian chờ rate limit / backoff, in-flight."""
+    with _stats_lock:
+        stats = dict(_stats)
+    with _limiter._cond:
+        stats["in_flight"] = _limiter.active
+        stats["peak_in_flight"] = _limiter.peak
+    stats["max_in_flight"] = LLM_MAX_IN_FLIGHT
+    stats["rate_limit_rps"] = LLM_RATE_LIMIT_RPS
+    return stats
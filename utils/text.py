@@ -0,0 +1,27 @@
+"""
+utils/text.py – Tiện ích xử lý văn bản tiếng Việt (bỏ dấu, tách âm tiết, hư từ)
+"""
+
+from __future__ import annotations
+import re
+import unicodedata
+
+# Hư từ / từ hỏi phổ biến: bỏ khỏi truy vấn full-text để không ghép cụm vô nghĩa
+VI_STOPWORDS = {
+    "là", "gì", "thế", "nào", "như", "bị", "có", "không", "được", "của", "và",
+    "các", "những", "cho", "về", "theo", "bao", "nhiêu", "ra", "sao", "khi",
+    "thì", "mà", "với", "trong", "này", "đó", "để", "hay", "hoặc", "ai", "tôi",
+    "mình", "em", "anh", "chị", "ạ", "nhé", "vậy", "đâu", "quy", "định",
+}
+
+
+def fold_vietnamese(text: str) -> str:
+    """Bỏ dấu tiếng Việt, chữ thường, gộp khoảng trắng (dùng để so khớp tên văn bản)."""
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.lower().split())
+
+
+def syllables(text: str) -> list[str]:
+    """Tách văn bản thành các âm tiết (chữ thường, bỏ dấu câu)."""
+    return re.findall(r"[^\W_]+", text.lower())
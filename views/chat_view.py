@@ -3,7 +3,7 @@ views/chat_view.py – Giao diện chat giống ChatGPT dùng st.chat_message +
 """
 
 import streamlit as st
-from controllers.chat_controller import ask_law_question
+from controllers.chat_controller import stream_law_question
 
 
 def render_chat_main() -> None:
@@ -18,10 +18,8 @@ def render_chat_main() -> None:
             st.markdown(msg["content"])
 
             # �️ Hiển thị tổng thời gian xử lý (Nếu có)
-            if role == "assistant" and msg.get("timings"):
-                t_total = msg["timings"].get("total")
-                if t_total:
-                    st.caption(f"⚡ Tổng thời gian xử lý: {t_total:.2f}s")
+            if role == "assistant":
+                _render_meta(msg)
 
             # �🚀 Hiển thị Expanded Query (Nếu có)
             if role == "assistant" and msg.get("search_query"):
@@ -31,6 +29,12 @@ def render_chat_main() -> None:
                 if t_expand is not None:
                     label += f" ({t_expand:.2f}s)"
                 with st.expander(label, expanded=False):
+                    expansion = msg.get("expansion")
+                    if expansion:
+                        action = f"{expansion['n_variants']} biến thể" if expansion["expand"] else "không mở rộng"
+                        if expansion.get("cached"):
+                            action += " (cache)"
+                        st.caption(f"Chính sách: {expansion['reason']} → {action}")
                     if isinstance(msg["search_query"], list):
                         query_text = "\n".join([f"- {q}" for q in msg["search_query"]])
                         st.info(f"**Các truy vấn đã dùng:**\n{query_text}")
@@ -69,7 +73,10 @@ def render_chat_main() -> None:
                 t_rerank = timings.get("rerank")
                 label = f"📚 Xem {len(msg['citations'])} điều luật tham khảo (sau Rerank)"
                 if t_rerank is not None:
-                    label += f" ({t_rerank:.2f}s)"
+                    label += f" ({t_rerank:.2f}s"
+                    if timings.get("rerank_candidates"):
+                        label += f", chấm {timings['rerank_scored']}/{timings['rerank_candidates']} ứng viên"
+                    label += ")"
                 with st.expander(label):
                     for i, (citation, chunk) in enumerate(
                         zip(msg["citations"], msg.get("chunks", [])), 1
@@ -102,11 +109,15 @@ def _handle_question(question: str) -> None:
     # Thêm tin nhắn user
     st.session_state.messages.append({"role": "user", "content": question})
 
-    # Gọi controller (hiển thị spinner cho bước retrieval)
+    with st.chat_message("user", avatar="🙋"):
+        st.markdown(question)
+
+    # Gọi controller (hiển thị spinner cho bước retrieval, câu trả lời hiện dần từng token)
+    events = stream_law_question(question)
     with st.spinner("Đang tìm kiếm và xử lý dữ liệu..."):
-        result = ask_law_question(question)
+        result = next(events)
 
-    if result.get("error"):
+    if result["type"] == "error":
         st.session_state.messages.append({
             "role":      "assistant",
             "content":   "Đã xảy ra lỗi khi xử lý câu hỏi của bạn.",
@@ -115,16 +126,31 @@ def _handle_question(question: str) -> None:
             "error":     result["error"],
         })
     else:
-        # Hiển thị tin nhắn assistant (Không Streaming)
         with st.chat_message("assistant", avatar="⚖️"):
-            full_answer = result["answer"]
-            st.markdown(full_answer)
+            final: dict = {}
+
+            def answer_tokens():
+                for event in events:
+                    if event["type"] == "token":
+                        yield event["text"]
+                    else:
+                        final.update(event)
+
+            if result.get("answer") is not None:
+                # Không đủ tài liệu: câu trả lời có sẵn, không gọi LLM
+                full_answer = result["answer"]
+                st.markdown(full_answer)
+                for event in events:
+                    final.update(event)
+            else:
+                full_answer = st.write_stream(answer_tokens())
+
+            if final.get("type") == "error":
+                st.error(f"❌ {final['error']}")
+            result["timings"] = final.get("timings", result.get("timings", {}))
 
             # 🛠️ Hiển thị tổng thời gian xử lý
-            if result.get("timings"):
-                t_total = result["timings"].get("total")
-                if t_total:
-                    st.caption(f"⚡ Tổng thời gian xử lý: {t_total:.2f}s")
+            _render_meta(result)
             
             if result.get("search_query"):
                 timings = result.get("timings", {})
@@ -133,6 +159,12 @@ def _handle_question(question: str) -> None:
                 if t_expand is not None:
                     label += f" ({t_expand:.2f}s)"
                 with st.expander(label, expanded=False):
+                    expansion = result.get("expansion")
+                    if expansion:
+                        action = f"{expansion['n_variants']} biến thể" if expansion["expand"] else "không mở rộng"
+                        if expansion.get("cached"):
+                            action += " (cache)"
+                        st.caption(f"Chính sách: {expansion['reason']} → {action}")
                     if isinstance(result["search_query"], list):
                         query_text = "\n".join([f"- {q}" for q in result["search_query"]])
                         st.info(f"**Các truy vấn đã dùng:**\n{query_text}")
@@ -157,7 +189,10 @@ def _handle_question(question: str) -> None:
                 t_rerank = timings.get("rerank")
                 label = f"📚 Xem {len(result['citations'])} điều luật tham khảo (sau Rerank)"
                 if t_rerank is not None:
-                    label += f" ({t_rerank:.2f}s)"
+                    label += f" ({t_rerank:.2f}s"
+                    if timings.get("rerank_candidates"):
+                        label += f", chấm {timings['rerank_scored']}/{timings['rerank_candidates']} ứng viên"
+                    label += ")"
                 with st.expander(label):
                     for i, (citation, chunk) in enumerate(zip(result["citations"], result.get("chunks", [])), 1):
                         rerank_score = chunk.get("rerank_score", 0)
@@ -171,6 +206,38 @@ def _handle_question(question: str) -> None:
             "chunks":       result.get("chunks", []),
             "candidates":   result.get("candidates", []),
             "search_query": result.get("search_query"),
+            "expansion":    result.get("expansion"),
+            "cached":       result.get("cached", False),
+            "semantic_match": result.get("semantic_match"),
             "timings":      result.get("timings", {}),
-            "error":        None,
+            "error":        final.get("error"),
         })
+
+
+def _render_meta(meta: dict) -> None:
+    """Dòng caption dưới câu trả lời: thời gian, cache / cache ngữ nghĩa, token đầu tiên, context, rút gọn."""
+    timings = meta.get("timings")
+    if not timings:
+        return
+    t_total = timings.get("total")
+    t_first = timings.get("ttft")
+    if t_total:
+        caption = f"⚡ Tổng thời gian xử lý: {t_total:.2f}s"
+        match = meta.get("semantic_match")
+        if match:
+            caption += (
+                f" · 🔁 Dùng lại câu trả lời của câu hỏi tương tự: “{match['question']}” "
+                f"(khoảng cách {match['distance']:.3f})"
+            )
+        elif meta.get("cached"):
+            caption += " · ♻️ Câu trả lời từ cache"
+        if t_first:
+            caption += f" · Token đầu tiên: {t_first:.2f}s"
+        t_context = timings.get("context_tokens")
+        if t_context:
+            saved = timings.get("context_tokens_saved", 0)
+            caption += f" · Context: {t_context:,} token (tiết kiệm {saved:,})"
+        st.caption(caption)
+    degraded = timings.get("degraded")
+    if degraded:
+        st.caption("⚠️ Rút gọn do quá hạn: " + " · ".join(degraded))
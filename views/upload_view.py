@@ -3,8 +3,13 @@ views/upload_view.py – Giao diện sidebar upload JSON / PDF / DOCX
 """
 
 import streamlit as st
+from models.db import get_pool_stats
 from models.law_model import count_records
+from models.vector_index import index_report
 from controllers.ingest_controller import ingest_law_file
+from services.reranker import get_rerank_cache_stats, get_reranker_worker_stats
+from services.answer_cache import get_answer_cache_stats
+from services.openrouter_service import get_client_stats
 
 ACCEPTED_TYPES = ["pdf", "docx", "doc"]
 
@@ -18,6 +23,65 @@ def render_upload_sidebar() -> None:
         st.metric(label="📚 Bản ghi trong DB", value=f"{total:,}")
     except Exception as e:
         st.warning(f"⚠️ Không thể kết nối DB: {e}")
+    else:
+        with st.expander("🔌 Connection pool"):
+            stats = get_pool_stats()
+            st.caption(
+                f"Đang dùng: {stats['in_use']}/{stats['max_size']} · "
+                f"Lượt chờ: {stats['waits']} · "
+                f"Chờ TB: {stats['avg_wait_time'] * 1000:.0f} ms · "
+                f"Timeout: {stats['timeouts']}"
+            )
+        with st.expander("🧭 Vector index"):
+            report = index_report()
+            size = f"{report['size_mb']:.1f} MB" if report["size_mb"] is not None else "chưa có"
+            st.caption(f"Loại: {report['method'] or '—'} (cấu hình: {report['configured_method']}) · Kích thước: {size}")
+            if report["last_build"]:
+                last = report["last_build"]
+                st.caption(f"Build gần nhất: {last['build_seconds']:.1f}s · {last['rows']:,} dòng · {last['reason']}")
+        with st.expander("♻️ Answer cache"):
+            answers = get_answer_cache_stats()
+            st.caption(
+                f"Hit ratio: {answers['hit_ratio']:.0%} · Bộ nhớ: {answers['memory_hits']:,} hit · "
+                f"DB: {answers['persistent_hits']:,} hit · Miss: {answers['misses']:,} · "
+                f"Đang giữ: {answers['memory_size']:,}"
+            )
+        with st.expander("🎯 Reranker cache"):
+            cache = get_rerank_cache_stats()
+            st.caption(
+                f"Cặp đã cache: {cache['size']:,}/{cache['maxsize']:,} · "
+                f"Hit ratio: {cache['hit_ratio']:.0%} ({cache['hits']:,} hit / {cache['misses']:,} miss) · "
+                f"Loại bỏ: {cache['evictions']:,}"
+            )
+            try:
+                worker = get_reranker_worker_stats()
+            except Exception as e:
+                st.caption(f"Worker: không truy cập được ({e})")
+            else:
+                if worker is None:
+                    st.caption("Worker: chưa khởi tạo (chưa có câu hỏi nào).")
+                else:
+                    st.caption(
+                        f"Worker ({worker['mode']}): hàng đợi {worker['queue_depth']} · "
+                        f"{worker['batches']:,} batch · TB {worker['avg_batch_pairs']:.1f} cặp "
+                        f"/ {worker['avg_batch_requests']:.1f} yêu cầu mỗi batch · lớn nhất {worker['max_batch_pairs']} · "
+                        f"bỏ do quá hạn {worker.get('abandoned', 0):,}"
+                    )
+
+        with st.expander("🚦 OpenRouter"):
+            client = get_client_stats()
+            st.caption(
+                f"Request: {client['requests']:,} · Đang chạy: {client['in_flight']}/{client['max_in_flight']} "
+                f"(cao nhất {client['peak_in_flight']}) · Gộp: {client['coalesced']:,}"
+            )
+            st.caption(
+                f"Retry: {client['retries']:,} · 429: {client['throttled']:,} · 5xx: {client['server_errors']:,} · "
+                f"Lỗi kết nối: {client['transport_errors']:,} · Thất bại: {client['failures']:,}"
+            )
+            st.caption(
+                f"Chờ rate limit: {client['rate_limit_waits']:,} lần ({client['rate_limit_wait_time']:.1f}s) · "
+                f"Backoff: {client['backoff_time']:.1f}s · Chờ slot: {client['in_flight_waits']:,}"
+            )
 
     st.markdown("---")
     st.subheader("📥 Import Văn Bản Luật")